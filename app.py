@@ -1,724 +1,3342 @@
-import streamlit as st
-from PIL import Image
-import google.generativeai as genai
-import datetime
-import time
-import io
-import json
-import os
-import requests
-import base64
-from urllib.parse import quote
-
-# ==========================================
-# 📦 KÜTÜPHANE KONTROLLERİ
-# ==========================================
-try:
-    from streamlit_paste_button import paste_image_button
-    PASTE_ENABLED = True
-except ImportError:
-    PASTE_ENABLED = False
-
-try:
-    import feedparser
-    NEWS_ENABLED = True
-except ImportError:
-    NEWS_ENABLED = False
-
-# Firebase Kontrolü
-try:
-    import firebase_admin
-    from firebase_admin import credentials, db
-    FIREBASE_ENABLED = True
-except ImportError:
-    FIREBASE_ENABLED = False
-
-# ==========================================
-# 🔐 AYARLAR VE FIREBASE BAĞLANTISI
-# ==========================================
-CONFIG_FILE = "site_config.json"
-FIREBASE_DB_URL = 'https://borsakopru-default-rtdb.firebaseio.com/' 
-
-def init_firebase():
-    """Firebase bağlantısını başlatır (Singleton)"""
-    if not FIREBASE_ENABLED: return False
-    try:
-        if not firebase_admin._apps:
-            if "firebase" in st.secrets:
-                key_dict = json.loads(st.secrets["firebase"]["json_content"])
-                cred = credentials.Certificate(key_dict)
-            elif os.path.exists("firebase_key.json"):
-                cred = credentials.Certificate("firebase_key.json")
-            else:
-                return False
-            firebase_admin.initialize_app(cred, {'databaseURL': FIREBASE_DB_URL})
-        return True
-    except Exception as e:
-        st.error(f"Firebase Hatası: {e}")
-        return False
-
-firebase_ready = init_firebase()
-
-def load_global_config():
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, "r") as f: return json.load(f)
-        except: return {"beta_active": True}
-    return {"beta_active": True}
-
-def save_global_config(config):
-    with open(CONFIG_FILE, "w") as f: json.dump(config, f)
-
-global_config = load_global_config()
-
-
-# ==========================================
-# 🎯 MERKEZİ FONKSİYON TANIMLARI
-# ==========================================
-
-def get_model(key):
-    """API key ile kullanılabilecek modeli bulur"""
-    try:
-        genai.configure(api_key=key)
-        models = [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
-        for m in models:
-            if "gemini-2.5-flash" in m: return m
-        return models[0] if models else None
-    except: return None
-
-def compress_image(image):
-    """Görseli ASLA küçültmez. Piksel kaybını önler."""
-    if image.mode in ("RGBA", "P"): 
-        image = image.convert("RGB")
-    return image
-
-def fetch_stock_news(symbol):
-    """Google News RSS (Son 24 Saat)"""
-    if not NEWS_ENABLED: return "Haber modülü aktif değil."
-    try:
-        query = f"{symbol} Borsa KAP when:1d"
-        rss_url = f"https://news.google.com/rss/search?q={quote(query)}&hl=tr&gl=TR&ceid=TR:tr"
-        feed = feedparser.parse(rss_url)
-        news_list = []
-        for entry in feed.entries[:5]: 
-            published = entry.published_parsed
-            date_str = time.strftime("%d.%m.%Y %H:%M", published) if published else "Tarih Yok"
-            news_list.append(f"- {entry.title} ({date_str})")
-        if not news_list: return "Son 24 saatte önemli haber yok."
-        return "\n".join(news_list)
-    except Exception as e:
-        return f"Haber çekme hatası: {str(e)}"
-
-def fetch_data_via_bridge(symbol, data_type):
-    """Firebase üzerinden PC'deki bridge.py ile konuşur"""
-    if not firebase_ready:
-        st.error("Veritabanı bağlantısı yok.")
-        return None
-
-    status_area = st.empty()
-    try:
-        status_area.info(f"📡 {symbol} için {data_type} isteniyor... PC'ye bağlanılıyor.")
-        ref_req = db.reference('bridge/request')
-        ref_req.set({
-            'symbol': symbol,
-            'type': data_type,
-            'status': 'pending',
-            'timestamp': time.time()
-        })
-        
-        progress_bar = st.progress(0)
-        for i in range(25):
-            time.sleep(1)
-            progress_bar.progress((i + 1) / 25)
-            status_data = ref_req.get()
-            status = status_data.get('status') if status_data else None
-            
-            if status == 'processing':
-                status_area.warning("⏳ Robot emri aldı, Telegram'dan yanıt bekleniyor...")
-            elif status == 'completed':
-                status_area.success("✅ Veri Alındı!")
-                progress_bar.empty()
-                ref_res = db.reference('bridge/response')
-                data = ref_res.get()
-                if data and 'image_base64' in data:
-                    img_bytes = base64.b64decode(data['image_base64'])
-                    return Image.open(io.BytesIO(img_bytes))
-                break
-            elif status == 'timeout':
-                status_area.error("❌ Zaman aşımı. Hedef bot cevap vermedi.")
-                break
-        else:
-            status_area.error("❌ Yanıt yok. PC'deki 'bridge.py' çalışıyor mu?")
-    except Exception as e:
-        status_area.error(f"Hata: {e}")
-    return None
-
-
-
-# ==========================================
-# --- SESSION INIT ---
-# ==========================================
-if "authenticated" not in st.session_state: st.session_state.authenticated = False
-if "is_admin" not in st.session_state: st.session_state.is_admin = False
-if "reset_counter" not in st.session_state: st.session_state.reset_counter = 0
-if "analysis_result" not in st.session_state: st.session_state.analysis_result = None
-if "messages" not in st.session_state: st.session_state.messages = []
-if "loaded_count" not in st.session_state: st.session_state.loaded_count = 0
-if "active_working_key" not in st.session_state: st.session_state.active_working_key = None
-if "key_status" not in st.session_state: st.session_state.key_status = {}
-
-if "api_depth_data" not in st.session_state: st.session_state.api_depth_data = None
-if "api_akd_data" not in st.session_state: st.session_state.api_akd_data = None
-if "tg_img_derinlik" not in st.session_state: st.session_state.tg_img_derinlik = None
-if "tg_img_akd" not in st.session_state: st.session_state.tg_img_akd = None
-if "tg_img_kademe" not in st.session_state: st.session_state.tg_img_kademe = None
-if "tg_img_takas" not in st.session_state: st.session_state.tg_img_takas = None
-
-# API KEY INIT
-if "api_keys" not in st.session_state:
-    api_keys_raw = st.secrets.get("GOOGLE_API_KEY", "")
-    st.session_state.api_keys = [k.strip() for k in api_keys_raw.split(",") if k.strip()]
-
-for cat in ["Derinlik", "AKD", "Kademe", "Takas"]:
-    if f"pasted_{cat}" not in st.session_state: 
-        st.session_state[f"pasted_{cat}"] = []
-
-api_keys = st.session_state.api_keys 
-
-# --- AUTH LOGIC ---
-query_params = st.query_params
-admin_secret = st.secrets.get("ADMIN_KEY", "admin123") 
-
-if query_params.get("admin") == admin_secret:
-    st.session_state.authenticated = True
-    st.session_state.is_admin = True
-
-def check_password():
-    if "APP_PASSWORD" in st.secrets:
-        correct_password = st.secrets["APP_PASSWORD"]
-    else:
-        st.error("🚨 Secrets Hatası.")
-        st.stop()
-
-    input_pass = st.session_state.get("password_input", "")
-    if input_pass == admin_secret:
-        st.session_state.authenticated = True
-        st.session_state.is_admin = True
-        return
-    if input_pass == correct_password:
-        if global_config["beta_active"]:
-            st.session_state.authenticated = True
-            st.session_state.is_admin = False
-        else:
-            st.error("🔒 Beta kapalı.")
-    elif input_pass:
-        st.error("❌ Hatalı Kod!")
-
-# --- LOGIN SCREEN ---
-if not st.session_state.authenticated:
-    col1, col2, col3 = st.columns([1, 2, 1])
-    with col2:
-        st.markdown("<div style='border: 2px solid #00d4ff; padding: 40px; border-radius: 15px; background-color: #1E2130; text-align: center; margin-top: 50px;'>", unsafe_allow_html=True)
-        st.title("🔒 Beta Erişim")
-        if global_config["beta_active"]:
-            st.text_input("Giriş Kodu:", type="password", key="password_input", on_change=check_password)
-            if st.button("Giriş Yap"): check_password()
-        else:
-            st.warning("⚠️ BAKIMDA")
-            with st.expander("Yönetici"):
-                st.text_input("Admin:", type="password", key="password_input", on_change=check_password)
-                if st.button("Yönetici Gir"): check_password()
-        st.markdown("</div>", unsafe_allow_html=True)
-    st.stop() 
-
-# ==========================================
-# 🚀 MAIN APP
-# ==========================================
-
-col_title, col_reset = st.columns([5, 1])
-with col_title:
-    st.title("🐋 BIST Yapay Zeka PRO")
-    if st.session_state.is_admin: st.success("👑 YÖNETİCİ MODU")
-    else: st.info("Küçük Yatırımcının Büyüdüğü Bir Evren..")
-
-with col_reset:
-    st.markdown("<br>", unsafe_allow_html=True)
-    if st.button("🔄 SİSTEMİ SIFIRLA", type="secondary"):
-        st.session_state.reset_counter += 1
-        st.session_state.api_depth_data = None
-        st.session_state.api_akd_data = None
-        st.session_state.tg_img_derinlik = None
-        st.session_state.tg_img_akd = None
-        st.session_state.tg_img_kademe = None
-        st.session_state.tg_img_takas = None
-        
-        keys_to_keep = ["authenticated", "is_admin", "reset_counter", "api_depth_data", "api_akd_data", "tg_img_derinlik", "tg_img_akd", "tg_img_kademe", "tg_img_takas", "key_status", "api_keys"]
-        for key in list(st.session_state.keys()):
-            if key not in keys_to_keep: del st.session_state[key]
-        for cat in ["Derinlik", "AKD", "Kademe", "Takas"]:
-            st.session_state[f"pasted_{cat}"] = []
-        st.rerun()
-
-# --- API & DATA FETCH SECTION ---
-st.markdown("---")
-st.subheader("📡 Veri Merkezi")
-
-api_col1, api_col2 = st.columns([3, 1])
-with api_col1:
-    api_ticker_input = st.text_input("Hisse Kodu:", "THYAO", key="api_ticker").upper()
-with api_col2:
-    st.markdown("<br>", unsafe_allow_html=True)
-    fetch_btn = st.button("Derinlik - AKD Verilerini AL", type="primary")
-
-if fetch_btn:
-    try:
-        today_str = datetime.date.today().strftime("%Y-%m-%d")
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        with st.spinner(f"{api_ticker_input} Verileri Çekiliyor..."):
-            url_depth = f"https://webapi.hisseplus.com/api/v1/derinlik?sembol={api_ticker_input}"
-            r_depth = requests.get(url_depth, headers=headers)
-            st.session_state.api_depth_data = r_depth.json() if r_depth.status_code == 200 else None
-            url_akd = f"https://webapi.hisseplus.com/api/v1/akd?sembol={api_ticker_input}&ilk={today_str}&son={today_str}"
-            r_akd = requests.get(url_akd, headers=headers)
-            st.session_state.api_akd_data = r_akd.json() if r_akd.status_code == 200 else None
-    except Exception as e:
-        st.error(f"API Hatası: {e}")
-
-# --- DATA STATUS ---
-if st.session_state.api_depth_data or st.session_state.api_akd_data:
-    st.markdown("##### 📊 Veri Durumu")
-    stat_col1, stat_col2 = st.columns(2)
-    with stat_col1:
-        if st.session_state.api_depth_data: st.success("API DERİNLİK 🟢")
-        else: st.error("API DERİNLİK 🔴")
-    with stat_col2:
-        if st.session_state.api_akd_data: st.success("API AKD 🟢")
-        else: st.error("API AKD 🔴")
-
-valid_model_name = None
-working_key = None
-for k in api_keys:
-    mod = get_model(k)
-    if mod: 
-        valid_model_name = mod
-        working_key = k 
-        break
-
-if not valid_model_name:
-    st.error("❌ Aktif Model Bulunamadı. Lütfen API anahtarlarınızı kontrol edin.")
-    if not st.session_state.is_admin: st.stop()
-
-# --- UPLOAD SECTION ---
-file_key_suffix = str(st.session_state.reset_counter)
-
-def handle_paste(cat):
-    if PASTE_ENABLED:
-        res = paste_image_button(
-            label=f"📋 Yapıştır", 
-            background_color="#1E2130", hover_background_color="#333",
-            key=f"paste_{cat}_{file_key_suffix}"
-        )
-        if res.image_data is not None:
-            if not st.session_state[f"pasted_{cat}"] or st.session_state[f"pasted_{cat}"][-1] != res.image_data:
-                st.session_state[f"pasted_{cat}"].append(res.image_data)
-
-def show_images(cat):
-    if st.session_state[f"pasted_{cat}"]:
-        st.markdown(f"**📋 Pano ({len(st.session_state[f'pasted_{cat}'])}):**")
-        cols = st.columns(3)
-        for i, img in enumerate(st.session_state[f"pasted_{cat}"]):
-            with cols[i % 3]:
-                st.image(img, use_container_width=True)
-                if st.button("🗑️ Sil", key=f"del_{cat}_{i}_{st.session_state.reset_counter}"):
-                    st.session_state[f"pasted_{cat}"].pop(i) 
-                    st.rerun() 
-        if st.button(f"🗑️ Tüm {cat} Görsellerini Temizle", key=f"clear_all_{cat}"):
-            st.session_state[f"pasted_{cat}"] = []
-            st.rerun()
-
-def render_category_panel(title, cat_name, tg_session_key, uploader_key):
-    st.markdown(f"### {title}")
-    if st.session_state[tg_session_key]:
-        with st.container(border=True):
-            st.caption("📲 Telegram'dan Alındı")
-            st.image(st.session_state[tg_session_key], width=100, caption="TG Verisi") 
-            if st.button("🗑️ Kaldır", key=f"del_tg_{cat_name}"):
-                st.session_state[tg_session_key] = None
-                st.rerun()
-    uploaded_files = st.file_uploader("Dosya Yükle", type=["jpg","png","jpeg"], key=uploader_key, accept_multiple_files=True)
-    handle_paste(cat_name) 
-    show_images(cat_name)  
-    return uploaded_files
-
-col1, col2 = st.columns(2)
-with col1:
-    img_d = render_category_panel("1. Derinlik 💹", "Derinlik", "tg_img_derinlik", f"d_{file_key_suffix}")
-    st.markdown("---") 
-    img_k = render_category_panel("3. Kademe 📊", "Kademe", "tg_img_kademe", f"k_{file_key_suffix}")
-with col2:
-    img_a = render_category_panel("2. AKD 🤵", "AKD", "tg_img_akd", f"a_{file_key_suffix}")
-    st.markdown("---") 
-    img_t = render_category_panel("4. Takas 🌍", "Takas", "tg_img_takas", f"t_{file_key_suffix}")
-
-# --- SIDEBAR ---
-def add_api_key():
-    new_key = st.session_state.new_api_key_input.strip()
-    if new_key and new_key not in st.session_state.api_keys:
-        st.session_state.api_keys.append(new_key)
-        st.session_state.new_api_key_input = ""
-        st.rerun()
-
-def delete_api_key(key_to_delete):
-    if key_to_delete in st.session_state.api_keys:
-        st.session_state.api_keys.remove(key_to_delete)
-        if key_to_delete in st.session_state.key_status:
-            del st.session_state.key_status[key_to_delete]
-        st.rerun()
-
-with st.sidebar:
-    if st.session_state.is_admin:
-        st.subheader("⚙️ Yönetici Kontrol Paneli")
-        curr = global_config["beta_active"]
-        new_s = st.toggle("Beta Açık", value=curr)
-        if new_s != curr:
-            global_config["beta_active"] = new_s
-            save_global_config(global_config)
-            st.rerun()
-
-        with st.expander("🔑 API Anahtar Havuzu Yönetimi", expanded=True):
-            st.markdown(f"<span style='font-size: small;'>Aktif Key Sayısı: {len(api_keys)}</span>", unsafe_allow_html=True)
-            st.text_input("Yeni Key Ekle:", type="password", key="new_api_key_input")
-            if st.button("➕ Anahtarı Ekle", on_click=add_api_key, use_container_width=True): pass
-            st.markdown("---")
-            for k in api_keys:
-                cols = st.columns([1, 3, 2])
-                key_display = f"<span style='font-size: x-small; font-weight: bold;'>...{k[-4:]}</span>"
-                if k in st.session_state.key_status:
-                    s = st.session_state.key_status[k]
-                    lite_status = s.get('lite', '❓')
-                    flash_status = s.get('flash', '❓')
-                    status_text = f"<span style='font-size: xx-small;'>Lite: {lite_status} | Flash: {flash_status}</span>"
-                else:
-                    status_text = "<span style='font-size: x-small;' class='key-status-limit'>❓ TEST ET</span>"
-                with cols[0]:
-                    if st.button("❌", key=f"del_key_{k[-4:]}_v4", on_click=delete_api_key, args=(k,)): pass
-                with cols[1]: st.markdown(key_display, unsafe_allow_html=True)
-                with cols[2]: st.markdown(status_text, unsafe_allow_html=True)
-            st.markdown("---")
-            if st.button("🔄 Kota Testi", use_container_width=True, key="admin_key_test"):
-                st.session_state.key_status = {}
-                prog = st.progress(0)
-                test_prompt = "Hello" 
-                def test_model_quota(api_key, model_name):
-                    try:
-                        genai.configure(api_key=api_key)
-                        model = genai.GenerativeModel(model_name)
-                        model.generate_content(test_prompt)
-                        return "✅ OK"
-                    except Exception as e:
-                        error_str = str(e).lower()
-                        if "429" in error_str or "quota" in error_str: return "<span class='key-status-limit'>⚠️ KOTA</span>"
-                        elif "model" in error_str: return "<span class='key-status-fail'>❌ MODEL YOK</span>"
-                        else: return "<span class='key-status-fail'>❌ HATA</span>"
-                for i, k in enumerate(api_keys):
-                    key_results = {}
-                    key_results['lite'] = test_model_quota(k, 'gemini-2.5-flash-lite')
-                    key_results['flash'] = test_model_quota(k, 'gemini-2.5-flash')
-                    st.session_state.key_status[k] = key_results
-                    prog.progress((i+1)/len(api_keys))
-                    time.sleep(0.5)
-                prog.empty()
-                st.rerun()
-        st.markdown("---")
-
-    st.header("📲 Telegram Köprüsü")
-    tg_ticker = st.text_input("Hisse Kodu (TG):", api_ticker_input, key="tg_ticker_final").upper() 
-    col_t1, col_t2 = st.columns(2)
-    with col_t1:
-        if st.button("📉 Derinlik", key="tg_dr"): st.session_state.tg_img_derinlik = fetch_data_via_bridge(tg_ticker, "derinlik")
-    with col_t2:
-        if st.button("🏦 AKD", key="tg_akd"): st.session_state.tg_img_akd = fetch_data_via_bridge(tg_ticker, "akd")
-    col_t3, col_t4 = st.columns(2)
-    with col_t3:
-        if st.button("📊 Kademe", key="tg_kdm"): st.session_state.tg_img_kademe = fetch_data_via_bridge(tg_ticker, "kademe")
-    with col_t4:
-        if st.button("🌍 Takas", key="tg_tks"): st.session_state.tg_img_takas = fetch_data_via_bridge(tg_ticker, "takas")
-
-    st.markdown("---")
-    if st.button("🚪 Çıkış Yap", key="logout_btn"):
-        st.session_state.authenticated = False
-        st.rerun()
-
-    st.markdown("---")
-    st.header("𝕏 Tarayıcı")
-    raw_ticker = st.text_input("Kod:", api_ticker_input, key="x_ticker_input").upper()
-    clean_ticker = raw_ticker.replace("#", "").strip()
-    search_mode = st.radio("Tip:", ("🔥 Geçmiş", "⏱️ Canlı"), key="x_search_mode")
-    if search_mode == "🔥 Geçmiş":
-        s_date = st.date_input("Tarih", datetime.date.today(), key="x_date_input")
-        url = f"https://x.com/search?q={quote(f'#{clean_ticker} lang:tr until:{s_date + datetime.timedelta(days=1)} since:{s_date} min_faves:5')}&src=typed_query&f=top"
-        btn_txt = f"🔥 <b>{s_date}</b> Popüler"
-    else:
-        url = f"https://x.com/search?q={quote(f'#{clean_ticker} lang:tr')}&src=typed_query&f=live"
-        btn_txt = f"⏱️ Son Dakika"
-    st.markdown(f"""<a href="{url}" target="_blank" class="x-btn">{btn_txt}</a>""", unsafe_allow_html=True)
-
-# --- ANALYZE ---
-st.markdown("---")
-c1, c2 = st.columns([1, 1])
-MODEL_OPTIONS = {"gemini-2.5-flash": "🚀 Flash", "gemini-2.5-flash-lite": "⚡ Lite"}
-
-with c2:
-    st.markdown("##### 🛠️ Analiz Ayarları")
-    use_lite_model = st.checkbox("⚡ Lite Modeli Kullan (Daha Hızlı)", key="use_lite_model_checkbox", value=False)
-    analysis_mode = st.radio(
-        "Analiz Modu Seçiniz:",
-        options=["⚡ SADE MOD (Öz ve Net)", "🛡️ DESTEK-DİRENÇ MODU (Özel Strateji)", "🧠 GELİŞMİŞ MOD (Ultra Detay - 50 Madde)"],
-        index=0
-    )
-    if "GELİŞMİŞ" in analysis_mode:
-        max_items = st.slider("Gelişmiş Mod Madde Sayısı", 10, 50, 20)
-
-with c1:
-    st.markdown("<br>", unsafe_allow_html=True)
-    if st.button("🐋 ANALİZİ BAŞLAT", type="primary", use_container_width=True):
-        if not api_keys:
-            st.error("❌ API Anahtar Havuzu Boş!")
-            st.stop()
-            
-        input_data = []
-        context_str = ""
-        if st.session_state.api_depth_data:
-            context_str += f"\n\n--- CANLI DERİNLİK API VERİSİ ---\n{json.dumps(st.session_state.api_depth_data, indent=2, ensure_ascii=False)}"
-        if st.session_state.api_akd_data:
-            context_str += f"\n\n--- CANLI AKD API VERİSİ ---\n{json.dumps(st.session_state.api_akd_data, indent=2, ensure_ascii=False)}"
-
-        if NEWS_ENABLED:
-            with st.spinner("Haberler taranıyor..."):
-                news_text = fetch_stock_news(api_ticker_input)
-                context_str += f"\n\n--- HABERLER ({api_ticker_input}) ---\n{news_text}"
-
-        def add_imgs(fl, pl, tg_img):
-            added = False
-            if fl: [input_data.append(compress_image(Image.open(f))) for f in fl]; added=True
-            if pl: [input_data.append(compress_image(i)) for i in pl]; added=True
-            if tg_img: input_data.append(compress_image(tg_img)); added=True
-            return added
-
-        has_d = add_imgs(img_d, st.session_state["pasted_Derinlik"], st.session_state.tg_img_derinlik)
-        has_a = add_imgs(img_a, st.session_state["pasted_AKD"], st.session_state.tg_img_akd)
-        has_k = add_imgs(img_k, st.session_state["pasted_Kademe"], st.session_state.tg_img_kademe)
-        has_t = add_imgs(img_t, st.session_state["pasted_Takas"], st.session_state.tg_img_takas)
-        
-        is_depth_avail = has_d or st.session_state.api_depth_data
-        is_akd_avail = has_a or st.session_state.api_akd_data
-        is_kademe_avail = has_k
-        is_takas_avail = has_t
-        
-        base_role = f"""
-        Sen Borsa Uzmanısın ve Kıdemli Veri Analistisin.
-        GÖREV: SADECE sana sağlanan görselleri ve verileri kullanarak analiz yap.
-        🚨 Hisse kodunu görselden veya veriden tespit et.
-        --- MEVCUT VERİ SETİ ---
-        {context_str}
-        --- ⚠️ KRİTİK KURALLAR ---
-        1. 🚫 **YASAK:** Elimizde verisi olmayan başlıkları rapora ekleme.
-        2. 🚫 **YASAK:** Giriş cümlesi yazma. Direkt analize başla.
-        3. 🎨 **RENK:** :green[**OLUMLU**], :blue[**NÖTR**], :red[**OLUMSUZ**] cümlelerin yanına ekle.
-        4. 🚫 **YASAK:** Listeyi doldurmak için aynı satırı tekrarlama. Sadece gördüğün kadarını yaz.
-        5. ⚠️ **DİKKAT:** Tablodaki "Fiyat" (TL) ve "Lot/Adet" (Volume) sütunlarını karıştırma. Genellikle "Lot" sütunu daha büyük tam sayılar içerir.
-        6. 🧠 **MANTIK VE FİYAT KONTROLÜ (ÇOK ÖNEMLİ):**
-           - Önce görseldeki **ANLIK FİYATI** (Current Price) tespit et.
-           - **KURAL 1:** Anlık fiyattan **YÜKSEK** olan emirler **SATIŞ (DİRENÇ)** emirleridir. (Asla bunlara 'Alış' deme!)
-           - **KURAL 2:** Anlık fiyattan **DÜŞÜK** olan emirler **ALIŞ (DESTEK)** emirleridir.
-           - ÖRNEK: Fiyat 22.58 ise, 22.90'daki yığılma **SATIŞ (DİRENÇ)** olur. 22.10'daki yığılma **ALIŞ (DESTEK)** olur. Bunu karıştırma!
-        """
-        
-        destek_direnc_prompt_sade = """
-        ## 🛡️ GÜÇLÜ/ZAYIF DESTEK VE DİRENÇ ANALİZİ
-        (GÖREV: SADECE VERİDE GÖRDÜĞÜN, "BALİNA GİRİŞİ" OLAN ÖNEMLİ SEVİYELERİ YAZ.)
-        (DİKKAT: 15 adet yazmak zorunda DEĞİLSİN. Eğer sadece 3 tane varsa, 3 tane yaz.)
-        (EĞER bir seviyede AŞIRI YÜKSEK LOT (Balina) varsa yanına "🔥 :green[**ÇOK GÜÇLÜ ALIM**]" veya "🔥 :red[**ÇOK GÜÇLÜ SATIM**]" yaz. Yoksa sadece fiyatı bırak.)
-        (Hatırlatma: Güncel fiyattan YÜKSEK olanlar SATIŞ/DİRENÇ, DÜŞÜK olanlar ALIŞ/DESTEK'tir.)
-        (FORMAT: **[FİYAT]**: [NEDENİ - Lot miktarı vs.] [VARSA GÜÇ İBARESİ])
-        """
-        
-        guc_siralama_prompt = """
-        ## 🏅 GÜÇ VE ÖNEM SIRALAMASI
-        (Bulduğun seviyeleri, ÖNEM sırasına göre diz. En çok lot olandan en aza doğru.)
-        (Sadece tespit edebildiğin kadarını yaz, listeyi zorlama.)
-        * **DESTEKLER (Güçlüden Zayıfa):** [Fiyat] ...
-        * **DİRENÇLER (Güçlüden Zayıfa):** [Fiyat] ...
-        """
-
-        if "SADE" in analysis_mode:
-            req_sections = ""
-            if is_depth_avail: req_sections += """\n## 💹 DERİNLİK ANALİZİ (EN AZ 5 MADDE)\n"""
-            if is_akd_avail: req_sections += """\n## 🤵 AKD ANALİZİ (EN AZ 5 MADDE)\n"""
-            if is_kademe_avail: req_sections += """\n## 📊 KADEME ANALİZİ (EN AZ 5 MADDE)\n"""
-            if is_takas_avail: req_sections += """\n## 🌍 TAKAS ANALİZİ (EN AZ 5 MADDE)\n"""
-
-            prompt = base_role + f"""
-            --- ⚡ SADE MOD ---
-            {req_sections}
-            {destek_direnc_prompt_sade}
-            ## 🐋 GENEL SENTEZ
-            ## 7. 🧭 YÖN / FİYAT OLASILIĞI
-            ## 8. 💯 SKOR KARTI
-            ## 9. 🚀 İŞLEM PLANI
-            """
-        elif "DESTEK" in analysis_mode:
-            prompt = base_role + f"""
-            --- 🛡️ DESTEK-DİRENÇ VE SEVİYE ANALİZİ MODU ---
-            GÖREV: Bu modda SADECE kritik fiyat seviyelerine odaklan.
-            
-            ## 🧱 KRİTİK DESTEK BÖLGELERİ (Mevcut Olanlar)
-            (Hatırlatma: Güncel fiyattan DÜŞÜK olanlar DESTEKTİR.)
-            1. **[FİYAT]**: [NEDENİ]
-            ... (Sadece olan kadar yaz)
-
-            ## 🚧 KRİTİK DİRENÇ BÖLGELERİ (Mevcut Olanlar)
-            (Hatırlatma: Güncel fiyattan YÜKSEK olanlar DİRENÇTİR.)
-            1. **[FİYAT]**: [NEDENİ]
-            ... (Sadece olan kadar yaz)
-
-            {guc_siralama_prompt}
-            
-            ## ⚖️ KİLİT RAKAM (PİVOT)
-            ## 📉 GAP (BOŞLUK) ANALİZİ
-            ## 🚀 ALIM-SATIM STRATEJİSİ
-            """
-        else:
-            limit_txt = f"(DİKKAT: SADECE VERİDE OLANLARI YAZ, UYDURMA.)"
-            main_headers = ""
-            if is_depth_avail: main_headers += f"## 📸 DERİNLİK ANALİZİ {limit_txt}\n"
-            if is_akd_avail: main_headers += f"## 🏦 AKD ANALİZİ {limit_txt}\n"
-            if is_kademe_avail: main_headers += f"## 📊 KADEME ANALİZİ {limit_txt}\n"
-            if is_takas_avail: main_headers += f"## 🌍 TAKAS ANALİZİ {limit_txt}\n"
-
-            prompt = base_role + f"""
-            --- 🧠 GELİŞMİŞ MOD ---
-            {main_headers}
-            {destek_direnc_prompt_sade}
-            --- 🕵️‍♂️ MİKRO-YAPISAL ANALİZ (50 MADDE KONTROLÜ) ---
-            (Mevcut listeden sadece cevabı olanları yaz)
-            --- FİNAL ---
-            ## 🐋 GENEL SENTEZ
-            ## 🧭 YÖN / FİYAT OLASILIĞI
-            ## 💯 SKOR KARTI
-            ## 🚀 İŞLEM PLANI
-            """
-
-        input_data.append(prompt)
-        
-        count = 0
-        if has_d: count += 1
-        if has_a: count += 1
-        if has_k: count += 1
-        if has_t: count += 1
-        
-        if count == 0 and not context_str:
-            st.warning("⚠️ Lütfen analiz için veri yükleyin.")
-        else:
-            if st.session_state.get("use_lite_model_checkbox"):
-                primary_model = "gemini-2.5-flash-lite"
-                model_priority = ["gemini-2.5-flash-lite", "gemini-2.5-flash"]
-            else:
-                primary_model = "gemini-2.5-flash"
-                model_priority = ["gemini-2.5-flash", "gemini-2.5-flash-lite"] 
-            
-            placeholder = st.empty()
-            full_response = ""
-            
-            with st.spinner(f"Analiz ({MODEL_OPTIONS.get(primary_model, primary_model)}) ile Başlatılıyor..."):
-                stream_active = False
-                local_keys = api_keys.copy()
-                if working_key and working_key in local_keys:
-                    local_keys.remove(working_key)
-                    local_keys.insert(0, working_key)
-                    
-                for k in local_keys:
-                    for model_name in model_priority:
-                        try:
-                            genai.configure(api_key=k)
-                            model = genai.GenerativeModel(model_name)
-                            stream = model.generate_content(input_data, stream=True)
-                            st.session_state.active_working_key = k
-                            working_key = k
-                            stream_active = True
-                            
-                            for chunk in stream:
-                                if chunk.text:
-                                    full_response += chunk.text
-                                    placeholder.markdown(full_response + "▌") 
-                            
-                            placeholder.markdown(full_response)
-                            st.session_state.analysis_result = full_response
-                            st.session_state.loaded_count = count
-                            time.sleep(1)
-                            break 
-                        except Exception as e:
-                            error_str = str(e).lower()
-                            if "429" in error_str or "quota" in error_str: 
-                                if model_name == model_priority[-1]: st.warning(f"⚠️ Anahtar `...{k[-4:]}` dolu.")
-                                continue
-                            elif "expired" in error_str or "invalid" in error_str:
-                                if model_name == model_priority[-1]: st.warning(f"⚠️ Anahtar `...{k[-4:]}` geçersiz.")
-                                continue
-                            else: 
-                                st.error(f"Hata: {e}"); break
-                    if stream_active: break
-                if not stream_active: st.error("Tüm kotalar dolu.")
-
-if st.session_state.analysis_result:
-    st.markdown("## 🐋 Kurumsal Rapor")
-    st.markdown(st.session_state.analysis_result)
-    st.markdown("---")
-    st.subheader("💬 Analist ile Sohbet")
-    
-    col_c1, col_c2 = st.columns([1, 4])
-    with col_c1:
-        st.markdown("**Mod:**")
-        chat_scope = st.radio("M", ("📝 RAPOR", "🌍 GENEL"), label_visibility="collapsed")
-
-    for m in st.session_state.messages:
-        with st.chat_message(m["role"]): st.markdown(m["content"])
-
-    if q := st.chat_input("Soru sor..."):
-        st.session_state.messages.append({"role": "user", "content": q})
-        with st.chat_message("user"): st.markdown(q)
-
-        with st.chat_message("assistant"):
-            local_keys = api_keys.copy()
-            if st.session_state.active_working_key and st.session_state.active_working_key in local_keys:
-                local_keys.remove(st.session_state.active_working_key)
-                local_keys.insert(0, st.session_state.active_working_key)
-            
-            key_found = False
-            full_resp = ""
-            for k in local_keys:
-                try:
-                    sys_inst = ("GÖREV: Sadece rapora sadık kal." if chat_scope == "📝 RAPOR" else "GÖREV: Raporu temel al ama genel borsa bilginle yorum kat.")
-                    final_prompt = f"{sys_inst}\n\nRAPOR:\n{st.session_state.analysis_result}\n\nSORU:\n{q}"
-                    genai.configure(api_key=k)
-                    model = genai.GenerativeModel(valid_model_name)
-                    stream = model.generate_content(final_prompt, stream=True)
-                    st.session_state.active_working_key = k 
-                    key_found = True
-                    def parser():
-                        for ch in stream:
-                            if ch.text: yield ch.text
-                    resp = st.write_stream(parser)
-                    full_resp = resp
-                    time.sleep(1)
-                    break 
-                except Exception as e:
-                    error_str = str(e).lower()
-                    if "429" in error_str or "quota" in error_str: continue 
-                    else: break 
-            
-            if key_found: st.session_state.messages.append({"role": "assistant", "content": full_resp})
-            else: st.error("❌ Sohbet Hatası")
-
-
-
+import streamlit as st
+from PIL import Image, ImageChops, ImageStat
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+import datetime
+import time
+import io
+import math
+import json
+import re
+import os
+import sqlite3
+import requests
+import pandas as pd
+import numpy as np
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import base64
+import hashlib
+import calendar
+import threading
+import queue
+import copy
+import uuid
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from urllib.parse import quote
+
+# ==========================================
+# 📦 KÜTÜPHANE KONTROLLERİ
+# ==========================================
+try:
+    from streamlit_paste_button import paste_image_button
+    PASTE_ENABLED = True
+except ImportError:
+    PASTE_ENABLED = False
+
+try:
+    import feedparser
+    NEWS_ENABLED = True
+except ImportError:
+    NEWS_ENABLED = False
+
+# Firebase Kontrolü
+try:
+    import firebase_admin
+    from firebase_admin import credentials, db
+    FIREBASE_ENABLED = True
+    try:
+        from firebase_admin import storage
+    except ImportError:
+        storage = None
+except ImportError:
+    FIREBASE_ENABLED = False
+
+# ==========================================
+# 🔐 AYARLAR VE FIREBASE BAĞLANTISI
+# ==========================================
+CONFIG_FILE = "site_config.json"
+FIREBASE_DB_URL = 'https://borsakopru-default-rtdb.firebaseio.com/' 
+FIREBASE_STORAGE_BUCKET = os.environ.get("FIREBASE_STORAGE_BUCKET", "")
+
+def init_firebase():
+    """Firebase bağlantısını başlatır (Singleton)"""
+    if not FIREBASE_ENABLED: return False
+    try:
+        if not firebase_admin._apps:
+            if "firebase" in st.secrets:
+                key_dict = json.loads(st.secrets["firebase"]["json_content"])
+                cred = credentials.Certificate(key_dict)
+            elif os.path.exists("firebase_key.json"):
+                cred = credentials.Certificate("firebase_key.json")
+            else:
+                return False
+            options = {'databaseURL': FIREBASE_DB_URL}
+            if FIREBASE_STORAGE_BUCKET: options['storageBucket'] = FIREBASE_STORAGE_BUCKET
+            firebase_admin.initialize_app(cred, options)
+        return True
+    except Exception as e:
+        st.error(f"Firebase Hatası: {e}")
+        return False
+
+firebase_ready = init_firebase()
+
+def load_global_config():
+    if os.path.exists(CONFIG_FILE):
+        try:
+            with open(CONFIG_FILE, "r") as f: return json.load(f)
+        except: return {"beta_active": True}
+    return {"beta_active": True}
+
+def save_global_config(config):
+    with open(CONFIG_FILE, "w") as f: json.dump(config, f)
+
+global_config = load_global_config()
+
+
+# ==========================================
+# 🎯 MERKEZİ FONKSİYON TANIMLARI
+# ==========================================
+
+# --- İzleme (tracing) ---
+TRACE_JSONL = os.environ.get("TRACE_JSONL")   # Verilirse her span bu dosyaya JSON satırı olarak eklenir
+TRACE_BUFFER_SIZE = 5000
+
+@st.cache_resource
+def _trace_buffer():
+    """Son span'ler (tüm oturumlar, halka tampon)"""
+    return {"lock": threading.Lock(), "spans": deque(maxlen=TRACE_BUFFER_SIZE)}
+
+def record_span(name, duration_s, **attrs):
+    span = {"name": name, "ts": time.time(), "ms": round(duration_s * 1000, 2), **attrs}
+    buf = _trace_buffer()
+    with buf["lock"]:
+        buf["spans"].append(span)
+        if TRACE_JSONL:
+            with open(TRACE_JSONL, "a", encoding="utf-8") as f: f.write(json.dumps(span, ensure_ascii=False, default=str) + "\n")
+
+@contextmanager
+def trace_span(name, **attrs):
+    """Süre + öznitelik kaydı. Çağıran, dönen sözlüğe öznitelik ekleyebilir (bayt, token, key...)."""
+    start = time.perf_counter()
+    span_attrs = dict(attrs)
+    try: yield span_attrs
+    except Exception as e:
+        span_attrs["error"] = type(e).__name__
+        raise
+    finally:
+        record_span(name, time.perf_counter() - start, **span_attrs)
+
+def trace_summary():
+    """Span adına göre adet, p50, p95 (ms)"""
+    with _trace_buffer()["lock"]: spans = list(_trace_buffer()["spans"])
+    if not spans: return pd.DataFrame()
+    df = pd.DataFrame(spans)
+    g = df.groupby("name")["ms"]
+    return pd.DataFrame({"adet": g.count(), "p50_ms": g.quantile(0.5).round(1), "p95_ms": g.quantile(0.95).round(1)}).sort_values("p95_ms", ascending=False)
+
+def prometheus_text():
+    """Prometheus metin formatında özet (quantile + count + sum, saniye)"""
+    with _trace_buffer()["lock"]: spans = list(_trace_buffer()["spans"])
+    lines = ["# HELP bist_span_seconds Span durations", "# TYPE bist_span_seconds summary"]
+    if spans:
+        df = pd.DataFrame(spans)
+        for name, ms in df.groupby("name")["ms"]:
+            sec = ms / 1000
+            for q in (0.5, 0.95):
+                lines.append(f'bist_span_seconds{{span="{name}",quantile="{q}"}} {sec.quantile(q):.6f}')
+            lines.append(f'bist_span_seconds_count{{span="{name}"}} {len(sec)}')
+            lines.append(f'bist_span_seconds_sum{{span="{name}"}} {sec.sum():.6f}')
+    return "\n".join(lines) + "\n"
+
+MODEL_CACHE_TTL = 1800      # Bulunan model bu kadar saniye geçerli
+MODEL_CACHE_NEG_TTL = 120   # Hatalı/dolu key bu kadar saniye tekrar denenmez
+
+@st.cache_resource
+def _genai_lock():
+    """genai.configure global olduğu için key değişimlerini sıraya sokar (tüm oturumlar)"""
+    return threading.Lock()
+
+@st.cache_resource
+def _model_cache():
+    """Key parmak izi -> (model_adı, zaman). Tüm oturumlar arasında paylaşılır."""
+    return {"lock": threading.Lock(), "entries": {}}
+
+def key_fingerprint(key):
+    """API key'i açık saklamamak için kısa SHA-256 parmak izi"""
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+def _discover_model(key):
+    """Ağ çağrısı: key ile kullanılabilecek modeli listeden bulur"""
+    try:
+        with _genai_lock():
+            genai.configure(api_key=key)
+            models = [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
+        for m in models:
+            if "gemini-2.5-flash" in m: return m
+        return models[0] if models else None
+    except: return None
+
+def get_model(key):
+    """API key ile kullanılabilecek modeli bulur (paylaşılan önbellekten, TTL ile)"""
+    cache = _model_cache()
+    fp = key_fingerprint(key)
+    now = time.time()
+    with cache["lock"]:
+        hit = cache["entries"].get(fp)
+    if hit:
+        model_name, ts = hit
+        ttl = MODEL_CACHE_TTL if model_name else MODEL_CACHE_NEG_TTL
+        if now - ts < ttl: return model_name
+    with trace_span("model_keşfi", key=fp):
+        model_name = _discover_model(key)
+    with cache["lock"]:
+        cache["entries"][fp] = (model_name, time.time())
+    return model_name
+
+def invalidate_model(key):
+    """429 / geçersiz key hatasında kaydı siler; sonraki get_model yeniden keşfeder.
+    Kota beklemesi anahtar sağlığı zamanlayıcısında tutulur (list_models kota dolunca da çalışır)."""
+    cache = _model_cache()
+    with cache["lock"]:
+        cache["entries"].pop(key_fingerprint(key), None)
+
+# ==========================================
+# 🔑 ANAHTAR SAĞLIĞI VE ZAMANLAYICI
+# ==========================================
+KEY_COOLDOWN_QUOTA = 60        # 429 sonrası key/model çifti bekleme süresi (sn)
+KEY_COOLDOWN_INVALID = 3600    # Geçersiz/süresi dolmuş key bekleme süresi (sn)
+HEALTH_EWMA_ALPHA = 0.3
+DEFAULT_FIRST_CHUNK_LATENCY = 5.0
+
+class KeyUnavailable(Exception):
+    """Key/model çifti kota veya geçersizlik yüzünden kullanılamıyor"""
+    def __init__(self, kind, message):
+        super().__init__(message)
+        self.kind = kind  # "quota" | "invalid"
+
+def classify_key_error(error):
+    """Hata mesajından key kaynaklı hata türünü çıkarır (None = key ile ilgisiz)"""
+    error_str = str(error).lower()
+    if "429" in error_str or "quota" in error_str: return "quota"
+    if "expired" in error_str or "invalid" in error_str: return "invalid"
+    return None
+
+@st.cache_resource
+def _key_health():
+    """(key parmak izi, model) -> sağlık kaydı. Tüm oturumlar arasında paylaşılır."""
+    return {"lock": threading.Lock(), "pairs": {}}
+
+def _health_entry(store, key, model_name):
+    return store["pairs"].setdefault((key_fingerprint(key), model_name), {
+        "last_429": None, "cooldown_until": 0.0,
+        "success_rate": 1.0, "latency": None, "calls": 0,
+        "probe_status": None, "probe_ts": None,
+    })
+
+def record_key_result(key, model_name, ok, latency=None, error_kind=None):
+    """Bir çağrının sonucunu sağlık kaydına işler (EWMA)"""
+    store = _key_health()
+    now = time.time()
+    with store["lock"]:
+        h = _health_entry(store, key, model_name)
+        h["calls"] += 1
+        h["success_rate"] += HEALTH_EWMA_ALPHA * ((1.0 if ok else 0.0) - h["success_rate"])
+        if ok:
+            h["cooldown_until"] = 0.0
+            if latency is not None:
+                h["latency"] = latency if h["latency"] is None else h["latency"] + HEALTH_EWMA_ALPHA * (latency - h["latency"])
+        elif error_kind == "quota":
+            h["last_429"] = now
+            h["cooldown_until"] = now + KEY_COOLDOWN_QUOTA
+        elif error_kind == "invalid":
+            h["cooldown_until"] = now + KEY_COOLDOWN_INVALID
+
+def key_health_snapshot(key, model_name):
+    store = _key_health()
+    with store["lock"]:
+        return dict(_health_entry(store, key, model_name))
+
+def schedule_candidates(keys, model_priority, preferred_key=None):
+    """Key/model çiftlerini sağlığa göre sıralar: soğumada olmayanlar, tercih edilen key, model önceliği, skor.
+    preferred_key yükü key'lere dağıtmak içindir; soğumada değilse çiftleri her zaman önce gelir."""
+    now = time.time()
+    store = _key_health()
+    ranked = []
+    with store["lock"]:
+        for k in keys:
+            for rank, model_name in enumerate(model_priority):
+                h = _health_entry(store, k, model_name)
+                cooling = h["cooldown_until"] > now
+                latency = h["latency"] if h["latency"] is not None else DEFAULT_FIRST_CHUNK_LATENCY
+                score = h["success_rate"] - latency / 30.0
+                ranked.append(((cooling, h["cooldown_until"] if cooling else 0.0, k != preferred_key, rank, -score), (k, model_name)))
+    ranked.sort(key=lambda x: x[0])
+    return [pair for _, pair in ranked]
+
+def bound_model(key, model_name):
+    """Key'e bağlı model döndürür. genai.configure global olduğundan istemci kilit altında
+    modele bağlanır; sonraki çağrılar kilitsiz ve eşzamanlı yapılabilir."""
+    with _genai_lock():
+        genai.configure(api_key=key)
+        model = genai.GenerativeModel(model_name)
+        model._client = genai_client.get_default_generative_client()
+    return model
+
+def _iter_stream(stream):
+    """Akışı gezer; kapatılınca alttaki gRPC çağrısını da iptal eder (kota yakmaya devam etmesin)"""
+    try: yield from stream
+    finally:
+        for obj in (getattr(stream, "_iterator", None), stream):
+            cancel = getattr(obj, "cancel", None) or getattr(obj, "close", None)
+            if callable(cancel):
+                try: cancel()
+                except Exception: pass
+
+def _discard_stream(future):
+    """Yarışı kaybeden adayın akışını, ilk parçası geldiği anda kapatır"""
+    try: future.result()[2].close()
+    except Exception: pass
+
+def _open_stream(key, model_name, contents, model=None):
+    """Akışı açar ve ilk parçayı bekler; sonucu sağlık kaydına işler"""
+    t0 = time.time()
+    try:
+        stream = (model or bound_model(key, model_name)).generate_content(contents, stream=True)
+        it = _iter_stream(stream)
+        first = next(it, None)
+    except Exception as e:
+        kind = classify_key_error(e)
+        record_key_result(key, model_name, False, error_kind=kind)
+        if kind: raise KeyUnavailable(kind, str(e)) from e
+        raise
+    record_key_result(key, model_name, True, latency=time.time() - t0)
+    return key, model_name, it, first
+
+def open_first_stream(batch, contents, prebound=None):
+    """Gruptaki adayları aynı anda başlatır, ilk parçayı ilk getireni döndürür.
+    Hepsi key kaynaklı düşerse KeyUnavailable, aksi halde ilk genel hata fırlatılır."""
+    prebound = prebound or {}
+    if len(batch) == 1:
+        return _open_stream(batch[0][0], batch[0][1], contents, prebound.pop(batch[0], None))
+    pool = ThreadPoolExecutor(max_workers=len(batch))
+    futures = [pool.submit(_open_stream, k, m, contents, prebound.pop((k, m), None)) for k, m in batch]
+    pending, errors = set(futures), []
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                try: winner = f.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                for other in futures:
+                    if other is not f: other.add_done_callback(_discard_stream)
+                return winner
+    finally:
+        pool.shutdown(wait=False)
+    generic = [e for e in errors if not isinstance(e, KeyUnavailable)]
+    if generic: raise generic[0]
+    raise errors[0]
+
+def prepare_candidates(keys, model_priority, preferred_key=None, prebind=2):
+    """Aday sırasını çıkarır ve ilk birkaç adayın istemcisini önceden bağlar"""
+    candidates = schedule_candidates(keys, model_priority, preferred_key)
+    prebound = {}
+    for pair in candidates[:prebind]:
+        try: prebound[pair] = bound_model(*pair)
+        except Exception: pass
+    return candidates, prebound
+
+def generate_with_pool(keys, model_priority, contents, preferred_key=None, **kwargs):
+    """Akışsız tek çağrı: sağlıklı adaydan başlayarak dener, yanıt metnini döndürür"""
+    last_error = None
+    for k, model_name in schedule_candidates(keys, model_priority, preferred_key):
+        t0 = time.time()
+        try:
+            response = bound_model(k, model_name).generate_content(contents, **kwargs)
+            text = response.text
+            record_key_result(k, model_name, True, latency=time.time() - t0)
+            return text
+        except Exception as e:
+            kind = classify_key_error(e)
+            record_key_result(k, model_name, False, error_kind=kind)
+            if kind:
+                last_error = e
+                continue
+            raise
+    raise KeyUnavailable("quota", str(last_error) if last_error else "Kullanılabilir anahtar yok")
+
+# ==========================================
+# 🩺 ANAHTAR SAĞLIK TESTİ (eşzamanlı + periyodik)
+# ==========================================
+PROBE_MODELS = {"lite": "gemini-2.5-flash-lite", "flash": "gemini-2.5-flash"}
+KEY_PROBE_WORKERS = 4
+KEY_PROBE_INTERVAL = 600       # Arka plan testi aralığı (sn)
+PROBE_LABELS = {
+    "ok": "✅ OK",
+    "quota": "<span class='key-status-limit'>⚠️ KOTA</span>",
+    "model": "<span class='key-status-fail'>❌ MODEL YOK</span>",
+    "invalid": "<span class='key-status-fail'>❌ GEÇERSİZ</span>",
+    "error": "<span class='key-status-fail'>❌ HATA</span>",
+}
+
+def record_probe(key, model_name, status, full=False):
+    """Test sonucunu ortak sağlık kaydına zaman damgasıyla işler"""
+    store = _key_health()
+    now = time.time()
+    with store["lock"]:
+        h = _health_entry(store, key, model_name)
+        h["probe_status"], h["probe_ts"] = status, now
+        if status == "quota":
+            h["last_429"] = now
+            h["cooldown_until"] = now + KEY_COOLDOWN_QUOTA
+        elif status == "invalid":
+            h["cooldown_until"] = now + KEY_COOLDOWN_INVALID
+        elif status == "ok" and full:
+            h["cooldown_until"] = 0.0
+
+def probe_key(key, model_name, full=False):
+    """Hafif test: count_tokens (üretim kotası harcamaz). Tam test: 1 token üretim."""
+    try:
+        model = bound_model(key, model_name)
+        if full: model.generate_content("Hello", generation_config={"max_output_tokens": 1})
+        else: model.count_tokens("Hello")
+        status = "ok"
+    except Exception as e:
+        status = classify_key_error(e) or ("model" if "model" in str(e).lower() else "error")
+    record_probe(key, model_name, status, full)
+    return status
+
+def run_health_check(keys, full=False, on_progress=None):
+    """Tüm key × model çiftlerini sınırlı havuzda test eder: {key: {"lite": durum, "flash": durum}}"""
+    results = {k: {} for k in keys}
+    jobs = [(k, label, m) for k in keys for label, m in PROBE_MODELS.items()]
+    with ThreadPoolExecutor(max_workers=KEY_PROBE_WORKERS) as pool:
+        futures = {pool.submit(probe_key, k, m, full): (k, label) for k, label, m in jobs}
+        for i, f in enumerate(as_completed(futures)):
+            k, label = futures[f]
+            results[k][label] = f.result()
+            if on_progress: on_progress((i + 1) / len(jobs))
+    return results
+
+def key_status_label(key, label):
+    """Kenar çubuğu için: canlı 429 soğuması testten yeniyse KOTA gösterilir"""
+    h = key_health_snapshot(key, PROBE_MODELS[label])
+    if h["cooldown_until"] > time.time() and h["last_429"] and h["last_429"] >= (h["probe_ts"] or 0):
+        return PROBE_LABELS["quota"]
+    return PROBE_LABELS.get(h["probe_status"], "❓")
+
+class KeyHealthChecker:
+    """Süreç başına tek: oturumların güncel key'lerini periyodik hafif testten geçirir"""
+    def __init__(self):
+        self.keys = {}                # oturum -> ({key}, son kayıt)
+        self.lock = threading.Lock()
+        self.last_run = None
+        threading.Thread(target=self._loop, name="key-health", daemon=True).start()
+    def register(self, owner, keys):
+        """Oturumun key kümesini değiştirir; silinen key bir sonraki turda test edilmez"""
+        with self.lock: self.keys[owner] = (set(keys), time.time())
+    def active_keys(self):
+        """Boşta kalmamış oturumların key birleşimi"""
+        cutoff = time.time() - SESSION_IDLE_TTL
+        with self.lock:
+            self.keys = {o: v for o, v in self.keys.items() if v[1] >= cutoff}
+            return sorted(set().union(*(ks for ks, _ in self.keys.values())))
+    def _loop(self):
+        while True:
+            time.sleep(KEY_PROBE_INTERVAL)
+            keys = self.active_keys()
+            if keys:
+                try: run_health_check(keys)
+                except Exception: pass
+                self.last_run = time.time()
+
+@st.cache_resource
+def get_key_health_checker():
+    return KeyHealthChecker()
+
+# ==========================================
+# 🕰️ BIST SEANS SAATLERİ
+# ==========================================
+BIST_TZ = datetime.timezone(datetime.timedelta(hours=3))
+BIST_OPEN = datetime.time(9, 55)    # Açılış seansı
+BIST_CLOSE = datetime.time(18, 10)  # Kapanış seansı sonu
+
+def bist_now():
+    return datetime.datetime.now(BIST_TZ)
+
+def is_market_open(now=None):
+    now = now or bist_now()
+    return now.weekday() < 5 and BIST_OPEN <= now.time() < BIST_CLOSE
+
+def next_market_open(now=None):
+    """Bir sonraki seans açılışı (hafta içi; resmi tatiller dikkate alınmaz)"""
+    now = now or bist_now()
+    day = now.date()
+    if now.time() >= BIST_OPEN or now.weekday() >= 5: day += datetime.timedelta(days=1)
+    while day.weekday() >= 5: day += datetime.timedelta(days=1)
+    return datetime.datetime.combine(day, BIST_OPEN, tzinfo=BIST_TZ)
+
+# ==========================================
+# 🌐 PİYASA VERİSİ ÇEKME KATMANI (hisseplus)
+# ==========================================
+HISSEPLUS_BASE_URL = os.environ.get("HISSEPLUS_BASE_URL", "https://webapi.hisseplus.com/api/v1")
+HTTP_TIMEOUT = (3.05, 10)      # (bağlantı, okuma) saniye
+MARKET_CACHE_TTL = 60          # Aynı (sembol, uç, gün) isteği bu süre tekrar çekilmez
+
+@st.cache_resource
+def _http_session():
+    """Keep-alive bağlantı havuzlu, yeniden denemeli ortak oturum"""
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset(["GET"]))
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({'User-Agent': 'Mozilla/5.0'})
+    return session
+
+class RateLimiter:
+    """Thread-safe token bucket: saniyede `rate` istek, `burst` kadar anlık"""
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_s = (1 - self._tokens) / self.rate
+            time.sleep(wait_s)
+
+@st.cache_resource
+def _rate_limiters():
+    """Üst kaynaklara giden tüm trafik (kullanıcı + ön yükleme) için ortak sınırlar"""
+    return {"hisseplus": RateLimiter(rate=2.0, burst=4), "news": RateLimiter(rate=0.5, burst=2)}
+
+@st.cache_resource
+def _fetch_pool():
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="hisseplus")
+
+@st.cache_resource
+def _market_cache():
+    """(sembol, uç, gün) -> (zaman, json). Uçuştaki istekler de paylaşılır."""
+    return {"lock": threading.Lock(), "entries": {}, "inflight": {}}
+
+def _endpoint_params(endpoint, symbol, day):
+    if endpoint == "derinlik": return {"sembol": symbol}
+    if endpoint == "akd": return {"sembol": symbol, "ilk": day, "son": day}
+    return {"sembol": symbol}
+
+def _http_get_json(endpoint, params):
+    _rate_limiters()["hisseplus"].acquire()
+    with trace_span("hisseplus", endpoint=endpoint, symbol=params.get("sembol")) as span:
+        r = _http_session().get(f"{HISSEPLUS_BASE_URL}/{endpoint}", params=params, timeout=HTTP_TIMEOUT)
+        retries = getattr(getattr(r.raw, "retries", None), "history", ())
+        span.update(status=r.status_code, bytes=len(r.content), retries=len(retries))
+    return r.json() if r.status_code == 200 else None
+
+def fetch_endpoint(symbol, endpoint, day=None, ttl=MARKET_CACHE_TTL):
+    """Tek bir ucu önbellekten ya da (aynı anda gelen istekleri birleştirerek) ağdan getirir"""
+    day = day or datetime.date.today().strftime("%Y-%m-%d")
+    cache_key = (symbol, endpoint, day)
+    cache = _market_cache()
+    with cache["lock"]:
+        hit = cache["entries"].get(cache_key)
+        if hit and time.time() - hit[0] < ttl: return hit[1]
+        fut = cache["inflight"].get(cache_key)
+        owner = fut is None
+        if owner:
+            fut = Future()
+            cache["inflight"][cache_key] = fut
+    if not owner: return fut.result()
+    try:
+        data = _http_get_json(endpoint, _endpoint_params(endpoint, symbol, day))
+        if data is not None and day == datetime.date.today().strftime("%Y-%m-%d"):
+            try: get_snapshot_store().append(symbol, endpoint, data)
+            except Exception: pass  # Geçmiş kaydı veri akışını bozmamalı
+        with cache["lock"]:
+            now = time.time()
+            if data is not None: cache["entries"][cache_key] = (now, data)
+            for k in [k for k, (ts, _) in cache["entries"].items() if now - ts > max(ttl, MARKET_CACHE_TTL) * 10]:
+                del cache["entries"][k]
+        fut.set_result(data)
+        return data
+    except Exception as e:
+        fut.set_exception(e)
+        raise
+    finally:
+        with cache["lock"]:
+            cache["inflight"].pop(cache_key, None)
+
+def fetch_market_data(symbol, endpoints=("derinlik", "akd"), day=None):
+    """Uçları eşzamanlı çeker. Dönüş: ({uç: json|None}, {uç: hata})"""
+    futures = {ep: _fetch_pool().submit(fetch_endpoint, symbol, ep, day) for ep in endpoints}
+    results, errors = {}, {}
+    for ep, f in futures.items():
+        try: results[ep] = f.result()
+        except Exception as e:
+            results[ep] = None
+            errors[ep] = e
+    return results, errors
+
+# ==========================================
+# 🧾 KOMPAKT PROMPT SERİLEŞTİRME
+# ==========================================
+PROMPT_TOP_N = 25              # Tablo başına en önemli satır sayısı
+PROMPT_BUDGET_TOKENS = 3000    # API verisi bağlamı için tahmini token bütçesi
+_IMPORTANCE_HINTS = ("lot", "adet", "net", "hacim", "miktar", "volume", "tutar")
+
+def estimate_tokens(text):
+    """Kaba token tahmini (~4 karakter / token)"""
+    return (len(text) + 3) // 4
+
+def _compact_value(v):
+    if isinstance(v, float):
+        if v.is_integer(): return int(v)
+        return round(v, 2) if abs(v) >= 1 else float(f"{v:.3g}")
+    return v
+
+def _collect_tables(node, path, tables, meta):
+    """JSON ağacındaki kayıt listelerini tabloya, skalerleri meta satırına toplar"""
+    if isinstance(node, list):
+        records = [r for r in node if isinstance(r, dict)]
+        if records: tables[path or "veri"] = pd.DataFrame(records)
+        else: meta[path or "veri"] = ",".join(str(_compact_value(v)) for v in node[:PROMPT_TOP_N])
+    elif isinstance(node, dict):
+        for k, v in node.items():
+            _collect_tables(v, f"{path}.{k}" if path else str(k), tables, meta)
+    elif node is not None and node != "":
+        meta[path] = _compact_value(node)
+
+def _meta_last(meta):
+    """Meta satırındaki anlık/son fiyat"""
+    return next((_parse_tr_number(v) for k, v in meta.items()
+                 if any(p in _norm_col(k) for p in ("sonfiyat", "last", "guncel", "anlik", "kapanis")) and _parse_tr_number(v)), None)
+
+def _depth_price_cols(df):
+    """Derinlik merdiveninin fiyat sütunları; kurum sütunu olan (AKD benzeri) tablolarda boş"""
+    cols = list(df.columns)
+    if _find_col(cols, ("kurum", "araci", "broker", "uye")): return []
+    return [c for c in cols if any(p in _norm_col(c) for p in _PRICE)]
+
+def _row_importance(df, last=None):
+    """Satır önemi. Derinlik merdiveninde anlık fiyata yakınlık: en yakın kademeler kalır, merdivende delik
+    (modelin GAP sanacağı) açılmaz. Diğer tablolarda lot/net/hacim benzeri sütunların mutlak toplamı, yoksa konum."""
+    price_cols = _depth_price_cols(df)
+    if price_cols:
+        prices = df[price_cols].apply(lambda c: pd.to_numeric(c.map(_parse_tr_number), errors="coerce"))
+        if last is None:
+            bid, ask = _find_col(price_cols, _BID), _find_col(price_cols, _ASK)
+            last = (prices[bid].max() + prices[ask].min()) / 2 if bid and ask else prices.stack().median()
+        dist = (prices - last).abs().min(axis=1)
+        if dist.notna().any(): return -dist.fillna(np.inf)
+    cols = [c for c in df.columns if any(h in str(c).lower() for h in _IMPORTANCE_HINTS)]
+    nums = df[cols].apply(pd.to_numeric, errors="coerce").abs().sum(axis=1) if cols else None
+    if nums is None or not nums.any(): return pd.Series(range(len(df), 0, -1), index=df.index, dtype="float64")
+    return nums
+
+def _render_tables(title, tables, meta):
+    lines = [f"--- {title} ---"]
+    if meta: lines.append(" ".join(f"{k}={v}" for k, v in meta.items()))
+    for name, df in tables.items():
+        lines.append(f"[{name}] ({len(df)} satır)")
+        lines.append(df.to_csv(index=False).strip())
+    return "\n".join(lines)
+
+def compact_payload(payload, title, top_n=PROMPT_TOP_N):
+    """Ham JSON'u sütunlu metne hazırlar: (tablolar, meta). Her tabloda en önemli top_n satır kalır."""
+    tables, meta = {}, {}
+    _collect_tables(payload, "", tables, meta)
+    last = _meta_last(meta)
+    for name, df in tables.items():
+        df = df.dropna(axis=1, how="all").apply(lambda col: col.map(_compact_value))
+        if len(df) > top_n:
+            keep = _row_importance(df, last).nlargest(top_n).index
+            df = df.loc[sorted(keep)]
+        tables[name] = df
+    return tables, meta
+
+def serialize_market_context(sections, budget_tokens=PROMPT_BUDGET_TOKENS, top_n=PROMPT_TOP_N):
+    """sections: [(başlık, json)] -> (metin, {"before": token, "after": token, "dropped": satır})
+    Bütçe aşılırsa en büyük tablodan en önemsiz satırlar atılır."""
+    before = sum(estimate_tokens(json.dumps(p, indent=2, ensure_ascii=False)) for _, p in sections)
+    parts = [(title, *compact_payload(p, title, top_n)) for title, p in sections]
+    render = lambda: "\n\n".join(_render_tables(t, tb, m) for t, tb, m in parts)
+    text = render()
+    dropped = 0
+    while estimate_tokens(text) > budget_tokens:
+        candidates = [(len(df), ti, name) for ti, (_, tb, _) in enumerate(parts) for name, df in tb.items() if len(df) > 1]
+        if not candidates: break
+        _, ti, name = max(candidates)
+        df = parts[ti][1][name]
+        parts[ti][1][name] = df.drop(_row_importance(df, _meta_last(parts[ti][2])).idxmin())
+        dropped += 1
+        text = render()
+    return text, {"before": before, "after": estimate_tokens(text), "dropped": dropped}
+
+# ==========================================
+# 📐 YEREL ANALİTİK (destek/direnç, balina, pivot, gap, kurum yoğunluğu)
+# ==========================================
+WHALE_Z = 3.5                  # Sağlam z-skoru (MAD) eşiği
+GAP_FACTOR = 3.0               # Medyan adımın kaç katı boşluk GAP sayılır
+_TR_CHARS = str.maketrans("ıİşŞçÇğĞüÜöÖ", "iissccgguuoo")
+
+def _norm_col(name):
+    return "".join(ch for ch in str(name).translate(_TR_CHARS).lower() if ch.isalnum())
+
+def _find_col(cols, *groups):
+    """Her gruptan en az bir parçayı içeren ilk sütunu bulur"""
+    for c in cols:
+        n = _norm_col(c)
+        if all(any(p in n for p in g) for g in groups): return c
+    return None
+
+_BID = ("alis", "bid", "buy")
+_ASK = ("satis", "ask", "sell")
+_PRICE = ("fiyat", "price")
+_LOT = ("lot", "adet", "miktar", "hacim", "volume", "qty")
+
+def _num(series, integer=False):
+    return pd.to_numeric(series.map(lambda v: _parse_tr_number(v, integer)), errors="coerce")
+
+def normalize_depth(payload):
+    """Derinlik verisini uzun formata çevirir: DataFrame[price, lot, side], anlık fiyat"""
+    if isinstance(payload, pd.DataFrame): tables, meta = {"tablo": payload}, {}
+    else:
+        tables, meta = {}, {}
+        _collect_tables(payload, "", tables, meta)
+    frames = []
+    for df in tables.values():
+        cols = list(df.columns)
+        bp, bl = _find_col(cols, _BID, _PRICE), _find_col(cols, _BID, _LOT)
+        ap, al = _find_col(cols, _ASK, _PRICE), _find_col(cols, _ASK, _LOT)
+        if bp and bl: frames.append(pd.DataFrame({"price": _num(df[bp]), "lot": _num(df[bl], True), "side": "alış"}))
+        if ap and al: frames.append(pd.DataFrame({"price": _num(df[ap]), "lot": _num(df[al], True), "side": "satış"}))
+        if not frames:
+            p, l = _find_col(cols, _PRICE), _find_col(cols, _LOT)
+            sd = _find_col(cols, ("side", "yon", "taraf", "tip"))
+            if p and l:
+                side = df[sd].map(lambda v: _SIDE_ALIASES.get(str(v).strip().lower())) if sd else None
+                frames.append(pd.DataFrame({"price": _num(df[p]), "lot": _num(df[l], True), "side": side}))
+    book = pd.concat(frames, ignore_index=True).dropna(subset=["price", "lot"]) if frames else pd.DataFrame(columns=["price", "lot", "side"])
+    return book, _meta_last(meta)
+
+def normalize_akd(payload):
+    """AKD verisini DataFrame[broker, buy, sell, net] formatına çevirir"""
+    if isinstance(payload, pd.DataFrame): tables = {"tablo": payload}
+    else:
+        tables, meta = {}, {}
+        _collect_tables(payload, "", tables, meta)
+    for df in tables.values():
+        cols = list(df.columns)
+        broker = _find_col(cols, ("kurum", "araci", "broker", "uye", "name"))
+        buy, sell = _find_col(cols, _BID, _LOT) or _find_col(cols, _BID), _find_col(cols, _ASK, _LOT) or _find_col(cols, _ASK)
+        net = _find_col(cols, ("net",))
+        if not broker or not (net or (buy and sell)): continue
+        out = pd.DataFrame({"broker": df[broker].astype(str)})
+        out["buy"] = _num(df[buy], True) if buy else np.nan
+        out["sell"] = _num(df[sell], True) if sell else np.nan
+        out["net"] = _num(df[net], True) if net else out["buy"].fillna(0) - out["sell"].fillna(0)
+        return out.dropna(subset=["net"]).reset_index(drop=True)
+    return pd.DataFrame(columns=["broker", "buy", "sell", "net"])
+
+def whale_mask(lots, z=WHALE_Z):
+    """Sağlam z-skoru ile aykırı büyük lotlar (vektörel)"""
+    lots = np.asarray(lots, dtype="float64")
+    if lots.size < 3: return np.zeros(lots.size, dtype=bool)
+    med = np.median(lots)
+    mad = np.median(np.abs(lots - med))
+    if mad == 0: return lots > med * 3 if med > 0 else np.zeros(lots.size, dtype=bool)
+    return 0.6745 * (lots - med) / mad > z
+
+def _gaps(prices):
+    p = np.unique(np.asarray(prices, dtype="float64"))
+    if p.size < 3: return []
+    d = np.diff(p)
+    step = np.median(d)
+    idx = np.nonzero(d > GAP_FACTOR * step)[0]
+    return [(float(p[i]), float(p[i + 1])) for i in idx]
+
+def compute_levels(depth_payload=None, akd_payload=None, top_n=10):
+    """Derinlik/AKD'den destek-direnç, balina, pivot, gap ve kurum yoğunluğunu hesaplar"""
+    result = {}
+    if depth_payload is not None:
+        book, last = normalize_depth(depth_payload)
+        if not book.empty:
+            levels = book.groupby("price", sort=True)["lot"].sum()
+            prices, lots = levels.index.to_numpy(dtype="float64"), levels.to_numpy(dtype="float64")
+            if last is None:
+                bids = book.loc[book["side"] == "alış", "price"]
+                asks = book.loc[book["side"] == "satış", "price"]
+                last = float((bids.max() + asks.min()) / 2) if len(bids) and len(asks) else float(np.median(prices))
+            whales = whale_mask(lots)
+            below, above = prices < last, prices > last
+            rank = lambda m: [(float(p), int(l), bool(w)) for p, l, w in sorted(zip(prices[m], lots[m], whales[m]), key=lambda x: -x[1])[:top_n]]
+            total_bid, total_ask = lots[below].sum(), lots[above].sum()
+            result.update({
+                "price": float(last),
+                "supports": rank(below),
+                "resistances": rank(above),
+                "pivot": float(np.average(prices, weights=lots)) if lots.sum() > 0 else None,
+                "key_level": float(prices[np.argmax(lots)]),
+                "gaps": _gaps(prices),
+                "imbalance": float(total_bid / (total_bid + total_ask)) if total_bid + total_ask > 0 else None,
+            })
+    if akd_payload is not None:
+        akd = normalize_akd(akd_payload)
+        if not akd.empty:
+            net = akd["net"].to_numpy(dtype="float64")
+            gross = np.abs(net).sum()
+            order = np.argsort(net)
+            buyers, sellers = order[::-1][:5], order[:5]
+            result.update({
+                "top_buyers": [(akd["broker"].iat[i], int(net[i])) for i in buyers if net[i] > 0],
+                "top_sellers": [(akd["broker"].iat[i], int(net[i])) for i in sellers if net[i] < 0],
+                "buy_concentration": float(net[buyers][net[buyers] > 0].sum() / max(net[net > 0].sum(), 1)),
+                "sell_concentration": float(-net[sellers][net[sellers] < 0].sum() / max(-net[net < 0].sum(), 1)),
+                "hhi": float(((np.abs(net) / gross) ** 2).sum()) if gross > 0 else None,
+                "akd_whales": [akd["broker"].iat[i] for i in np.nonzero(whale_mask(np.abs(net)))[0]],
+            })
+    return result
+
+def benchmark_levels(n_levels=1000, n_brokers=100, runs=50):
+    """Sentetik defter üzerinde compute_levels süresi (ms)"""
+    rng = np.random.default_rng(0)
+    prices = np.round(np.linspace(90, 110, n_levels), 2)
+    depth = {"data": [{"alisFiyat": p, "alisLot": int(l), "satisFiyat": p + 20, "satisLot": int(m)}
+                      for p, l, m in zip(prices, rng.lognormal(8, 1, n_levels), rng.lognormal(8, 1, n_levels))]}
+    akd = {"data": [{"kurum": f"K{i}", "net": int(v)} for i, v in enumerate(rng.normal(0, 1e5, n_brokers))]}
+    t0 = time.perf_counter()
+    for _ in range(runs): compute_levels(depth, akd)
+    return (time.perf_counter() - t0) * 1000 / runs
+
+def render_levels(r):
+    """Hesaplanan seviyeleri prompt için kısa metne çevirir"""
+    if not r: return ""
+    fmt = lambda rows: "; ".join(f"{p:g} ({l}{' 🐋' if w else ''})" for p, l, w in rows) or "-"
+    lines = []
+    if "price" in r:
+        lines += [f"Anlık fiyat: {r['price']:g}",
+                  f"DESTEKLER (lot sıralı): {fmt(r['supports'])}",
+                  f"DİRENÇLER (lot sıralı): {fmt(r['resistances'])}",
+                  f"Pivot (lot ağırlıklı): {r['pivot']:.2f} | Kilit seviye (en çok lot): {r['key_level']:g}" if r.get("pivot") else f"Kilit seviye: {r['key_level']:g}",
+                  f"GAP: {', '.join(f'{a:g}-{b:g}' for a, b in r['gaps']) or 'yok'}"]
+        if r.get("imbalance") is not None: lines.append(f"Alış payı: %{100 * r['imbalance']:.0f}")
+    if "top_buyers" in r:
+        lines += [f"Net alıcılar: {', '.join(f'{b} {n:+,}' for b, n in r['top_buyers']) or '-'}",
+                  f"Net satıcılar: {', '.join(f'{b} {n:+,}' for b, n in r['top_sellers']) or '-'}",
+                  f"İlk 5 yoğunluk: alış %{100 * r['buy_concentration']:.0f}, satış %{100 * r['sell_concentration']:.0f}" + (f", HHI {r['hhi']:.2f}" if r.get("hhi") is not None else "")]
+        if r["akd_whales"]: lines.append(f"AKD balinaları: {', '.join(r['akd_whales'])}")
+    return "\n".join(lines)
+
+# ==========================================
+# 🖼️ GÖRSEL ÖN İŞLEME
+# ==========================================
+PREPROCESS_CONFIG = {
+    "crop": True,            # Kenarlardaki düz renkli boşluğu kırp (tablo bölgesi kalır)
+    "max_side": 2000,        # Uzun kenar üst sınırı (px)
+    "min_scale": 0.5,        # Rakamlar okunur kalsın diye en fazla bu orana küçült
+    "grayscale": False,      # Opsiyonel: alış/satış yeşil-kırmızı rengini siler, yalnızca tek renkli tablolarda aç
+    "palette_colors": 0,     # >0 ise bu kadar renkli palete indir
+    "format": "WEBP",        # "WEBP" (kayıpsız) | "PNG" (optimize)
+}
+# Optimizasyon kapalıyken: piksel kaybı yok, sadece kayıpsız kodlama
+PREPROCESS_LOSSLESS = {"crop": False, "max_side": None, "min_scale": 1.0, "grayscale": False, "palette_colors": 0, "format": "PNG"}
+
+def _autocrop(img, tolerance=12):
+    """Sol üst piksel rengindeki kenar boşluklarını kırpar"""
+    bg = Image.new(img.mode, img.size, img.getpixel((0, 0)))
+    mask = ImageChops.difference(img, bg).convert("L").point(lambda p: 255 if p > tolerance else 0)
+    bbox = mask.getbbox()
+    return img.crop(bbox) if bbox else img
+
+def _prepare_pixels(image, config):
+    img = image if image.mode in ("RGB", "L") else image.convert("RGB")
+    if config.get("crop"): img = _autocrop(img)
+    max_side = config.get("max_side")
+    if max_side and max(img.size) > max_side:
+        scale = max(max_side / max(img.size), config.get("min_scale", 0.5))
+        if scale < 1:
+            img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+    if config.get("grayscale"): img = img.convert("L")
+    if config.get("palette_colors"): img = img.convert("RGB").quantize(colors=config["palette_colors"])
+    return img
+
+def preprocess_image(image, config=PREPROCESS_CONFIG):
+    """Görseli Gemini'ye gidecek kodlanmış blob'a çevirir: {"mime_type", "data"}"""
+    with trace_span("görsel_dönüşüm", pixels_in=image.width * image.height) as span:
+        img = _prepare_pixels(image, config)
+        fmt = config.get("format", "PNG").upper()
+        buf = io.BytesIO()
+        if fmt == "WEBP": img.save(buf, "WEBP", lossless=True, method=4)
+        else: img.save(buf, "PNG", optimize=True)
+        span.update(pixels_out=img.width * img.height, bytes=buf.tell())
+    return {"mime_type": f"image/{fmt.lower()}", "data": buf.getvalue()}
+
+@st.cache_resource
+def _image_pool():
+    # Pillow resize/encode sırasında GIL'i bırakır; script modülü süreç havuzuna taşınamaz
+    return ThreadPoolExecutor(max_workers=max(2, os.cpu_count() or 2), thread_name_prefix="imgprep")
+
+def preprocess_images(images, config=PREPROCESS_CONFIG):
+    """Görselleri paralel işler, sırayı korur"""
+    return list(_image_pool().map(lambda im: preprocess_image(im, config), images))
+
+def benchmark_preprocess(images, config=PREPROCESS_CONFIG):
+    """Önce/sonra bayt, süre ve okunurluk (PSNR, dB) raporu.
+    Okunurluk: işlenmiş görsel orijinal boyuta geri büyütülüp RGB'de karşılaştırılır (renk kaybı da ölçülür)."""
+    rows = []
+    for i, image in enumerate(images):
+        t0 = time.perf_counter()
+        before = preprocess_image(image, PREPROCESS_LOSSLESS)
+        t_before = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        after = preprocess_image(image, config)
+        t_after = time.perf_counter() - t0
+
+        ref = image.convert("RGB")
+        if config.get("crop"): ref = _autocrop(ref)
+        test = Image.open(io.BytesIO(after["data"])).convert("RGB").resize(ref.size, Image.LANCZOS)
+        rms = math.sqrt(sum(r * r for r in ImageStat.Stat(ImageChops.difference(ref, test)).rms) / 3)
+        psnr = float("inf") if rms == 0 else 20 * math.log10(255.0 / rms)
+        rows.append({
+            "görsel": i + 1,
+            "boyut_önce": f"{image.width}x{image.height}",
+            "boyut_sonra": "x".join(map(str, Image.open(io.BytesIO(after["data"])).size)),
+            "bayt_önce": len(before["data"]),
+            "bayt_sonra": len(after["data"]),
+            "oran_%": round(100 * len(after["data"]) / max(1, len(before["data"])), 1),
+            "ms_önce": round(t_before * 1000, 1),
+            "ms_sonra": round(t_after * 1000, 1),
+            "psnr_db": round(psnr, 1),
+        })
+    return rows
+
+IMAGE_STORE_MAX_BYTES = 256 * 1024 * 1024
+IMAGE_STORE_SHARED = os.environ.get("IMAGE_STORE_SHARED", "1") == "1"  # Oturumlar arası ortak depo (tek bellek sınırı)
+IMAGE_PIN_TTL = 900            # Analizdeki görseller bu süre (sn) tahliye edilmez; başka oturumun yüklemesi düşüremez
+
+def image_digest(image):
+    """Piksel içeriğinin hash'i: aynı ekran görüntüsü yükleme/yapıştırma/TG'den gelse de aynı"""
+    img = image if image.mode == "RGB" else image.convert("RGB")
+    h = hashlib.sha256(f"{img.size}".encode())
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+class ImageStore:
+    """İçerik adresli, bellek sınırlı LRU görsel deposu (çözülmüş görsel + ön işlenmiş blob'lar)"""
+    def __init__(self, max_bytes=IMAGE_STORE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items = OrderedDict()   # digest -> {"image", "prepared": {cfg: blob}, "bytes"}
+        self._aliases = {}            # dosya byte hash'i -> piksel digest
+        self._pins = {}               # sahip (oturum) -> ({digest}, bitiş zamanı)
+        self.size = 0
+
+    @staticmethod
+    def _cfg_key(config): return json.dumps(config, sort_keys=True)
+
+    def _evict(self):
+        now = time.time()
+        self._pins = {o: p for o, p in self._pins.items() if p[1] > now}
+        pinned = set().union(*(ds for ds, _ in self._pins.values()))
+        for digest in [d for d in self._items if d not in pinned]:
+            if self.size <= self.max_bytes or len(self._items) <= 1: break
+            item = self._items.pop(digest)
+            self.size -= item["bytes"]
+            for a in [a for a, d in self._aliases.items() if d == digest]: del self._aliases[a]
+
+    def add(self, image, digest=None, owner=None):
+        """owner verilirse görsel eklenirken (tahliyeden önce) o sahibin isteğine sabitlenir"""
+        digest = digest or image_digest(image)
+        with self._lock:
+            if owner: self._hold(owner, [digest])
+            if digest in self._items:
+                self._items.move_to_end(digest)
+                return digest
+            nbytes = image.width * image.height * len(image.getbands())
+            self._items[digest] = {"image": image, "prepared": {}, "bytes": nbytes}
+            self.size += nbytes
+            self._evict()
+        return digest
+
+    def _hold(self, owner, digests):
+        held = self._pins.get(owner, (set(), 0))[0]
+        self._pins[owner] = (held | set(digests), time.time() + IMAGE_PIN_TTL)
+
+    def pin(self, owner, digests):
+        """Görselleri owner'ın isteği için tahliyeden korur (IMAGE_PIN_TTL boyunca)"""
+        with self._lock: self._hold(owner, digests)
+
+    def release(self, owner):
+        with self._lock:
+            self._pins.pop(owner, None)
+            self._evict()
+
+    def add_file(self, uploaded, owner=None):
+        """Yüklenen dosyayı bir kez çözer; aynı dosya tekrar gelirse çözmeden digest döner"""
+        file_hash = hashlib.sha256(uploaded.getvalue()).hexdigest()
+        with self._lock:
+            digest = self._aliases.get(file_hash)
+            if digest and digest in self._items:
+                self._items.move_to_end(digest)
+                if owner: self._hold(owner, [digest])
+                return digest
+        digest = self.add(Image.open(uploaded), owner=owner)
+        with self._lock: self._aliases[file_hash] = digest
+        return digest
+
+    def get(self, digest):
+        with self._lock:
+            item = self._items.get(digest)
+            if item: self._items.move_to_end(digest)
+            return item["image"] if item else None
+
+    def prepare_many(self, digests, config=PREPROCESS_CONFIG):
+        """Ön işlenmiş blob'ları döndürür; yalnızca eksik olanlar (paralel) işlenir.
+        Depodan düşmüş görsel sessizce atlanmaz, LookupError fırlatılır."""
+        key = self._cfg_key(config)
+        with self._lock:
+            blobs = {d: self._items[d]["prepared"].get(key) for d in digests if d in self._items}
+            images = {d: self._items[d]["image"] for d in digests if d in self._items and blobs[d] is None}
+        lost = [d for d in digests if d not in blobs]
+        if lost: raise LookupError(f"{len(lost)} görsel bellekten düştü, tekrar yükleyin")
+        missing = list(images)
+        for d, blob in zip(missing, preprocess_images([images[d] for d in missing], config)):
+            blobs[d] = blob
+            with self._lock:
+                if d in self._items:
+                    self._items[d]["prepared"][key] = blob
+                    self._items[d]["bytes"] += len(blob["data"])
+                    self.size += len(blob["data"])
+            with self._lock: self._evict()
+        return [blobs[d] for d in digests]
+
+    def stats(self):
+        with self._lock: return {"items": len(self._items), "bytes": self.size}
+
+@st.cache_resource
+def _shared_image_store():
+    return ImageStore()
+
+def get_image_store():
+    if IMAGE_STORE_SHARED: return _shared_image_store()
+    if "image_store" not in st.session_state: st.session_state.image_store = ImageStore()
+    return st.session_state.image_store
+
+# ==========================================
+# 🧠 OTURUM BELLEĞİ (sıkıştırılmış, diske taşan)
+# ==========================================
+SESSION_MEM_MAX_BYTES = int(os.environ.get("SESSION_MEM_MAX_BYTES", 128 * 1024 * 1024))   # Tüm oturumlar, bellek katmanı
+SESSION_QUOTA_BYTES = int(os.environ.get("SESSION_QUOTA_BYTES", 48 * 1024 * 1024))        # Oturum başına
+SESSION_IDLE_TTL = 2 * 60 * 60        # Bu kadar süre görünmeyen oturumun verisi silinir (sn)
+SESSION_SWEEP_INTERVAL = 60
+SESSION_SPILL_DIR = os.environ.get("SESSION_SPILL_DIR", ".session_spill")
+
+_SPILL_NAME = re.compile(r"^[0-9a-f]{64}$")
+
+class SessionQuotaExceeded(Exception):
+    pass
+
+class SessionStore:
+    """Oturum verisi için içerik adresli bayt deposu. session_state yalnızca tanıtıcı (hash) tutar.
+    Bellek katmanı tüm oturumlarda ortak ve sınırlıdır; taşan en eski bloklar diske yazılır.
+    Her oturumun kotası vardır; uzun süre görünmeyen oturumların referansları bırakılır."""
+    def __init__(self, max_mem=SESSION_MEM_MAX_BYTES, quota=SESSION_QUOTA_BYTES, spill_dir=SESSION_SPILL_DIR):
+        self.max_mem, self.quota, self.spill_dir = max_mem, quota, spill_dir
+        self._lock = threading.Lock()
+        self._mem = OrderedDict()     # tanıtıcı -> bayt (LRU)
+        self._mem_bytes = 0
+        self._sizes = {}              # tanıtıcı -> boyut (bellekte ya da diskte)
+        self._refs = {}               # tanıtıcı -> {oturum}
+        self._sessions = {}           # oturum -> {"handles": {tanıtıcı: boyut}, "uses": {tanıtıcı: adet}, "bytes", "last_seen"}
+        self._last_sweep = 0.0
+        os.makedirs(spill_dir, exist_ok=True)
+        # Önceki süreçten kalan bloklar sahipsiz; yalnızca bu deponun yazdığı (sha256 adlı) dosyalar silinir
+        for f in os.listdir(spill_dir):
+            path = os.path.join(spill_dir, f)
+            if _SPILL_NAME.match(f) and os.path.isfile(path): os.remove(path)
+
+    def _path(self, handle): return os.path.join(self.spill_dir, handle)
+
+    def _session(self, sid):
+        return self._sessions.setdefault(sid, {"handles": {}, "uses": {}, "bytes": 0, "last_seen": time.time()})
+
+    def _spill(self):
+        while self._mem_bytes > self.max_mem and len(self._mem) > 1:
+            handle, data = self._mem.popitem(last=False)
+            with open(self._path(handle), "wb") as f: f.write(data)
+            self._mem_bytes -= len(data)
+
+    def put(self, sid, data):
+        """Her put bir kullanım sayar (aynı görsel iki kategoriye yapıştırılabilir); kota blok başına bir kez düşer"""
+        handle = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            sess = self._session(sid)
+            if handle in sess["handles"]:
+                sess["uses"][handle] += 1
+                return handle
+            if sess["bytes"] + len(data) > self.quota:
+                raise SessionQuotaExceeded(f"Oturum kotası dolu ({sess['bytes'] / 1048576:.0f}/{self.quota / 1048576:.0f} MB)")
+            sess["handles"][handle] = len(data)
+            sess["uses"][handle] = 1
+            sess["bytes"] += len(data)
+            self._refs.setdefault(handle, set()).add(sid)
+            if handle not in self._sizes:
+                self._sizes[handle] = len(data)
+                self._mem[handle] = data
+                self._mem_bytes += len(data)
+                self._spill()
+        return handle
+
+    def get(self, handle):
+        with self._lock:
+            data = self._mem.get(handle)
+            if data is not None:
+                self._mem.move_to_end(handle)
+                return data
+            if handle not in self._sizes: return None
+        try:
+            with open(self._path(handle), "rb") as f: data = f.read()
+        except FileNotFoundError:
+            return None   # Okuma sırasında son referans bırakılıp blok silindi
+        with self._lock:
+            if handle in self._sizes and handle not in self._mem:
+                self._mem[handle] = data
+                self._mem_bytes += len(data)
+                self._spill()
+                if handle in self._mem and os.path.exists(self._path(handle)):
+                    try: os.remove(self._path(handle))
+                    except FileNotFoundError: pass
+        return data
+
+    def _drop_ref(self, sid, handle, all_uses=False):
+        sess = self._sessions.get(sid)
+        if not sess or handle not in sess["handles"]: return
+        sess["uses"][handle] -= 1
+        if sess["uses"][handle] > 0 and not all_uses: return
+        sess["uses"].pop(handle)
+        sess["bytes"] -= sess["handles"].pop(handle)
+        refs = self._refs.get(handle, set())
+        refs.discard(sid)
+        if refs: return
+        self._refs.pop(handle, None)
+        self._sizes.pop(handle, None)
+        data = self._mem.pop(handle, None)
+        if data is not None: self._mem_bytes -= len(data)
+        else:
+            try: os.remove(self._path(handle))
+            except FileNotFoundError: pass
+
+    def release(self, sid, *handles):
+        with self._lock:
+            for h in handles:
+                if h: self._drop_ref(sid, h)
+
+    def release_session(self, sid):
+        with self._lock:
+            for h in list(self._sessions.get(sid, {}).get("handles", {})): self._drop_ref(sid, h, all_uses=True)
+            self._sessions.pop(sid, None)
+
+    def touch(self, sid):
+        """Oturum canlı; ara sıra boşta kalan oturumları temizler"""
+        now = time.time()
+        with self._lock:
+            self._session(sid)["last_seen"] = now
+            due = now - self._last_sweep >= SESSION_SWEEP_INTERVAL
+            if due: self._last_sweep = now
+        if due: self.evict_idle()
+
+    def evict_idle(self, max_idle=SESSION_IDLE_TTL):
+        cutoff = time.time() - max_idle
+        with self._lock: idle = [sid for sid, s in self._sessions.items() if s["last_seen"] < cutoff]
+        for sid in idle: self.release_session(sid)
+        return len(idle)
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            rows = [{"oturum": sid[:8], "blok": len(s["handles"]), "MB": round(s["bytes"] / 1048576, 2),
+                     "kota_%": round(100 * s["bytes"] / self.quota, 1), "boşta_dk": round((now - s["last_seen"]) / 60, 1)}
+                    for sid, s in self._sessions.items()]
+            total = sum(self._sizes.values())
+            return {"sessions": rows, "mem_bytes": self._mem_bytes, "disk_bytes": total - self._mem_bytes, "blocks": len(self._sizes)}
+
+@st.cache_resource
+def get_session_store():
+    return SessionStore()
+
+def session_id():
+    if "session_uid" not in st.session_state: st.session_state.session_uid = uuid.uuid4().hex
+    return st.session_state.session_uid
+
+def store_image(image):
+    """Görseli kayıpsız PNG olarak oturum deposuna koyar, tanıtıcı döndürür"""
+    buf = io.BytesIO()
+    (image if image.mode in ("RGB", "RGBA", "L", "P") else image.convert("RGB")).save(buf, "PNG", compress_level=3)
+    return get_session_store().put(session_id(), buf.getvalue())
+
+def load_image(handle):
+    data = get_session_store().get(handle) if handle else None
+    return Image.open(io.BytesIO(data)) if data is not None else None
+
+def store_payload(payload):
+    """JSON yanıtını zlib ile sıkıştırıp saklar (dict yerine tanıtıcı)"""
+    if payload is None: return None
+    return get_session_store().put(session_id(), zlib.compress(json.dumps(payload, ensure_ascii=False).encode("utf-8"), 6))
+
+def load_payload(handle):
+    data = get_session_store().get(handle) if handle else None
+    return json.loads(zlib.decompress(data)) if data is not None else None
+
+# ==========================================
+# 📦 İSTEK BÜTÇESİ PLANLAYICI
+# ==========================================
+# Gemini satır içi istek sınırı ~20 MB (base64 dahil). Token sayısı gecikmenin vekili olarak sınırlanır.
+REQUEST_BUDGET = {
+    "max_bytes": int(os.environ.get("REQUEST_MAX_BYTES", 12 * 1024 * 1024)),
+    "max_tokens": int(os.environ.get("REQUEST_MAX_TOKENS", 30000)),
+    "max_per_cat": int(os.environ.get("REQUEST_MAX_PER_CAT", 3)),   # Bütçe aşılırsa kategori başına en yeni N görsel
+}
+IMAGE_TILE_PX = 768        # Büyük görseller 768px karolara bölünür
+IMAGE_TILE_TOKENS = 258    # Karo (veya ≤384px görsel) başına token
+# Bütçe aşılırsa sırayla denenen daha sıkı küçültme adımları
+DOWNSCALE_STEPS = [{"max_side": 1600, "min_scale": 0.4}, {"max_side": 1280, "min_scale": 0.3}]
+
+def estimate_part(part):
+    """(istek baytı, token) tahmini: görselde base64 şişmesi + karo sayısı, metinde ~4 karakter/token"""
+    if isinstance(part, dict):
+        with Image.open(io.BytesIO(part["data"])) as im: w, h = im.size
+        tiles = 1 if max(w, h) <= 384 else math.ceil(w / IMAGE_TILE_PX) * math.ceil(h / IMAGE_TILE_PX)
+        return math.ceil(len(part["data"]) * 4 / 3), tiles * IMAGE_TILE_TOKENS
+    text = str(part)
+    return len(text.encode("utf-8")), estimate_tokens(text)
+
+def estimate_request(parts):
+    sizes = [estimate_part(p) for p in parts]
+    return {"bytes": sum(b for b, _ in sizes), "tokens": sum(t for _, t in sizes)}
+
+def newest_per_category(digests, image_cats, n):
+    """Kategori başına en yeni n görsel. Sıra yükleme → yapıştırma → TG olduğundan listede sonra gelen daha yenidir.
+    Dönüş: (kalanlar, atılanlar) — ikisi de özgün sırada"""
+    kept, per_cat = set(), {}
+    for d in reversed(digests):
+        if per_cat.get(image_cats[d], 0) < n:
+            per_cat[image_cats[d]] = per_cat.get(image_cats[d], 0) + 1
+            kept.add(d)
+    return [d for d in digests if d in kept], [d for d in digests if d not in kept]
+
+def fit_request(digests, image_cats, image_store, text_parts, config=PREPROCESS_CONFIG, budget=None):
+    """Görselleri metinle birlikte bütçeye sığdırır. Bütçe içindeyse hiçbir şey atılmaz (birebir kopyalar zaten
+    içerik hash'iyle tekilleşir). Aşılırsa sırayla: daha sıkı küçültme → kategori başına en yeni N →
+    kategori bazlı bölme (map-reduce) önerisi.
+    Dönüş: {"digests", "dropped", "parts", "config", "estimate", "steps", "split": {kategori: [digest]} | None, "fits"}"""
+    budget = {**REQUEST_BUDGET, **(budget or {})}
+    text_est = estimate_request(text_parts)
+    fits = lambda est: est["bytes"] <= budget["max_bytes"] and est["tokens"] <= budget["max_tokens"]
+    def measure(ds, cfg):
+        parts = image_store.prepare_many(ds, cfg)
+        est = estimate_request(parts)
+        return parts, {"bytes": est["bytes"] + text_est["bytes"], "tokens": est["tokens"] + text_est["tokens"]}
+
+    cfg, steps, dropped = config, [], []
+    parts, est = measure(digests, cfg)
+    for step in DOWNSCALE_STEPS:
+        if fits(est) or not digests: break
+        if config.get("max_side") and config["max_side"] <= step["max_side"]: continue
+        cfg = {**config, **step}
+        parts, est = measure(digests, cfg)
+        steps.append(f"küçültme ({step['max_side']}px)")
+    if not fits(est):
+        digests, dropped = newest_per_category(digests, image_cats, budget["max_per_cat"])
+        if dropped:
+            parts, est = measure(digests, cfg)
+            steps.append(f"{len(dropped)} eski görsel atıldı (kategori başına en fazla {budget['max_per_cat']})")
+    split = None
+    if not fits(est) and len({image_cats[d] for d in digests}) > 1:
+        split = {}
+        for d in digests: split.setdefault(image_cats[d], []).append(d)
+        steps.append(f"{len(split)} kategoriye bölme")
+    return {"digests": digests, "dropped": dropped, "parts": parts, "config": cfg, "estimate": est,
+            "steps": steps, "split": split, "fits": fits(est)}
+
+# ==========================================
+# 📋 TABLO ÇIKARIMI (görselden tipli tabloya)
+# ==========================================
+TABLE_COLUMNS = ["price", "lot", "broker", "side"]
+TABLE_CACHE_SIZE = 256
+OCR_BACKEND = os.environ.get("OCR_BACKEND", "gemini")      # "gemini" | "fixture"
+OCR_FIXTURE_DIR = os.environ.get("OCR_FIXTURE_DIR", "ocr_fixtures")
+_SIDE_ALIASES = {"bid": "alış", "buy": "alış", "alis": "alış", "alış": "alış", "a": "alış",
+                 "ask": "satış", "sell": "satış", "satis": "satış", "satış": "satış", "s": "satış"}
+
+_TR_GROUPED = re.compile(r"^[-+]?\d{1,3}(\.\d{3})+$")
+
+def _parse_tr_number(value, integer=False):
+    """'1.234.567' ve '22,58' gibi Türkçe sayı yazımlarını float'a çevirir.
+    integer=True (lot/adet/net sütunları): tek noktalı '12.500' de binlik ayracı sayılır."""
+    if value is None or isinstance(value, (int, float)): return value
+    v = str(value).strip().replace(" ", "")
+    if "," in v: v = v.replace(".", "").replace(",", ".")
+    elif v.count(".") > 1 or (integer and _TR_GROUPED.match(v)): v = v.replace(".", "")
+    try: return float(v)
+    except ValueError: return None
+
+def rows_to_frame(rows):
+    """Ham satırları tipli DataFrame'e çevirir (price: float, lot: Int64, side: alış/satış)"""
+    df = pd.DataFrame(rows or [], columns=TABLE_COLUMNS)
+    df["price"] = pd.to_numeric(df["price"].map(_parse_tr_number), errors="coerce").astype("float64")
+    df["lot"] = pd.to_numeric(df["lot"].map(lambda v: _parse_tr_number(v, integer=True)), errors="coerce").round().astype("Int64")
+    df["side"] = df["side"].map(lambda s: _SIDE_ALIASES.get(str(s).strip().lower()) if s is not None else None).astype("category")
+    df["broker"] = df["broker"].where(df["broker"].notna(), None)
+    return df.dropna(subset=["price", "lot"], how="all").reset_index(drop=True)
+
+def frame_to_prompt(df):
+    """Model için kompakt CSV (boş sütunlar atılır). Sayılar kompakt prompt'taki gibi 2 ondalığa yuvarlanır;
+    anlamlı basamak sınırı 312,25 gibi çeyrek adımlı fiyatları bozar."""
+    df = df.dropna(axis=1, how="all")
+    return df.apply(lambda col: col.map(_compact_value)).to_csv(index=False)
+
+# OCR arka uç arayüzü: name (önbellek anahtarı) ve extract(blob, category, digest) -> satır listesi | None
+class GeminiOCRBackend:
+    """Görseli bir kez Lite modele okutup JSON satırlarına çevirir"""
+    name = "gemini"
+    def __init__(self, keys): self.keys = keys
+    def extract(self, blob, category, digest):
+        prompt = (f"Bu bir BIST {category} ekran görüntüsü. Tablodaki her satırı JSON listesine çevir: "
+                  '[{"price": sayı, "lot": sayı, "broker": "kurum veya null", "side": "alış|satış|null"}]. '
+                  "Sayıları görseldeki gibi yaz, uydurma. Sadece JSON döndür.")
+        text = generate_with_pool(self.keys, ["gemini-2.5-flash-lite", "gemini-2.5-flash"], [blob, prompt],
+                                  generation_config={"response_mime_type": "application/json"})
+        data = json.loads(text)
+        return data.get("rows", []) if isinstance(data, dict) else data
+
+class FixtureOCRBackend:
+    """Deterministik test arka ucu: <OCR_FIXTURE_DIR>/<digest>.json satırlarını okur"""
+    name = "fixture"
+    def __init__(self, root=OCR_FIXTURE_DIR): self.root = root
+    def extract(self, blob, category, digest):
+        path = os.path.join(self.root, f"{digest}.json")
+        if not os.path.exists(path): return None
+        with open(path, "r", encoding="utf-8") as f: return json.load(f)
+
+def get_ocr_backend(keys):
+    if OCR_BACKEND == "fixture": return FixtureOCRBackend()
+    return GeminiOCRBackend(keys)
+
+@st.cache_resource
+def _table_cache():
+    """(arka uç, görsel digest) -> DataFrame. Aynı görsel bir kez okunur (tüm oturumlar)."""
+    return {"lock": threading.Lock(), "tables": OrderedDict()}
+
+def extract_tables(image_cats, image_store, keys, backend=None):
+    """{digest: kategori} için tabloları döndürür: {digest: DataFrame}. Okunamayanlar atlanır."""
+    backend = backend or get_ocr_backend(keys)
+    cache = _table_cache()
+    tables, missing = {}, []
+    with cache["lock"]:
+        for d in image_cats:
+            df = cache["tables"].get((backend.name, d))
+            if df is not None:
+                cache["tables"].move_to_end((backend.name, d))
+                tables[d] = df
+            else: missing.append(d)
+
+    def run(d):
+        blob = image_store.prepare_many([d])[0]
+        rows = backend.extract(blob, image_cats[d], d)
+        return rows_to_frame(rows) if rows else None
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = {d: pool.submit(run, d) for d in missing}
+    for d, f in futures.items():
+        try: df = f.result()
+        except Exception: df = None
+        if df is None or df.empty: continue
+        tables[d] = df
+        with cache["lock"]:
+            cache["tables"][(backend.name, d)] = df
+            while len(cache["tables"]) > TABLE_CACHE_SIZE: cache["tables"].popitem(last=False)
+    return tables
+
+# ==========================================
+# 📰 HABER ALT SİSTEMİ (koşullu GET + önbellek)
+# ==========================================
+NEWS_RSS_URL = "https://news.google.com/rss/search?q={q}&hl=tr&gl=TR&ceid=TR:tr"
+NEWS_CACHE_TTL = 300           # Sembol başına haber listesi bu süre taze (sn)
+NEWS_MAX_ITEMS = 5             # Prompta giden başlık sayısı
+NEWS_KEEP_ITEMS = 20           # Önbellekte tutulan başlık sayısı
+NEWS_FIXTURE_DIR = os.environ.get("NEWS_FIXTURE_DIR")  # Kayıtlı RSS: <dizin>/<SEMBOL>.xml
+
+@st.cache_resource
+def _news_store():
+    """feeds: sembol -> {etag, modified, keys, fetched}; headlines: başlık anahtarı -> kayıt (tek kopya)"""
+    return {"lock": threading.Lock(), "feeds": {}, "headlines": OrderedDict()}
+
+def _headline_key(title):
+    """' - Kaynak' eki atılmış, harf/rakam dışı temizlenmiş başlık"""
+    base = title.rsplit(" - ", 1)[0] if " - " in title else title
+    return "".join(ch for ch in base.translate(_TR_CHARS).lower() if ch.isalnum())
+
+def _fetch_feed(symbol, etag=None, modified=None):
+    """(durum, içerik, etag, modified). 304'te içerik None döner."""
+    if NEWS_FIXTURE_DIR:
+        with open(os.path.join(NEWS_FIXTURE_DIR, f"{symbol}.xml"), "rb") as f: return 200, f.read(), None, None
+    _rate_limiters()["news"].acquire()
+    headers = {}
+    if etag: headers["If-None-Match"] = etag
+    if modified: headers["If-Modified-Since"] = modified
+    url = NEWS_RSS_URL.format(q=quote(f"{symbol} Borsa KAP when:1d"))
+    with trace_span("rss", symbol=symbol) as span:
+        r = _http_session().get(url, headers=headers, timeout=HTTP_TIMEOUT)
+        span.update(status=r.status_code, bytes=len(r.content))
+    if r.status_code == 304: return 304, None, etag, modified
+    r.raise_for_status()
+    return r.status_code, r.content, r.headers.get("ETag"), r.headers.get("Last-Modified")
+
+def fetch_news_entries(symbol, max_age=NEWS_CACHE_TTL, force=False):
+    """Sembolün başlık kayıtları (yeniden eskiye). Aynı başlık semboller arasında tek kopya tutulur."""
+    store = _news_store()
+    with store["lock"]:
+        feed = dict(store["feeds"].get(symbol) or {})
+    if feed and not force and time.time() - feed["fetched"] < max_age:
+        keys = feed["keys"]
+    else:
+        status, content, etag, modified = _fetch_feed(symbol, feed.get("etag"), feed.get("modified"))
+        keys = feed.get("keys", [])
+        if status != 304:
+            parsed = feedparser.parse(content)
+            keys = []
+            with store["lock"]:
+                for entry in parsed.entries[:NEWS_KEEP_ITEMS]:
+                    key = _headline_key(entry.title)
+                    if not key or key in keys: continue
+                    item = store["headlines"].setdefault(key, {"title": entry.title, "published": entry.get("published_parsed"), "symbols": set()})
+                    item["symbols"].add(symbol)
+                    store["headlines"].move_to_end(key)
+                    keys.append(key)
+                while len(store["headlines"]) > 50 * NEWS_KEEP_ITEMS: store["headlines"].popitem(last=False)
+        with store["lock"]:
+            store["feeds"][symbol] = {"etag": etag, "modified": modified, "keys": keys, "fetched": time.time()}
+    with store["lock"]:
+        items = [store["headlines"][k] for k in keys if k in store["headlines"]]
+    return sorted(items, key=lambda i: calendar.timegm(i["published"]) if i["published"] else 0, reverse=True)
+
+def fetch_stock_news(symbol, max_age=NEWS_CACHE_TTL, force=False):
+    """Google News RSS (Son 24 Saat)"""
+    if not NEWS_ENABLED: return "Haber modülü aktif değil."
+    try:
+        news_list = []
+        for item in fetch_news_entries(symbol, max_age, force)[:NEWS_MAX_ITEMS]:
+            published = item["published"]
+            date_str = time.strftime("%d.%m.%Y %H:%M", published) if published else "Tarih Yok"
+            shared = f" [+{', '.join(sorted(item['symbols'] - {symbol}))}]" if len(item["symbols"]) > 1 else ""
+            news_list.append(f"- {item['title']} ({date_str}){shared}")
+        if not news_list: return "Son 24 saatte önemli haber yok."
+        return "\n".join(news_list)
+    except Exception as e:
+        return f"Haber çekme hatası: {str(e)}"
+
+# ==========================================
+# 🛰️ ARKA PLAN ÖN YÜKLEME (izleme listesi)
+# ==========================================
+PREFETCH_INTERVAL_OPEN = 45        # Seans içi derinlik/AKD yenileme (sn) < MARKET_CACHE_TTL
+PREFETCH_INTERVAL_CLOSED = 600     # Seans dışı tur aralığı (sadece haber)
+PREFETCH_NEWS_INTERVAL = 240       # Haber yenileme aralığı (sn) < NEWS_CACHE_TTL
+PREFETCH_QUEUE_SIZE = 64
+PREFETCH_WORKERS = 2
+
+class MarketPrefetcher:
+    """Süreç başına tek: izleme listesini seans saatlerine göre sıcak tutar.
+    Kuyruk sınırlıdır; dolarsa tur atlanır (geri basınç), istekler ortak hız sınırından geçer."""
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=PREFETCH_QUEUE_SIZE)
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.last_news = {}
+        self.stats = {"rounds": 0, "fetched": 0, "errors": 0, "dropped": 0, "last_round": None}
+        threading.Thread(target=self._scheduler, name="prefetch-scheduler", daemon=True).start()
+        for i in range(PREFETCH_WORKERS):
+            threading.Thread(target=self._worker, name=f"prefetch-worker-{i}", daemon=True).start()
+
+    def _scheduler(self):
+        while True:
+            cfg = load_global_config()
+            if not cfg.get("prefetch_active"):
+                time.sleep(5)
+                continue
+            market_open = is_market_open()
+            for symbol in cfg.get("watchlist", []):
+                with self.lock:
+                    if symbol in self.pending: continue
+                    self.pending.add(symbol)
+                try: self.queue.put_nowait((symbol, market_open))
+                except queue.Full:
+                    with self.lock:
+                        self.pending.discard(symbol)
+                        self.stats["dropped"] += 1
+            self.stats["rounds"] += 1
+            self.stats["last_round"] = time.time()
+            time.sleep(PREFETCH_INTERVAL_OPEN if market_open else PREFETCH_INTERVAL_CLOSED)
+
+    def _worker(self):
+        while True:
+            symbol, market_open = self.queue.get()
+            try:
+                if market_open:
+                    for ep in ("derinlik", "akd"):
+                        fetch_endpoint(symbol, ep, ttl=0)
+                        self.stats["fetched"] += 1
+                if NEWS_ENABLED and time.time() - self.last_news.get(symbol, 0) >= PREFETCH_NEWS_INTERVAL:
+                    fetch_stock_news(symbol, force=True)
+                    self.last_news[symbol] = time.time()
+                    self.stats["fetched"] += 1
+            except Exception:
+                self.stats["errors"] += 1
+            finally:
+                with self.lock: self.pending.discard(symbol)
+                self.queue.task_done()
+
+@st.cache_resource
+def get_prefetcher():
+    return MarketPrefetcher()
+
+# ==========================================
+# 🔎 TOPLU TARAMA (çok sembollü)
+# ==========================================
+SCAN_CONCURRENCY = 6         # Aynı anda çekilen sembol (istekler yine ortak hız sınırından geçer)
+SCAN_TOP_K = 5               # Gemini yorumuna gönderilecek aday sayısı
+SCAN_NEAR_PCT = 0.02         # Dengesizlik için anlık fiyata ±%2 bant
+SCAN_WEIGHTS = {"dengesizlik": 0.4, "balina_baskısı": 0.3, "akd_balina_net": 0.3}
+SCAN_PROMPT = """
+Sen Borsa Uzmanısın. {symbol} için yerel hesaplanmış derinlik/AKD özeti ve tarama sinyalleri aşağıda.
+Giriş cümlesi yazma. En fazla 3 kısa madde: baskın taraf, kritik seviye, dikkat edilecek risk.
+--- SİNYALLER ---
+{signals}
+--- SEVİYELER ---
+{levels}
+"""
+
+@st.cache_resource
+def _scan_pool():
+    return ThreadPoolExecutor(max_workers=SCAN_CONCURRENCY, thread_name_prefix="scan")
+
+def _robust_z(values, groups):
+    """Grup içi (sembol başına) sağlam z-skoru; whale_mask'in vektörel çok-sembollü karşılığı"""
+    med = values.groupby(groups).transform("median")
+    mad = (values - med).abs().groupby(groups).transform("median")
+    fallback = pd.Series(np.where(values > med * 3, np.inf, 0.0), index=values.index)
+    return (0.6745 * (values - med) / mad.where(mad > 0)).fillna(fallback)
+
+def scan_signals(depths, akds):
+    """Tüm semboller tek tabloda: derinlik dengesizliği, balina baskısı, AKD balina akışı ve bileşik skor.
+    depths/akds: {sembol: payload}. Dönüş: skorun mutlak değerine göre sıralı DataFrame (indeks: sembol)"""
+    books = []
+    for sym, payload in depths.items():
+        if payload is None: continue
+        book, last = normalize_depth(payload)
+        if book.empty: continue
+        if last is None:
+            bids, asks = book.loc[book["side"] == "alış", "price"], book.loc[book["side"] == "satış", "price"]
+            last = float((bids.max() + asks.min()) / 2) if len(bids) and len(asks) else float(book["price"].median())
+        books.append(book[["price", "lot"]].assign(symbol=sym, last=last))
+    out = pd.DataFrame(index=pd.Index(sorted(set(depths) | set(akds)), name="sembol"))
+    if books:
+        lv = pd.concat(books, ignore_index=True).groupby(["symbol", "price"], sort=False).agg(lot=("lot", "sum"), last=("last", "first")).reset_index()
+        near = (lv["price"] - lv["last"]).abs() <= lv["last"] * SCAN_NEAR_PCT
+        below, above = lv["price"] < lv["last"], lv["price"] > lv["last"]
+        whale = _robust_z(lv["lot"], lv["symbol"]) > WHALE_Z
+        agg = pd.DataFrame({
+            "symbol": lv["symbol"],
+            "bid": lv["lot"].where(below & near, 0.0), "ask": lv["lot"].where(above & near, 0.0),
+            "wbid": lv["lot"].where(below & whale, 0.0), "wask": lv["lot"].where(above & whale, 0.0),
+            "whale": whale.astype(int),
+        }).groupby("symbol").sum()
+        out["fiyat"] = lv.groupby("symbol")["last"].first()
+        out["dengesizlik"] = (agg["bid"] - agg["ask"]) / (agg["bid"] + agg["ask"]).where(lambda x: x > 0)
+        out["balina_baskısı"] = (agg["wbid"] - agg["wask"]) / (agg["wbid"] + agg["wask"]).where(lambda x: x > 0)
+        out["derinlik_balina"] = agg["whale"]
+    frames = [normalize_akd(p).assign(symbol=sym) for sym, p in akds.items() if p is not None]
+    frames = [f for f in frames if not f.empty]
+    if frames:
+        akd = pd.concat(frames, ignore_index=True)
+        absnet = akd["net"].abs()
+        whale = _robust_z(absnet, akd["symbol"]) > WHALE_Z
+        rank = akd.groupby("symbol")["net"].rank(ascending=False, method="first")
+        g = pd.DataFrame({"symbol": akd["symbol"], "gross": absnet, "wnet": akd["net"].where(whale, 0.0), "whale": whale.astype(int),
+                          "top5": akd["net"].where((rank <= 5) & (akd["net"] > 0), 0.0), "pos": akd["net"].clip(lower=0)}).groupby("symbol").sum()
+        out["akd_balina_net"] = g["wnet"] / g["gross"].where(lambda x: x > 0)
+        out["akd_balina"] = g["whale"]
+        out["ilk5_yoğunluk"] = g["top5"] / g["pos"].where(lambda x: x > 0)
+    for col in SCAN_WEIGHTS:
+        if col not in out: out[col] = np.nan
+    out["skor"] = sum(out[c].fillna(0) * w for c, w in SCAN_WEIGHTS.items())
+    return out.reindex(out["skor"].abs().sort_values(ascending=False).index).round(3)
+
+def run_scan(symbols, on_update=None):
+    """Sembolleri sınırlı eşzamanlılıkla çeker; her tamamlanan sembolde tablo (vektörel) yeniden hesaplanır.
+    Dönüş: (sinyal tablosu, {sembol: (derinlik, akd)})"""
+    futures = {_scan_pool().submit(fetch_market_data, sym): sym for sym in symbols}
+    payloads, signals = {}, pd.DataFrame()
+    for i, fut in enumerate(as_completed(futures), 1):
+        try: data, _ = fut.result()
+        except Exception: data = {}
+        payloads[futures[fut]] = (data.get("derinlik"), data.get("akd"))
+        signals = scan_signals({s: d for s, (d, _) in payloads.items()}, {s: a for s, (_, a) in payloads.items()})
+        if on_update: on_update(signals, i)
+    return signals, payloads
+
+def comment_candidates(signals, payloads, keys, top_k=SCAN_TOP_K, on_done=None):
+    """İlk top_k aday için kısa Gemini yorumu; çağrılar farklı anahtarlara dağıtılır. Dönüş: {sembol: yorum}"""
+    ranked_keys = list(dict.fromkeys(k for k, _ in schedule_candidates(keys, MAP_MODEL_PRIORITY)))
+    def one(sym, preferred):
+        depth, akd = payloads.get(sym, (None, None))
+        prompt = SCAN_PROMPT.format(symbol=sym, signals=signals.loc[sym].dropna().to_string(),
+                                    levels=render_levels(compute_levels(depth, akd)) or "-")
+        with trace_span("tarama_yorumu", symbol=sym):
+            return generate_with_pool(keys, MAP_MODEL_PRIORITY, prompt, preferred_key=preferred)
+    futures = {_map_pool().submit(one, sym, ranked_keys[i % len(ranked_keys)] if ranked_keys else None): sym
+               for i, sym in enumerate(signals.index[:top_k])}
+    comments = {}
+    for fut in as_completed(futures):
+        try: comments[futures[fut]] = fut.result()
+        except Exception as e: comments[futures[fut]] = f"⚠️ {e}"
+        if on_done: on_done(comments)
+    return comments
+
+# ==========================================
+# 📲 TELEGRAM KÖPRÜSÜ (olay tabanlı)
+# ==========================================
+BRIDGE_DEADLINE = 25           # Köprü yanıtı için azami bekleme (sn)
+BRIDGE_POLL_INTERVAL = 1.0     # Dinleyici kurulamazsa yedek polling aralığı (sn)
+# "legacy": bridge/request + bridge/response tek slot (mevcut bridge.py). "jobs": bridge/jobs/<id> — PC tarafı
+# iş kuyruğunu izleyen bridge.py sürümüyle birlikte açılmalı, aksi halde her istek zaman aşımına düşer.
+BRIDGE_PROTOCOL = os.environ.get("BRIDGE_PROTOCOL", "legacy")
+BRIDGE_RESULT_TTL = 120        # Aynı (sembol, tip) görseli bu süre tekrar istenmez (sn)
+BRIDGE_RESULT_CACHE_SIZE = 64
+
+def _apply_event(state, path, data):
+    """RTDB dinleyici olayını yerel kopyaya uygular"""
+    parts = [p for p in path.split("/") if p]
+    if not parts: return data if isinstance(data, dict) else {}
+    node = state if isinstance(state, dict) else {}
+    root = node
+    for p in parts[:-1]:
+        node = node.setdefault(p, {})
+    if data is None: node.pop(parts[-1], None)
+    else: node[parts[-1]] = data
+    return root
+
+class RTDBBridgeTransport:
+    """Firebase RTDB taşıyıcısı: durum değişiklikleri dinleyici ile itilir"""
+    def set(self, path, value): db.reference(path).set(value)
+    def update(self, path, value): db.reference(path).update(value)
+    def get(self, path): return db.reference(path).get()
+    def delete(self, path): db.reference(path).delete()
+    def listen(self, path, callback):
+        state = {"v": {}}
+        def on_event(event):
+            state["v"] = _apply_event(state["v"], event.path, event.data)
+            callback(copy.deepcopy(state["v"]))
+        return db.reference(path).listen(on_event).close
+
+class LocalBridgeTransport:
+    """Süreç içi taşıyıcı (test / yerel geliştirme). PC tarafı update() ile taklit edilir."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+        self._listeners = {}
+    def _notify(self, path):
+        value = self.get(path)
+        for cb in list(self._listeners.get(path, [])): cb(value)
+    def set(self, path, value):
+        with self._lock: self._data[path] = copy.deepcopy(value)
+        self._notify(path)
+    def update(self, path, value):
+        with self._lock:
+            node = self._data.setdefault(path, {})
+            node.update(copy.deepcopy(value))
+        self._notify(path)
+    def get(self, path):
+        with self._lock: return copy.deepcopy(self._data.get(path))
+    def delete(self, path):
+        with self._lock: self._data.pop(path, None)
+        self._notify(path)
+    def listen(self, path, callback):
+        with self._lock: self._listeners.setdefault(path, []).append(callback)
+        callback(self.get(path))
+        def close():
+            with self._lock:
+                if callback in self._listeners.get(path, []): self._listeners[path].remove(callback)
+        return close
+
+@st.cache_resource
+def _local_bridge_transport():
+    return LocalBridgeTransport()
+
+def get_bridge_transport():
+    """BRIDGE_TRANSPORT=local ise süreç içi taşıyıcı, değilse Firebase"""
+    if os.environ.get("BRIDGE_TRANSPORT") == "local": return _local_bridge_transport()
+    if firebase_ready: return RTDBBridgeTransport()
+    return None
+
+@st.cache_resource
+def _bridge_metrics():
+    """Son köprü isteklerinin faz süreleri (tüm oturumlar)"""
+    return deque(maxlen=200)
+
+BLOB_DIR = os.environ.get("BRIDGE_BLOB_DIR", ".bridge_blobs")
+BLOB_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+class FileBlobStore:
+    """İçerik adresli dosya deposu (sha256 -> dosya). Aynı görsel bir kez yazılır."""
+    def __init__(self, root, max_bytes=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+    def path(self, digest): return os.path.join(self.root, digest[:2], digest)
+    def exists(self, digest): return os.path.exists(self.path(digest))
+    def open(self, digest): return open(self.path(digest), "rb")
+    def put(self, data):
+        return self.put_stream(io.BytesIO(data))
+    def put_stream(self, fileobj, expected=None):
+        """Akışı parça parça diske yazar, hash'i yolda hesaplar"""
+        h = hashlib.sha256()
+        tmp = os.path.join(self.root, f".tmp-{uuid.uuid4().hex}")
+        try:
+            with open(tmp, "wb") as out:
+                for block in iter(lambda: fileobj.read(64 * 1024), b""):
+                    h.update(block)
+                    out.write(block)
+            digest = h.hexdigest()
+            if expected and digest != expected: raise ValueError(f"Blob hash uyuşmuyor: {expected[:12]}")
+            if self.exists(digest): return digest
+            os.makedirs(os.path.dirname(self.path(digest)), exist_ok=True)
+            os.replace(tmp, self.path(digest))
+        finally:
+            if os.path.exists(tmp): os.remove(tmp)
+        self._prune()
+        return digest
+    def _prune(self):
+        if not self.max_bytes: return
+        files = []
+        for sub in os.scandir(self.root):
+            if sub.is_dir():
+                files.extend(os.scandir(sub.path))
+        total = sum(f.stat().st_size for f in files)
+        for f in sorted(files, key=lambda f: f.stat().st_mtime):
+            if total <= self.max_bytes: break
+            total -= f.stat().st_size
+            os.remove(f.path)
+
+class FirebaseBlobStore:
+    """Firebase Storage üzerinde içerik adresli depo (bridge/blobs/<sha256>)"""
+    def __init__(self, bucket, prefix="bridge/blobs"):
+        self.bucket = bucket
+        self.prefix = prefix
+    def _blob(self, digest): return self.bucket.blob(f"{self.prefix}/{digest}")
+    def exists(self, digest): return self._blob(digest).exists()
+    def open(self, digest): return self._blob(digest).open("rb")
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        blob = self._blob(digest)
+        if not blob.exists(): blob.upload_from_string(data, content_type="image/png")
+        return digest
+
+@st.cache_resource
+def _local_blob_store():
+    """Yerel blob önbelleği; uzak depo yoksa dosya sistemi yedeği olarak da kullanılır"""
+    return FileBlobStore(BLOB_DIR, max_bytes=BLOB_CACHE_MAX_BYTES)
+
+def get_remote_blob_store():
+    if firebase_ready and storage is not None and FIREBASE_STORAGE_BUCKET:
+        return FirebaseBlobStore(storage.bucket())
+    return _local_blob_store()
+
+def _resolve_bridge_image(data):
+    """Yanıttaki görseli yerel depoya alır ve içerik hash'ini döndürür.
+    Yeni format: image_sha256 (+ meta), eski format: image_base64."""
+    local = _local_blob_store()
+    if data.get('image_sha256'):
+        digest = data['image_sha256']
+        if not local.exists(digest):
+            with get_remote_blob_store().open(digest) as f:
+                local.put_stream(f, expected=digest)
+        return digest
+    if data.get('image_base64'):
+        return local.put(base64.b64decode(data['image_base64']))
+    return None
+
+def open_blob_image(digest):
+    """Görseli diskten tembel açar (başlık okunur, pikseller gerektiğinde); blob budanmışsa None"""
+    if not digest or not _local_blob_store().exists(digest): return None
+    return Image.open(_local_blob_store().path(digest))
+
+@st.cache_resource
+def _bridge_jobs():
+    """Uçuştaki işler ve (sembol, tip) -> görsel hash sonuç önbelleği (tüm oturumlar)"""
+    return {"lock": threading.Lock(), "inflight": {}, "results": OrderedDict()}
+
+@st.cache_resource
+def _bridge_pool():
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="bridge")
+
+def _bridge_paths():
+    """İstek ve yanıt düğümleri: iş kuyruğu (varsayılan) veya eski tek slot"""
+    if BRIDGE_PROTOCOL == "legacy": return 'bridge/request', 'bridge/response'
+    job_path = f"bridge/jobs/{uuid.uuid4().hex}"
+    return job_path, f"{job_path}/result"
+
+def _run_bridge_job(transport, symbol, data_type, deadline, job):
+    """Arka planda işi yazar, durumu dinler, görselin içerik hash'ini döndürür (st çağrısı yok)"""
+    req_path, res_path = _bridge_paths()
+    events = queue.Queue()
+    close_listener = None
+    metrics = {"symbol": symbol, "type": data_type, "reads": 0, "mode": "listen"}
+    req_ts = time.time()
+    phases = {}
+    result = None
+    try:
+        transport.set(req_path, {
+            'symbol': symbol,
+            'type': data_type,
+            'status': 'pending',
+            'timestamp': req_ts
+        })
+        phases["pending"] = time.time()
+
+        def on_request(value):
+            value = value or {}
+            if value.get('timestamp') not in (None, req_ts): return  # başka/eski istek
+            events.put((time.time(), value))
+        try:
+            close_listener = transport.listen(req_path, on_request)
+        except Exception:
+            metrics["mode"] = "poll"
+
+        end = req_ts + deadline
+        last_poll = 0.0
+        job["status"] = "noresponse"
+        while True:
+            remaining = end - time.time()
+            if remaining <= 0: break
+            if close_listener is None and time.time() - last_poll >= BRIDGE_POLL_INTERVAL:
+                last_poll = time.time()
+                metrics["reads"] += 1
+                on_request(transport.get(req_path))
+            try:
+                ts, value = events.get(timeout=min(0.25, remaining))
+            except queue.Empty:
+                continue
+            status = value.get('status')
+            if status == 'processing':
+                phases.setdefault("processing", ts)
+                job["status"] = "processing"
+            elif status == 'completed':
+                phases["completed"] = ts
+                data = value.get('result')
+                if not data:
+                    metrics["reads"] += 1
+                    data = transport.get(res_path)
+                if data: result = _resolve_bridge_image(data)
+                job["status"] = "completed"
+                break
+            elif status == 'timeout':
+                job["status"] = "timeout"
+                break
+    finally:
+        if close_listener:
+            try: close_listener()
+            except Exception: pass
+        if BRIDGE_PROTOCOL != "legacy":
+            try: transport.delete(req_path)
+            except Exception: pass
+
+    t_pending = phases.get("pending", req_ts)
+    if "processing" in phases: metrics["pending_to_processing"] = phases["processing"] - t_pending
+    if "completed" in phases:
+        metrics["processing_to_completed"] = phases["completed"] - phases.get("processing", t_pending)
+    metrics["total"] = time.time() - req_ts
+    metrics["status"] = job["status"]
+    job["metrics"] = metrics
+    _bridge_metrics().append(metrics)
+    record_span("köprü", metrics["total"], **{k: v for k, v in metrics.items() if k != "total"})
+    return result
+
+def _bridge_cached_result(symbol, data_type):
+    jobs = _bridge_jobs()
+    with jobs["lock"]:
+        hit = jobs["results"].get((symbol, data_type))
+        if not hit or not _local_blob_store().exists(hit[1]): return None
+        if time.time() - hit[0] > BRIDGE_RESULT_TTL:
+            del jobs["results"][(symbol, data_type)]
+            return None
+        jobs["results"].move_to_end((symbol, data_type))
+        return hit[1]
+
+def _start_or_join_job(transport, symbol, data_type, deadline):
+    """Aynı (sembol, tip) için uçuşta iş varsa ona katılır, yoksa yenisini başlatır"""
+    jobs = _bridge_jobs()
+    key = (symbol, data_type)
+    with jobs["lock"]:
+        job = jobs["inflight"].get(key)
+        if job: return job, False
+        job = {"status": "pending", "started": time.time(), "deadline": deadline}
+        jobs["inflight"][key] = job
+
+    def run():
+        try:
+            digest = _run_bridge_job(transport, symbol, data_type, deadline, job)
+        except Exception:
+            job["status"] = "error"
+            raise
+        finally:
+            with jobs["lock"]: jobs["inflight"].pop(key, None)
+        if digest:
+            with jobs["lock"]:
+                jobs["results"][key] = (time.time(), digest)
+                jobs["results"].move_to_end(key)
+                while len(jobs["results"]) > BRIDGE_RESULT_CACHE_SIZE:
+                    jobs["results"].popitem(last=False)
+        return digest
+
+    job["future"] = _bridge_pool().submit(run)
+    return job, True
+
+def fetch_data_via_bridge(symbol, data_type, deadline=BRIDGE_DEADLINE, transport=None):
+    """PC'deki bridge.py ile konuşur; aynı istekler birleştirilir, sonuçlar kısa süre saklanır.
+    Dönüş: yerel blob deposundaki görselin hash'i (görsel open_blob_image ile açılır)"""
+    transport = transport or get_bridge_transport()
+    if transport is None:
+        st.error("Veritabanı bağlantısı yok.")
+        return None
+
+    status_area = st.empty()
+    try:
+        cached = _bridge_cached_result(symbol, data_type)
+        if cached:
+            status_area.success("✅ Veri Alındı! (önbellek)")
+            return cached
+
+        job, owner = _start_or_join_job(transport, symbol, data_type, deadline)
+        if owner: status_area.info(f"📡 {symbol} için {data_type} isteniyor... PC'ye bağlanılıyor.")
+        else: status_area.info(f"📡 {symbol} {data_type} isteği zaten sırada, sonuç paylaşılacak...")
+        progress_bar = st.progress(0)
+        fut = job["future"]
+        while not fut.done():
+            wait([fut], timeout=0.25)
+            progress_bar.progress(min(1.0, (time.time() - job["started"]) / job["deadline"]))
+            if job["status"] == "processing":
+                status_area.warning("⏳ Robot emri aldı, Telegram'dan yanıt bekleniyor...")
+        progress_bar.empty()
+
+        digest = fut.result()
+        if job["status"] == "completed":
+            status_area.success("✅ Veri Alındı!")
+        elif job["status"] == "timeout":
+            status_area.error("❌ Zaman aşımı. Hedef bot cevap vermedi.")
+        else:
+            status_area.error("❌ Yanıt yok. PC'deki 'bridge.py' çalışıyor mu?")
+        if digest:
+            m = job.get("metrics", {})
+            st.caption(f"⏱️ Köprü: bekleme→işlem {m.get('pending_to_processing', 0):.1f} sn · işlem→tamam {m.get('processing_to_completed', 0):.1f} sn")
+            return digest
+    except Exception as e:
+        status_area.error(f"Hata: {e}")
+    return None
+
+
+
+# ==========================================
+# 🗃️ ANALİZ ÖNBELLEĞİ (SQLite)
+# ==========================================
+ANALYSIS_CACHE_DB = os.environ.get("ANALYSIS_CACHE_DB", "analysis_cache.sqlite3")
+ANALYSIS_CACHE_TTL_OPEN = 15 * 60              # Seans içinde sonuç bu kadar geçerli (sn)
+ANALYSIS_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+def analysis_ttl(now=None):
+    """Seans açıkken kısa TTL; kapalıyken bir sonraki açılışa kadar (veri değişmez)"""
+    now = now or bist_now()
+    if is_market_open(now): return ANALYSIS_CACHE_TTL_OPEN
+    return (next_market_open(now) - now).total_seconds()
+
+def analysis_fingerprint(image_digests, api_payloads, news_text, analysis_mode, max_items, model, prompt):
+    """Analiz girdilerinin parmak izi; aynı girdi = aynı rapor"""
+    h = lambda obj: hashlib.sha256(json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+    return h({"images": list(image_digests), "api": h(api_payloads), "news": h(news_text),
+              "mode": analysis_mode, "max_items": max_items, "model": model, "prompt": h(prompt)})
+
+class AnalysisCache:
+    """Boyut sınırlı, TTL'li kalıcı analiz önbelleği (LRU tahliye)"""
+    def __init__(self, path=ANALYSIS_CACHE_DB, max_bytes=ANALYSIS_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        with self._conn() as c:
+            c.execute("""CREATE TABLE IF NOT EXISTS analyses (
+                key TEXT PRIMARY KEY, created REAL, expires REAL, last_access REAL,
+                model TEXT, result TEXT, size INTEGER)""")
+
+    def _conn(self): return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key):
+        now = time.time()
+        with self._conn() as c:
+            row = c.execute("SELECT result, model, created FROM analyses WHERE key=? AND expires>?", (key, now)).fetchone()
+            if row: c.execute("UPDATE analyses SET last_access=? WHERE key=?", (now, key))
+        return {"result": row[0], "model": row[1], "created": row[2]} if row else None
+
+    def put(self, key, result, model, ttl):
+        now = time.time()
+        size = len(result.encode("utf-8"))
+        with self._conn() as c:
+            c.execute("INSERT OR REPLACE INTO analyses VALUES (?,?,?,?,?,?,?)", (key, now, now + ttl, now, model, result, size))
+            c.execute("DELETE FROM analyses WHERE expires<=?", (now,))
+            total = c.execute("SELECT COALESCE(SUM(size), 0) FROM analyses").fetchone()[0]
+            if total > self.max_bytes:
+                for k, sz in c.execute("SELECT key, size FROM analyses ORDER BY last_access").fetchall():
+                    if total <= self.max_bytes: break
+                    c.execute("DELETE FROM analyses WHERE key=?", (k,))
+                    total -= sz
+
+@st.cache_resource
+def get_analysis_cache():
+    return AnalysisCache()
+
+# ==========================================
+# 🗄️ GEÇMİŞ ANLIK GÖRÜNTÜLER (derinlik / AKD)
+# ==========================================
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", ".snapshots")
+SNAPSHOT_RETENTION_DAYS = 30
+PRICE_SCALE = 100            # Fiyatlar kuruş cinsinden tam sayı (BIST adımı 0.01)
+NA_INT = np.iinfo("int64").min
+# Düzen: <dizin>/<SEMBOL>/<tip>/<gün>/{index.bin, <sütun>.bin[, brokers.json]} — yalnızca eklenir, okuma memmap ile
+SNAPSHOT_COLUMNS = {
+    "derinlik": {"price": "<i4", "lot": "<i8", "side": "<i1"},   # price: sıralı kademeler arası fark (delta)
+    "akd": {"broker": "<i2", "buy": "<i8", "sell": "<i8", "net": "<i8"},   # broker: gün sözlüğünde kod
+}
+SNAPSHOT_INDEX = np.dtype([("ts", "<f8"), ("offset", "<i8"), ("rows", "<i4"), ("base", "<i8"), ("last", "<f8")])
+_SIDE_CODES = {"alış": 1, "satış": -1}
+
+def _to_int(series):
+    return np.where(series.isna(), NA_INT, series.fillna(0).round()).astype("int64")
+
+def _from_int(arr):
+    return pd.Series(np.where(arr == NA_INT, np.nan, arr), dtype="float64")
+
+def _memmap(path, dtype):
+    if not os.path.exists(path) or os.path.getsize(path) == 0: return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+class SnapshotStore:
+    """Sembol başına eklenen derinlik/AKD anlık görüntüleri; sütun bazlı ikili dosyalar.
+    Fiyatlar delta kodlu int32, lotlar int64, kurum adları gün sözlüğüyle int16 kodlanır.
+    Zaman aralığı sorgusu indeksin ts sütununda ikili arama ile yapılır."""
+    def __init__(self, root=SNAPSHOT_DIR, retention_days=SNAPSHOT_RETENTION_DAYS):
+        self.root = root
+        self._lock = threading.Lock()
+        self._last_hash = {}
+        os.makedirs(root, exist_ok=True)
+        self.prune(retention_days)
+
+    def _dir(self, symbol, kind, day):
+        return os.path.join(self.root, symbol.upper(), kind, str(day))
+
+    def _vocab(self, path):
+        f = os.path.join(path, "brokers.json")
+        if not os.path.exists(f): return []
+        with open(f, encoding="utf-8") as fh: return json.load(fh)
+
+    def _encode(self, kind, payload, path):
+        if kind == "derinlik":
+            book, last = normalize_depth(payload)
+            if book.empty: return None
+            book = book.assign(code=book["side"].map(_SIDE_CODES).fillna(0).astype("int8")).sort_values(["code", "price"], ascending=[False, True])
+            ticks = (book["price"].to_numpy() * PRICE_SCALE).round().astype("int64")
+            return {"price": np.diff(ticks, prepend=ticks[0]), "lot": _to_int(book["lot"]), "side": book["code"].to_numpy()}, int(ticks[0]), last
+        akd = normalize_akd(payload)
+        if akd.empty: return None
+        vocab = self._vocab(path)
+        codes = {b: i for i, b in enumerate(vocab)}
+        new = [b for b in dict.fromkeys(akd["broker"]) if b not in codes]
+        if new:
+            vocab += new
+            codes.update({b: i for i, b in enumerate(vocab)})
+            with open(os.path.join(path, "brokers.json"), "w", encoding="utf-8") as fh: json.dump(vocab, fh, ensure_ascii=False)
+        return {"broker": akd["broker"].map(codes).to_numpy(), "buy": _to_int(akd["buy"]), "sell": _to_int(akd["sell"]), "net": _to_int(akd["net"])}, 0, None
+
+    def append(self, symbol, kind, payload, ts=None):
+        """Yeni görüntüyü ekler; bir öncekiyle aynıysa atlar. Dönüş: eklendi mi"""
+        if kind not in SNAPSHOT_COLUMNS or payload is None: return False
+        digest = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+        ts = ts or time.time()
+        path = self._dir(symbol, kind, datetime.datetime.fromtimestamp(ts, BIST_TZ).date())
+        with self._lock:
+            if self._last_hash.get((symbol, kind)) == digest: return False
+            os.makedirs(path, exist_ok=True)
+            enc = self._encode(kind, payload, path)
+            if enc is None: return False
+            cols, base, last = enc
+            spec = SNAPSHOT_COLUMNS[kind]
+            first = next(iter(spec))
+            offset = os.path.getsize(os.path.join(path, f"{first}.bin")) // np.dtype(spec[first]).itemsize if os.path.exists(os.path.join(path, f"{first}.bin")) else 0
+            for col, dtype in spec.items():
+                with open(os.path.join(path, f"{col}.bin"), "ab") as fh: fh.write(np.asarray(cols[col]).astype(dtype).tobytes())
+            # İndeks en son yazılır: okuyucu yarım kalmış görüntüyü görmez
+            rec = np.array([(ts, offset, len(cols[first]), base, np.nan if last is None else last)], dtype=SNAPSHOT_INDEX)
+            with open(os.path.join(path, "index.bin"), "ab") as fh: fh.write(rec.tobytes())
+            self._last_hash[(symbol, kind)] = digest
+        return True
+
+    def _days(self, symbol, kind, start=None, end=None):
+        base = os.path.join(self.root, symbol.upper(), kind)
+        if not os.path.isdir(base): return []
+        lo = datetime.datetime.fromtimestamp(start, BIST_TZ).date().isoformat() if start else ""
+        hi = datetime.datetime.fromtimestamp(end, BIST_TZ).date().isoformat() if end else "9999"
+        return [d for d in sorted(os.listdir(base)) if lo <= d <= hi]
+
+    def times(self, symbol, kind, start=None, end=None):
+        """Aralıktaki görüntü zaman damgaları (epoch sn)"""
+        out = []
+        for day in self._days(symbol, kind, start, end):
+            ts = _memmap(os.path.join(self._dir(symbol, kind, day), "index.bin"), SNAPSHOT_INDEX)["ts"]
+            lo = np.searchsorted(ts, start, "left") if start else 0
+            hi = np.searchsorted(ts, end, "right") if end else len(ts)
+            out.extend(ts[lo:hi].tolist())
+        return out
+
+    def _read(self, path, kind, rec):
+        sl = slice(int(rec["offset"]), int(rec["offset"]) + int(rec["rows"]))
+        cols = {c: np.array(_memmap(os.path.join(path, f"{c}.bin"), dt)[sl]) for c, dt in SNAPSHOT_COLUMNS[kind].items()}
+        if kind == "derinlik":
+            side = pd.Series(cols["side"]).map({v: k for k, v in _SIDE_CODES.items()})
+            return pd.DataFrame({"price": (int(rec["base"]) + np.cumsum(cols["price"].astype("int64"))) / PRICE_SCALE,
+                                 "lot": _from_int(cols["lot"]), "side": side})
+        vocab = self._vocab(path)
+        return pd.DataFrame({"broker": [vocab[i] for i in cols["broker"]], "buy": _from_int(cols["buy"]),
+                             "sell": _from_int(cols["sell"]), "net": _from_int(cols["net"])})
+
+    def at(self, symbol, kind, ts=None):
+        """ts anındaki (ya da öncesindeki son) görüntü: (zaman, DataFrame, anlık fiyat) | None"""
+        for day in reversed(self._days(symbol, kind, None, ts)):
+            path = self._dir(symbol, kind, day)
+            idx = _memmap(os.path.join(path, "index.bin"), SNAPSHOT_INDEX)
+            i = (np.searchsorted(idx["ts"], ts, "right") if ts else len(idx)) - 1
+            if i >= 0:
+                rec = idx[i]
+                return float(rec["ts"]), self._read(path, kind, rec), (None if np.isnan(rec["last"]) else float(rec["last"]))
+        return None
+
+    def diff(self, symbol, kind, t0, t1=None):
+        """İki görüntü arasındaki fark. Derinlik: (taraf, fiyat) başına lot; AKD: kurum başına net.
+        Dönüş: (DataFrame[anahtar, önce, sonra, değişim], t0, t1) | None"""
+        a, b = self.at(symbol, kind, t0), self.at(symbol, kind, t1)
+        if a is None or b is None: return None
+        keys, val = (["side", "price"], "lot") if kind == "derinlik" else (["broker"], "net")
+        old = a[1].groupby(keys, dropna=False)[val].sum().rename("önce")
+        new = b[1].groupby(keys, dropna=False)[val].sum().rename("sonra")
+        d = pd.concat([old, new], axis=1).fillna(0)
+        d["değişim"] = d["sonra"] - d["önce"]
+        d = d[d["değişim"] != 0]
+        d = d.reindex(d["değişim"].abs().sort_values(ascending=False).index).reset_index()
+        return d, a[0], b[0]
+
+    def symbols(self):
+        return sorted(d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d)))
+
+    def prune(self, retention_days):
+        cutoff = (bist_now().date() - datetime.timedelta(days=retention_days)).isoformat()
+        for sym in self.symbols():
+            for kind in SNAPSHOT_COLUMNS:
+                for day in self._days(sym, kind):
+                    if day < cutoff:
+                        path = self._dir(sym, kind, day)
+                        for f in os.listdir(path): os.remove(os.path.join(path, f))
+                        os.rmdir(path)
+
+@st.cache_resource
+def get_snapshot_store():
+    return SnapshotStore()
+
+def render_snapshot_diff(result, kind, top_n=15):
+    """Görüntü farkını prompt için kısa metne çevirir"""
+    if result is None: return ""
+    d, t0, t1 = result
+    fmt = lambda t: datetime.datetime.fromtimestamp(t, BIST_TZ).strftime("%H:%M")
+    head = f"{'DEFTER' if kind == 'derinlik' else 'AKD'} DEĞİŞİMİ ({fmt(t0)} → {fmt(t1)})"
+    if d.empty: return f"{head}: değişiklik yok"
+    if kind == "derinlik":
+        rows = [f"{r.side or '?'} {r.price:g}: {int(r.önce):,} → {int(r.sonra):,} ({int(r.değişim):+,})" for r in d.head(top_n).itertuples()]
+    else:
+        rows = [f"{r.broker}: net {int(r.önce):+,} → {int(r.sonra):+,} ({int(r.değişim):+,})" for r in d.head(top_n).itertuples()]
+    return head + "\n" + "\n".join(rows)
+
+# ==========================================
+# 📆 ÇOK GÜNLÜ AKD (gün bazlı önbellek)
+# ==========================================
+AKD_CACHE_DB = os.environ.get("AKD_CACHE_DB", "akd_days.sqlite3")
+AKD_RANGE_OPTIONS = {1: "Bugün", 5: "Son 5 seans", 20: "Son 20 seans"}
+
+def recent_sessions(n, now=None):
+    """Son n seans günü (bugün seans başladıysa dahil). Hafta sonu atlanır; resmi tatiller boş gün olarak gelir."""
+    now = now or bist_now()
+    day = now.date() if now.weekday() < 5 and now.time() >= BIST_OPEN else now.date() - datetime.timedelta(days=1)
+    days = []
+    while len(days) < n:
+        if day.weekday() < 5: days.append(day)
+        day -= datetime.timedelta(days=1)
+    return days[::-1]
+
+class AKDDayCache:
+    """Kapanmış günlerin ham AKD yanıtları; değişmedikleri için süresiz saklanır"""
+    def __init__(self, path=AKD_CACHE_DB):
+        self.path = path
+        with self._conn() as c:
+            c.execute("CREATE TABLE IF NOT EXISTS akd_days (symbol TEXT, day TEXT, payload TEXT, PRIMARY KEY (symbol, day))")
+
+    def _conn(self): return sqlite3.connect(self.path, timeout=5)
+
+    def get_many(self, symbol, days):
+        marks = ",".join("?" * len(days))
+        with self._conn() as c:
+            rows = c.execute(f"SELECT day, payload FROM akd_days WHERE symbol=? AND day IN ({marks})", (symbol, *days)).fetchall()
+        return {d: json.loads(p) for d, p in rows}
+
+    def put(self, symbol, day, payload):
+        with self._conn() as c:
+            c.execute("INSERT OR REPLACE INTO akd_days VALUES (?,?,?)", (symbol, day, json.dumps(payload, ensure_ascii=False)))
+
+@st.cache_resource
+def get_akd_day_cache():
+    return AKDDayCache()
+
+def fetch_akd_range(symbol, n_sessions, now=None):
+    """Son n seansın AKD'si: kapanmış günler kalıcı önbellekten, yalnızca eksikler (ve bugün) ağdan.
+    Dönüş: ({gün: payload | None}, ağdan çekilen gün sayısı)"""
+    now = now or bist_now()
+    days = [d.isoformat() for d in recent_sessions(n_sessions, now)]
+    today = now.date().isoformat()
+    cache = get_akd_day_cache()
+    payloads = cache.get_many(symbol, [d for d in days if d < today])
+    missing = [d for d in days if d not in payloads]
+    futures = {d: _fetch_pool().submit(fetch_endpoint, symbol, "akd", d) for d in missing}
+    for d, fut in futures.items():
+        try: payloads[d] = fut.result()
+        except Exception: payloads[d] = None
+        # Tatil günü boş yanıt da kalıcıdır; hata (None) saklanmaz, sonra yeniden denenir
+        if d < today and payloads[d] is not None: cache.put(symbol, d, payloads[d])
+    return {d: payloads.get(d) for d in days}, len(missing)
+
+def aggregate_akd_range(payloads):
+    """Gün bazlı AKD'leri kurum × gün net tablosunda birleştirir (vektörel).
+    Dönüş: DataFrame[toplam_net, alış, satış, aktif_gün, alıcı_gün, son_gün_net] (net toplamına göre sıralı)"""
+    frames = [normalize_akd(p).assign(day=d) for d, p in payloads.items() if p]
+    frames = [f for f in frames if not f.empty]
+    if not frames: return pd.DataFrame()
+    akd = pd.concat(frames, ignore_index=True)
+    net = akd.pivot_table(index="broker", columns="day", values="net", aggfunc="sum", fill_value=0).sort_index(axis=1)
+    sums = akd.groupby("broker")[["buy", "sell"]].sum(min_count=1)
+    out = pd.DataFrame({
+        "toplam_net": net.sum(axis=1),
+        "alış": sums["buy"], "satış": sums["sell"],
+        "aktif_gün": (net != 0).sum(axis=1),
+        "alıcı_gün": (net > 0).sum(axis=1),
+        "son_gün_net": net.iloc[:, -1],
+    })
+    out.index.name = "kurum"
+    return out.sort_values("toplam_net", ascending=False)
+
+def render_akd_range(agg, n_days, top_n=8):
+    """Aralık toplamını prompt için kısa metne çevirir"""
+    if agg is None or agg.empty: return ""
+    fmt = lambda rows: "; ".join(f"{b} {int(r.toplam_net):+,} ({r.alıcı_gün}/{r.aktif_gün} gün alıcı)" for b, r in rows.iterrows()) or "-"
+    return (f"Dönem: son {n_days} seans\n"
+            f"Net alıcılar: {fmt(agg[agg['toplam_net'] > 0].head(top_n))}\n"
+            f"Net satıcılar: {fmt(agg[agg['toplam_net'] < 0].iloc[::-1].head(top_n))}")
+
+# ==========================================
+# 🧩 PARÇALI ANALİZ (MAP-REDUCE)
+# ==========================================
+MAP_MODEL_PRIORITY = ["gemini-2.5-flash-lite", "gemini-2.5-flash"]
+MAP_WORKERS = 4
+MAP_SECTION_PROMPT = """
+Sen Borsa Veri Analistisin. Sadece {cat} verisine bakıyorsun; rapor yazma, giriş cümlesi yazma.
+1. Görünen anlık fiyatı ve tablodaki tüm sayısal veriyi (fiyat, lot/adet, kurum, oran) kompakt madde listesi olarak çıkar.
+2. En fazla 5 kısa gözlem ekle (yığılma, balina, dengesizlik) ve her birini :green[**OLUMLU**], :blue[**NÖTR**] veya :red[**OLUMSUZ**] olarak işaretle.
+3. Anlık fiyattan yüksek emirler SATIŞ (DİRENÇ), düşük emirler ALIŞ (DESTEK) emirleridir.
+"""
+
+@st.cache_resource
+def _map_pool():
+    return ThreadPoolExecutor(max_workers=MAP_WORKERS, thread_name_prefix="mapreduce")
+
+def _map_one(cat, digests, text, image_store, config, keys, preferred_key, use_cache):
+    contents = image_store.prepare_many(digests, config) + ([text] if text else []) + [MAP_SECTION_PROMPT.format(cat=cat)]
+    cache_key = analysis_fingerprint(digests, [text], None, f"map:{cat}", None, MAP_MODEL_PRIORITY[0], MAP_SECTION_PROMPT)
+    cached = get_analysis_cache().get(cache_key) if use_cache else None
+    if cached: return cached["result"], True
+    with trace_span("parça_analizi", cat=cat, images=len(digests)):
+        result = generate_with_pool(keys, MAP_MODEL_PRIORITY, contents, preferred_key=preferred_key)
+    if use_cache: get_analysis_cache().put(cache_key, result, MAP_MODEL_PRIORITY[0], analysis_ttl())
+    return result, False
+
+def run_category_map(groups, image_store, config, keys, texts=None, use_cache=True, on_done=None):
+    """Her kategori ayrı (lite) çağrıda, farklı anahtarlara dağıtılarak eşzamanlı özetlenir.
+    groups: {kategori: [digest]}, texts: {kategori: metin bağlamı}. Dönüş: {kategori: özet} (grup sırasıyla)
+    Hata alan kategorinin özeti None olur; çağıran o kategorinin verisini ana isteğe doğrudan ekler.
+    Tüm kategoriler key kaynaklı düşerse KeyUnavailable fırlatılır.
+    on_done(kategori, önbellekten_mi) ana thread'de çağrılır (hatada önbellekten_mi None)."""
+    texts = texts or {}
+    cats = [c for c in dict.fromkeys(list(groups) + list(texts)) if groups.get(c) or texts.get(c)]
+    ranked_keys = list(dict.fromkeys(k for k, _ in schedule_candidates(keys, MAP_MODEL_PRIORITY)))
+    futures = {_map_pool().submit(_map_one, cat, groups.get(cat, []), texts.get(cat, ""), image_store, config, keys,
+                                  ranked_keys[i % len(ranked_keys)] if ranked_keys else None, use_cache): cat
+               for i, cat in enumerate(cats)}
+    results, errors = {}, {}
+    for fut in as_completed(futures):
+        cat = futures[fut]
+        try: results[cat], cached = fut.result()
+        except Exception as e: results[cat], cached, errors[cat] = None, None, e
+        if on_done: on_done(cat, cached)
+    if cats and len(errors) == len(cats) and all(isinstance(e, KeyUnavailable) for e in errors.values()):
+        raise next(iter(errors.values()))
+    return {cat: results[cat] for cat in cats}
+
+def render_partials(partials):
+    return "\n\n".join(f"--- {cat.upper()} ÖN ANALİZİ ---\n{txt}" for cat, txt in partials.items() if txt is not None)
+
+# ==========================================
+# 🖋️ AKIŞ GÖRÜNTÜLEYİCİ
+# ==========================================
+STREAM_RENDER_INTERVAL = 0.25   # Kuyruk en fazla bu aralıkla yeniden çizilir (sn)
+STREAM_RENDER_MIN_CHARS = 400   # ...ya da bu kadar yeni karakter birikince
+
+class StreamRenderer:
+    """Akan raporu parça parça çizer. Tamamlanan bölümler (## başlıkları) sabit öğe olarak bir kez yazılır,
+    sadece aktif kuyruk yeniden çizilir; kuyruk güncellemeleri zaman/boyut eşiğiyle toplanır.
+    Böylece tarayıcıya giden veri rapor uzunluğunun karesiyle değil, doğrusal büyür."""
+    def __init__(self, target=None, interval=STREAM_RENDER_INTERVAL, min_chars=STREAM_RENDER_MIN_CHARS, clock=time.perf_counter):
+        self.root = target if target is not None else st.empty()
+        self.interval, self.min_chars, self.clock = interval, min_chars, clock
+        self.reset()
+
+    def reset(self):
+        """Akış baştan başlarken (ör. anahtar değişimi) çizilenleri temizler"""
+        self.text, self.committed, self.pending, self.last_flush = "", 0, 0, float("-inf")
+        self.stats = {"mesaj": 0, "bayt": 0}
+        self.box = self.root.container()
+        self.tail = self.box.empty()
+
+    def _emit(self, slot, body):
+        slot.markdown(body)
+        self.stats["mesaj"] += 1
+        self.stats["bayt"] += len(body.encode("utf-8"))
+
+    def feed(self, chunk):
+        if not chunk: return
+        self.text += chunk
+        self.pending += len(chunk)
+        now = self.clock()
+        if self.pending >= self.min_chars or now - self.last_flush >= self.interval: self._flush(now)
+
+    def _flush(self, now, final=False):
+        cut = self.text.rfind("\n## ", self.committed)
+        if cut > self.committed:
+            # Son başlıktan öncesi tamamlandı: mevcut kuyruğa son hali yazılır, yeni kuyruk açılır
+            self._emit(self.tail, self.text[self.committed:cut])
+            self.tail = self.box.empty()
+            self.committed = cut + 1
+        self._emit(self.tail, self.text[self.committed:] + ("" if final else "▌"))
+        self.pending, self.last_flush = 0, now
+
+    def finish(self):
+        self._flush(self.clock(), final=True)
+        return self.text
+
+class _CountingSlot:
+    """Ölçüm için st.empty()/container() yerine geçen, gönderilen baytı sayan hedef"""
+    def __init__(self, stats=None): self.stats = stats if stats is not None else {"mesaj": 0, "bayt": 0}
+    def markdown(self, body):
+        self.stats["mesaj"] += 1
+        self.stats["bayt"] += len(body.encode("utf-8"))
+    def empty(self): return _CountingSlot(self.stats)
+    def container(self): return self
+
+def benchmark_stream_render(n_sections=50, items=8, chunk_chars=60, chunk_interval=0.05):
+    """Sentetik uzun akışta (GELİŞMİŞ rapor boyutu) her parçada tam yeniden çizim ile StreamRenderer karşılaştırması.
+    Bayt: öğelere gönderilen markdown gövdesi (websocket yükünün baskın kısmı). Akış saati simüle edilir."""
+    report = "".join(f"## {i + 1}. BÖLÜM\n" + "".join(f"* Madde {j + 1}: 22.58 seviyesinde 1.250.000 lot yığılma :green[**OLUMLU**]\n" for j in range(items)) + "\n"
+                     for i in range(n_sections))
+    chunks = [report[i:i + chunk_chars] for i in range(0, len(report), chunk_chars)]
+    rows = []
+
+    sink = _CountingSlot()
+    slot, full = sink.empty(), ""
+    t0 = time.perf_counter()
+    for c in chunks:
+        full += c
+        slot.markdown(full + "▌")
+    slot.markdown(full)
+    rows.append({"yöntem": "her parçada tam çizim", **sink.stats, "ms": round((time.perf_counter() - t0) * 1000, 1)})
+
+    fake_now = [0.0]
+    renderer = StreamRenderer(_CountingSlot(), clock=lambda: fake_now[0])
+    t0 = time.perf_counter()
+    for c in chunks:
+        fake_now[0] += chunk_interval
+        renderer.feed(c)
+    renderer.finish()
+    rows.append({"yöntem": "StreamRenderer", **renderer.stats, "ms": round((time.perf_counter() - t0) * 1000, 1)})
+    for r in rows: r["bayt"] = f"{r['bayt'] / 1024:,.0f} KB"
+    return rows, {"karakter": len(report), "parça": len(chunks)}
+
+# ==========================================
+# ⏱️ ANALİZ HATTI ZAMANLAYICISI
+# ==========================================
+class PipelineTimer:
+    """Aşama başlangıç/süre kaydı (ms). Eşzamanlı aşamalar farklı thread'lerden yazabilir."""
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def _record(self, name, start):
+        end = time.perf_counter()
+        with self._lock:
+            self.stages[name] = {"başlangıç_ms": round((start - self.t0) * 1000, 1), "süre_ms": round((end - start) * 1000, 1)}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try: yield
+        finally: self._record(name, start)
+
+    def timed(self, name, fn):
+        """Havuzda çalışacak fonksiyonu aşama olarak sarar"""
+        def run(*args, **kwargs):
+            with self.stage(name): return fn(*args, **kwargs)
+        return run
+
+    def mark(self, name):
+        """Anlık nokta: başlangıçtan bu yana geçen süre (ör. ilk parça = TTFT)"""
+        elapsed = round((time.perf_counter() - self.t0) * 1000, 1)
+        with self._lock: self.stages[name] = {"başlangıç_ms": elapsed, "süre_ms": elapsed}
+
+    def finish(self):
+        """Özeti ortak halkaya yazar, aşamaları span olarak kaydeder ve döndürür"""
+        with self._lock: summary = {k: dict(v) for k, v in self.stages.items()}
+        _pipeline_timings().append(summary)
+        for name, v in summary.items(): record_span(f"analiz.{name}", v["süre_ms"] / 1000)
+        return summary
+
+@st.cache_resource
+def _pipeline_timings():
+    return deque(maxlen=200)
+
+# ==========================================
+# 💬 SOHBET BAĞLAMI (rapor dizini + son turlar)
+# ==========================================
+CHAT_MAX_SECTIONS = 3          # Soru başına gönderilecek en ilgili rapor bölümü
+CHAT_RECENT_TURNS = 4          # Bağlama eklenecek son mesaj sayısı
+
+def _words(text):
+    return {w for w in "".join(ch if ch.isalnum() else " " for ch in text.translate(_TR_CHARS).lower()).split() if len(w) >= 3}
+
+def build_report_index(report):
+    """Raporu '## ' başlıklarından bölümlere ayırır ve bir kez kompakt özet çıkarır"""
+    sections, title, body = [], "GİRİŞ", []
+    for line in report.splitlines():
+        if line.startswith("## "):
+            if "".join(body).strip(): sections.append((title, "\n".join(body).strip()))
+            title, body = line[3:].strip(), []
+        else: body.append(line)
+    if "".join(body).strip(): sections.append((title, "\n".join(body).strip()))
+    summary = []
+    for t, b in sections:
+        first = next((l.strip(" -*") for l in b.splitlines() if l.strip(" -*")), "")
+        summary.append(f"- {t}: {first[:160]}")
+    return {"summary": "\n".join(summary),
+            "sections": [(t, b, _words(f"{t} {b}")) for t, b in sections]}
+
+def select_sections(index, question, k=CHAT_MAX_SECTIONS):
+    """Soruyla kelime örtüşmesi en yüksek bölümler (başlık eşleşmesi ağırlıklı)"""
+    q = _words(question)
+    scored = []
+    for i, (t, b, words) in enumerate(index["sections"]):
+        score = len(q & words) + 2 * len(q & _words(t))
+        if score: scored.append((score, -i, t, b))
+    return [(t, b) for _, _, t, b in sorted(scored, reverse=True)[:k]]
+
+def build_chat_prompt(index, history, question, scope):
+    sys_inst = ("GÖREV: Sadece rapora sadık kal." if scope == "📝 RAPOR" else "GÖREV: Raporu temel al ama genel borsa bilginle yorum kat.")
+    parts = [sys_inst, f"RAPOR ÖZETİ:\n{index['summary']}"]
+    relevant = select_sections(index, question)
+    if relevant: parts.append("İLGİLİ BÖLÜMLER:\n" + "\n\n".join(f"## {t}\n{b}" for t, b in relevant))
+    recent = history[-CHAT_RECENT_TURNS:]
+    if recent:
+        parts.append("SON KONUŞMA:\n" + "\n".join(f"{'Kullanıcı' if m['role'] == 'user' else 'Analist'}: {m['content'][:600]}" for m in recent))
+    parts.append(f"SORU:\n{question}")
+    return "\n\n".join(parts)
+
+def get_report_index(report):
+    """Rapor değişmedikçe dizin oturumda saklanır"""
+    digest = hashlib.sha256(report.encode("utf-8")).hexdigest()
+    cached = st.session_state.get("report_index")
+    if not cached or cached[0] != digest:
+        st.session_state.report_index = (digest, build_report_index(report))
+    return st.session_state.report_index[1]
+
+
+
+get_prefetcher()
+
+# ==========================================
+# --- SESSION INIT ---
+# ==========================================
+if "authenticated" not in st.session_state: st.session_state.authenticated = False
+if "is_admin" not in st.session_state: st.session_state.is_admin = False
+if "reset_counter" not in st.session_state: st.session_state.reset_counter = 0
+if "analysis_result" not in st.session_state: st.session_state.analysis_result = None
+if "messages" not in st.session_state: st.session_state.messages = []
+if "loaded_count" not in st.session_state: st.session_state.loaded_count = 0
+if "active_working_key" not in st.session_state: st.session_state.active_working_key = None
+
+# Oturumda yalnızca tanıtıcılar: API yanıtları sıkıştırılmış, görseller PNG olarak SessionStore'da
+if "api_depth_ref" not in st.session_state: st.session_state.api_depth_ref = None
+if "api_akd_ref" not in st.session_state: st.session_state.api_akd_ref = None
+if "tg_img_derinlik" not in st.session_state: st.session_state.tg_img_derinlik = None
+if "tg_img_akd" not in st.session_state: st.session_state.tg_img_akd = None
+if "tg_img_kademe" not in st.session_state: st.session_state.tg_img_kademe = None
+if "tg_img_takas" not in st.session_state: st.session_state.tg_img_takas = None
+
+# API KEY INIT
+if "api_keys" not in st.session_state:
+    api_keys_raw = st.secrets.get("GOOGLE_API_KEY", "")
+    st.session_state.api_keys = [k.strip() for k in api_keys_raw.split(",") if k.strip()]
+
+for cat in ["Derinlik", "AKD", "Kademe", "Takas"]:
+    if f"pasted_{cat}" not in st.session_state: 
+        st.session_state[f"pasted_{cat}"] = []
+    if f"pasted_{cat}_hashes" not in st.session_state:
+        st.session_state[f"pasted_{cat}_hashes"] = []
+
+api_keys = st.session_state.api_keys 
+get_key_health_checker().register(session_id(), api_keys)
+get_session_store().touch(session_id())
+api_depth_data = load_payload(st.session_state.api_depth_ref)
+api_akd_data = load_payload(st.session_state.api_akd_ref)
+
+# --- AUTH LOGIC ---
+query_params = st.query_params
+admin_secret = st.secrets.get("ADMIN_KEY", "admin123") 
+
+if query_params.get("admin") == admin_secret:
+    st.session_state.authenticated = True
+    st.session_state.is_admin = True
+
+def check_password():
+    if "APP_PASSWORD" in st.secrets:
+        correct_password = st.secrets["APP_PASSWORD"]
+    else:
+        st.error("🚨 Secrets Hatası.")
+        st.stop()
+
+    input_pass = st.session_state.get("password_input", "")
+    if input_pass == admin_secret:
+        st.session_state.authenticated = True
+        st.session_state.is_admin = True
+        return
+    if input_pass == correct_password:
+        if global_config["beta_active"]:
+            st.session_state.authenticated = True
+            st.session_state.is_admin = False
+        else:
+            st.error("🔒 Beta kapalı.")
+    elif input_pass:
+        st.error("❌ Hatalı Kod!")
+
+# --- LOGIN SCREEN ---
+if not st.session_state.authenticated:
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col2:
+        st.markdown("<div style='border: 2px solid #00d4ff; padding: 40px; border-radius: 15px; background-color: #1E2130; text-align: center; margin-top: 50px;'>", unsafe_allow_html=True)
+        st.title("🔒 Beta Erişim")
+        if global_config["beta_active"]:
+            st.text_input("Giriş Kodu:", type="password", key="password_input", on_change=check_password)
+            if st.button("Giriş Yap"): check_password()
+        else:
+            st.warning("⚠️ BAKIMDA")
+            with st.expander("Yönetici"):
+                st.text_input("Admin:", type="password", key="password_input", on_change=check_password)
+                if st.button("Yönetici Gir"): check_password()
+        st.markdown("</div>", unsafe_allow_html=True)
+    st.stop() 
+
+# ==========================================
+# 🚀 MAIN APP
+# ==========================================
+
+col_title, col_reset = st.columns([5, 1])
+with col_title:
+    st.title("🐋 BIST Yapay Zeka PRO")
+    if st.session_state.is_admin: st.success("👑 YÖNETİCİ MODU")
+    else: st.info("Küçük Yatırımcının Büyüdüğü Bir Evren..")
+
+with col_reset:
+    st.markdown("<br>", unsafe_allow_html=True)
+    if st.button("🔄 SİSTEMİ SIFIRLA", type="secondary"):
+        st.session_state.reset_counter += 1
+        get_session_store().release_session(session_id())
+        st.session_state.api_depth_ref = None
+        st.session_state.api_akd_ref = None
+        st.session_state.api_akd_range = None
+        st.session_state.tg_img_derinlik = None
+        st.session_state.tg_img_akd = None
+        st.session_state.tg_img_kademe = None
+        st.session_state.tg_img_takas = None
+        
+        keys_to_keep = ["authenticated", "is_admin", "reset_counter", "api_depth_ref", "api_akd_ref", "api_akd_range", "tg_img_derinlik", "tg_img_akd", "tg_img_kademe", "tg_img_takas", "api_keys"]
+        for key in list(st.session_state.keys()):
+            if key not in keys_to_keep: del st.session_state[key]
+        for cat in ["Derinlik", "AKD", "Kademe", "Takas"]:
+            st.session_state[f"pasted_{cat}"] = []
+            st.session_state[f"pasted_{cat}_hashes"] = []
+        st.rerun()
+
+# --- API & DATA FETCH SECTION ---
+st.markdown("---")
+st.subheader("📡 Veri Merkezi")
+
+api_col1, api_col3, api_col2 = st.columns([2, 1, 1])
+with api_col1:
+    api_ticker_input = st.text_input("Hisse Kodu:", "THYAO", key="api_ticker").upper()
+with api_col3:
+    akd_range = st.selectbox("AKD Aralığı:", list(AKD_RANGE_OPTIONS), format_func=AKD_RANGE_OPTIONS.get, key="akd_range")
+with api_col2:
+    st.markdown("<br>", unsafe_allow_html=True)
+    fetch_btn = st.button("Derinlik - AKD Verilerini AL", type="primary")
+
+if fetch_btn:
+    with st.spinner(f"{api_ticker_input} Verileri Çekiliyor..."):
+        market_data, market_errors = fetch_market_data(api_ticker_input)
+    api_depth_data, api_akd_data = market_data.get("derinlik"), market_data.get("akd")
+    get_session_store().release(session_id(), st.session_state.api_depth_ref, st.session_state.api_akd_ref)
+    try: st.session_state.api_depth_ref, st.session_state.api_akd_ref = store_payload(api_depth_data), store_payload(api_akd_data)
+    except SessionQuotaExceeded as e:
+        st.session_state.api_depth_ref = st.session_state.api_akd_ref = None
+        st.warning(f"⚠️ {e}. Veri yalnızca bu çalıştırmada kullanılabilir; eski görselleri silin.")
+    for ep, e in market_errors.items():
+        st.error(f"API Hatası ({ep}): {e}")
+    st.session_state.api_akd_range = None
+    if akd_range > 1:
+        with st.spinner(f"{AKD_RANGE_OPTIONS[akd_range]} AKD toplanıyor..."), trace_span("akd_aralığı", symbol=api_ticker_input, days=akd_range) as span:
+            day_payloads, fetched = fetch_akd_range(api_ticker_input, akd_range)
+            span["fetched"] = fetched
+            st.session_state.api_akd_range = (akd_range, aggregate_akd_range(day_payloads))
+        st.caption(f"📆 {akd_range} seans: {fetched} gün ağdan, {akd_range - fetched} gün önbellekten")
+
+if st.session_state.get("api_akd_range"):
+    with st.expander(f"📆 AKD — son {st.session_state.api_akd_range[0]} seans"):
+        st.dataframe(st.session_state.api_akd_range[1], use_container_width=True)
+
+# --- DATA STATUS ---
+if api_depth_data or api_akd_data:
+    st.markdown("##### 📊 Veri Durumu")
+    stat_col1, stat_col2 = st.columns(2)
+    with stat_col1:
+        if api_depth_data: st.success("API DERİNLİK 🟢")
+        else: st.error("API DERİNLİK 🔴")
+    with stat_col2:
+        if api_akd_data: st.success("API AKD 🟢")
+        else: st.error("API AKD 🔴")
+
+    # Gün içi karşılaştırma: kaydedilmiş görüntülerden biri seçilirse fark analize eklenir
+    day_start = bist_now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+    snap_times = get_snapshot_store().times(api_ticker_input, "derinlik", day_start) or get_snapshot_store().times(api_ticker_input, "akd", day_start)
+    fmt_ts = lambda t: "Karşılaştırma yok" if t is None else datetime.datetime.fromtimestamp(t, BIST_TZ).strftime("%H:%M:%S")
+    if len(snap_times) > 1:
+        st.selectbox("🕰️ Şu andan beri değişimi analize ekle:", [None] + snap_times[-2::-1], format_func=fmt_ts, key="snapshot_compare")
+
+valid_model_name = None
+working_key = None
+with trace_span("model_çözümleme", keys=len(api_keys)) as span:
+    for k in api_keys:
+        mod = get_model(k)
+        if mod: 
+            valid_model_name = mod
+            working_key = k 
+            break
+    span["model"] = valid_model_name
+
+if not valid_model_name:
+    st.error("❌ Aktif Model Bulunamadı. Lütfen API anahtarlarınızı kontrol edin.")
+    if not st.session_state.is_admin: st.stop()
+
+# --- BATCH SCAN SECTION ---
+with st.expander("🔎 Toplu Tarama (Çoklu Hisse Sıralaması)"):
+    scan_raw = st.text_area("Semboller (virgülle):", ", ".join(global_config.get("watchlist", [])), key="scan_symbols_input")
+    scan_top_k = st.slider("Gemini yorumu alacak aday sayısı", 0, 10, SCAN_TOP_K, key="scan_top_k")
+    scan_table = st.empty()
+    if st.button("🔎 Tara ve Sırala", use_container_width=True, key="scan_btn"):
+        symbols = list(dict.fromkeys(w.strip().upper() for w in scan_raw.split(",") if w.strip()))
+        if not symbols: st.warning("⚠️ Sembol girin.")
+        else:
+            scan_progress = st.progress(0.0)
+            def on_scan_update(df, done):
+                scan_table.dataframe(df, use_container_width=True)
+                scan_progress.progress(done / len(symbols), text=f"{done}/{len(symbols)} sembol")
+            with trace_span("toplu_tarama", symbols=len(symbols)):
+                signals, payloads = run_scan(symbols, on_scan_update)
+            if scan_top_k and not signals.empty and api_keys:
+                def on_comment(comments):
+                    scan_table.dataframe(signals.assign(yorum=pd.Series(comments)), use_container_width=True)
+                comments = comment_candidates(signals, payloads, api_keys, scan_top_k, on_comment)
+                signals = signals.assign(yorum=pd.Series(comments))
+            st.session_state.scan_results = signals
+    if st.session_state.get("scan_results") is not None:
+        scan_table.dataframe(st.session_state.scan_results, use_container_width=True)
+        st.caption("Skor: " + " + ".join(f"{w:g}×{c}" for c, w in SCAN_WEIGHTS.items()) + " (pozitif = alış baskısı). Sütun başlığına tıklayarak sıralayın.")
+
+# --- UPLOAD SECTION ---
+file_key_suffix = str(st.session_state.reset_counter)
+
+def handle_paste(cat):
+    if PASTE_ENABLED:
+        res = paste_image_button(
+            label=f"📋 Yapıştır", 
+            background_color="#1E2130", hover_background_color="#333",
+            key=f"paste_{cat}_{file_key_suffix}"
+        )
+        if res.image_data is not None:
+            digest = get_image_store().add(res.image_data)
+            if digest not in st.session_state[f"pasted_{cat}_hashes"]:
+                # Oturumda PIL nesnesi değil, sıkıştırılmış görselin tanıtıcısı tutulur
+                try: st.session_state[f"pasted_{cat}"].append(store_image(res.image_data))
+                except SessionQuotaExceeded as e:
+                    st.warning(f"⚠️ {e}. Eski görselleri silin.")
+                    return
+                st.session_state[f"pasted_{cat}_hashes"].append(digest)
+
+def show_images(cat):
+    if st.session_state[f"pasted_{cat}"]:
+        st.markdown(f"**📋 Pano ({len(st.session_state[f'pasted_{cat}'])}):**")
+        cols = st.columns(3)
+        for i, handle in enumerate(st.session_state[f"pasted_{cat}"]):
+            with cols[i % 3]:
+                data = get_session_store().get(handle)
+                if data is not None: st.image(data, use_container_width=True)
+                if st.button("🗑️ Sil", key=f"del_{cat}_{i}_{st.session_state.reset_counter}"):
+                    get_session_store().release(session_id(), st.session_state[f"pasted_{cat}"].pop(i))
+                    st.session_state[f"pasted_{cat}_hashes"].pop(i)
+                    st.rerun() 
+        if st.button(f"🗑️ Tüm {cat} Görsellerini Temizle", key=f"clear_all_{cat}"):
+            get_session_store().release(session_id(), *st.session_state[f"pasted_{cat}"])
+            st.session_state[f"pasted_{cat}"] = []
+            st.session_state[f"pasted_{cat}_hashes"] = []
+            st.rerun()
+
+def render_category_panel(title, cat_name, tg_session_key, uploader_key):
+    st.markdown(f"### {title}")
+    tg_image = open_blob_image(st.session_state[tg_session_key])
+    if tg_image is not None:
+        with st.container(border=True):
+            st.caption("📲 Telegram'dan Alındı")
+            st.image(tg_image, width=100, caption="TG Verisi") 
+            if st.button("🗑️ Kaldır", key=f"del_tg_{cat_name}"):
+                st.session_state[tg_session_key] = None
+                st.rerun()
+    uploaded_files = st.file_uploader("Dosya Yükle", type=["jpg","png","jpeg"], key=uploader_key, accept_multiple_files=True)
+    handle_paste(cat_name) 
+    show_images(cat_name)  
+    return uploaded_files
+
+col1, col2 = st.columns(2)
+with col1:
+    img_d = render_category_panel("1. Derinlik 💹", "Derinlik", "tg_img_derinlik", f"d_{file_key_suffix}")
+    st.markdown("---") 
+    img_k = render_category_panel("3. Kademe 📊", "Kademe", "tg_img_kademe", f"k_{file_key_suffix}")
+with col2:
+    img_a = render_category_panel("2. AKD 🤵", "AKD", "tg_img_akd", f"a_{file_key_suffix}")
+    st.markdown("---") 
+    img_t = render_category_panel("4. Takas 🌍", "Takas", "tg_img_takas", f"t_{file_key_suffix}")
+
+# --- SIDEBAR ---
+def add_api_key():
+    new_key = st.session_state.new_api_key_input.strip()
+    if new_key and new_key not in st.session_state.api_keys:
+        st.session_state.api_keys.append(new_key)
+        st.session_state.new_api_key_input = ""
+        st.rerun()
+
+def delete_api_key(key_to_delete):
+    if key_to_delete in st.session_state.api_keys:
+        st.session_state.api_keys.remove(key_to_delete)
+        get_key_health_checker().register(session_id(), st.session_state.api_keys)
+        st.rerun()
+
+with st.sidebar:
+    if st.session_state.is_admin:
+        st.subheader("⚙️ Yönetici Kontrol Paneli")
+        curr = global_config["beta_active"]
+        new_s = st.toggle("Beta Açık", value=curr)
+        if new_s != curr:
+            global_config["beta_active"] = new_s
+            save_global_config(global_config)
+            st.rerun()
+
+        with st.expander("🔑 API Anahtar Havuzu Yönetimi", expanded=True):
+            st.markdown(f"<span style='font-size: small;'>Aktif Key Sayısı: {len(api_keys)}</span>", unsafe_allow_html=True)
+            st.text_input("Yeni Key Ekle:", type="password", key="new_api_key_input")
+            if st.button("➕ Anahtarı Ekle", on_click=add_api_key, use_container_width=True): pass
+            st.markdown("---")
+            for k in api_keys:
+                cols = st.columns([1, 3, 2])
+                key_display = f"<span style='font-size: x-small; font-weight: bold;'>...{k[-4:]}</span>"
+                if any(key_health_snapshot(k, m)["probe_ts"] for m in PROBE_MODELS.values()):
+                    status_text = f"<span style='font-size: xx-small;'>Lite: {key_status_label(k, 'lite')} | Flash: {key_status_label(k, 'flash')}</span>"
+                else:
+                    status_text = "<span style='font-size: x-small;' class='key-status-limit'>❓ TEST ET</span>"
+                with cols[0]:
+                    if st.button("❌", key=f"del_key_{k[-4:]}_v4", on_click=delete_api_key, args=(k,)): pass
+                with cols[1]: st.markdown(key_display, unsafe_allow_html=True)
+                with cols[2]: st.markdown(status_text, unsafe_allow_html=True)
+            st.markdown("---")
+            full_probe = st.checkbox("Tam test (üretim kotası harcar)", key="full_probe_checkbox", value=False)
+            if st.button("🔄 Kota Testi", use_container_width=True, key="admin_key_test"):
+                prog = st.progress(0)
+                run_health_check(api_keys, full=full_probe, on_progress=prog.progress)
+                prog.empty()
+                st.rerun()
+            checker = get_key_health_checker()
+            if checker.last_run: st.caption(f"🩺 Son arka plan testi: {time.strftime('%H:%M', time.localtime(checker.last_run))}")
+
+        with st.expander("🧠 Oturum Belleği"):
+            mem = get_session_store().stats()
+            img_stats = get_image_store().stats()
+            st.caption(f"Bellek: {mem['mem_bytes'] / 1048576:.1f}/{SESSION_MEM_MAX_BYTES / 1048576:.0f} MB · Disk: {mem['disk_bytes'] / 1048576:.1f} MB · "
+                       f"Blok: {mem['blocks']} · Çözülmüş görsel deposu: {img_stats['bytes'] / 1048576:.1f} MB ({img_stats['items']})")
+            if mem["sessions"]: st.dataframe(pd.DataFrame(mem["sessions"]).sort_values("MB", ascending=False), use_container_width=True, hide_index=True)
+            if st.button("🧹 Boştaki Oturumları Temizle", use_container_width=True, key="evict_sessions_btn"):
+                st.toast(f"{get_session_store().evict_idle(SESSION_IDLE_TTL / 4)} oturum temizlendi")
+
+        with st.expander("🛰️ Ön Yükleme (İzleme Listesi)"):
+            pf_active = st.toggle("Arka Planda Güncel Tut", value=global_config.get("prefetch_active", False), key="prefetch_toggle")
+            wl_raw = st.text_area("Semboller (virgülle):", ", ".join(global_config.get("watchlist", [])), key="watchlist_input")
+            if st.button("💾 Kaydet", use_container_width=True, key="save_watchlist_btn"):
+                global_config["prefetch_active"] = pf_active
+                global_config["watchlist"] = [w.strip().upper() for w in wl_raw.split(",") if w.strip()]
+                save_global_config(global_config)
+                st.rerun()
+            pf = get_prefetcher()
+            st.caption(f"Tur: {pf.stats['rounds']} · Çekilen: {pf.stats['fetched']} · Hata: {pf.stats['errors']} · Atlanan: {pf.stats['dropped']} · Kuyruk: {pf.queue.qsize()}/{PREFETCH_QUEUE_SIZE}")
+
+        with st.expander("📈 Gecikme Panosu"):
+            summary = trace_summary()
+            if summary.empty: st.caption("Henüz ölçüm yok.")
+            else:
+                st.dataframe(summary, use_container_width=True)
+                with _trace_buffer()["lock"]: spans = list(_trace_buffer()["spans"])
+                st.download_button("⬇️ JSONL", "\n".join(json.dumps(sp, ensure_ascii=False, default=str) for sp in spans),
+                                   file_name="spans.jsonl", use_container_width=True, key="dl_spans")
+                if st.checkbox("Prometheus metnini göster", key="show_prom"): st.code(prometheus_text(), language="text")
+
+        with st.expander("⏱️ Analiz Aşama Süreleri"):
+            if st.session_state.get("last_pipeline_timings"):
+                st.markdown("**Son analiz (bu oturum):**")
+                st.dataframe(pd.DataFrame(st.session_state.last_pipeline_timings).T, use_container_width=True)
+            runs = list(_pipeline_timings())
+            if runs:
+                durations = pd.DataFrame([{k: v["süre_ms"] for k, v in r.items()} for r in runs])
+                st.markdown(f"**Son {len(runs)} analiz (tüm oturumlar), ms:**")
+                st.dataframe(durations.describe(percentiles=[0.5, 0.95]).T[["count", "50%", "95%"]], use_container_width=True)
+            else: st.caption("Henüz analiz yok.")
+
+        with st.expander("🧪 Yerel Analitik Ölçümü"):
+            if st.button("▶️ Ölç", use_container_width=True, key="bench_levels_btn"):
+                st.metric("compute_levels (1000 kademe, 100 kurum)", f"{benchmark_levels():.2f} ms")
+
+        with st.expander("🧪 Akış Görüntüleme Ölçümü"):
+            if st.button("▶️ Ölç", use_container_width=True, key="bench_stream_btn"):
+                rows, info = benchmark_stream_render()
+                st.caption(f"Sentetik rapor: {info['karakter']:,} karakter, {info['parça']} parça")
+                st.dataframe(rows, use_container_width=True)
+
+        with st.expander("🧪 Görsel Ön İşleme Testi"):
+            bench_files = st.file_uploader("Örnek Görseller", type=["jpg","png","jpeg"], accept_multiple_files=True, key="bench_files")
+            if st.button("▶️ Ölç", use_container_width=True, key="bench_preprocess_btn"):
+                sample = [Image.open(f) for f in (bench_files or [])]
+                if not sample:
+                    sample = [i for c in ["Derinlik", "AKD", "Kademe", "Takas"] for h in st.session_state[f"pasted_{c}"] if (i := load_image(h)) is not None]
+                if sample: st.dataframe(benchmark_preprocess(sample), use_container_width=True)
+                else: st.info("Ölçüm için görsel yükleyin veya yapıştırın.")
+        st.markdown("---")
+
+    st.header("📲 Telegram Köprüsü")
+    tg_ticker = st.text_input("Hisse Kodu (TG):", api_ticker_input, key="tg_ticker_final").upper() 
+    col_t1, col_t2 = st.columns(2)
+    with col_t1:
+        if st.button("📉 Derinlik", key="tg_dr"): st.session_state.tg_img_derinlik = fetch_data_via_bridge(tg_ticker, "derinlik")
+    with col_t2:
+        if st.button("🏦 AKD", key="tg_akd"): st.session_state.tg_img_akd = fetch_data_via_bridge(tg_ticker, "akd")
+    col_t3, col_t4 = st.columns(2)
+    with col_t3:
+        if st.button("📊 Kademe", key="tg_kdm"): st.session_state.tg_img_kademe = fetch_data_via_bridge(tg_ticker, "kademe")
+    with col_t4:
+        if st.button("🌍 Takas", key="tg_tks"): st.session_state.tg_img_takas = fetch_data_via_bridge(tg_ticker, "takas")
+
+    st.markdown("---")
+    if st.button("🚪 Çıkış Yap", key="logout_btn"):
+        st.session_state.authenticated = False
+        st.rerun()
+
+    st.markdown("---")
+    st.header("𝕏 Tarayıcı")
+    raw_ticker = st.text_input("Kod:", api_ticker_input, key="x_ticker_input").upper()
+    clean_ticker = raw_ticker.replace("#", "").strip()
+    search_mode = st.radio("Tip:", ("🔥 Geçmiş", "⏱️ Canlı"), key="x_search_mode")
+    if search_mode == "🔥 Geçmiş":
+        s_date = st.date_input("Tarih", datetime.date.today(), key="x_date_input")
+        url = f"https://x.com/search?q={quote(f'#{clean_ticker} lang:tr until:{s_date + datetime.timedelta(days=1)} since:{s_date} min_faves:5')}&src=typed_query&f=top"
+        btn_txt = f"🔥 <b>{s_date}</b> Popüler"
+    else:
+        url = f"https://x.com/search?q={quote(f'#{clean_ticker} lang:tr')}&src=typed_query&f=live"
+        btn_txt = f"⏱️ Son Dakika"
+    st.markdown(f"""<a href="{url}" target="_blank" class="x-btn">{btn_txt}</a>""", unsafe_allow_html=True)
+
+# --- ANALYZE ---
+st.markdown("---")
+c1, c2 = st.columns([1, 1])
+MODEL_OPTIONS = {"gemini-2.5-flash": "🚀 Flash", "gemini-2.5-flash-lite": "⚡ Lite"}
+
+with c2:
+    st.markdown("##### 🛠️ Analiz Ayarları")
+    use_lite_model = st.checkbox("⚡ Lite Modeli Kullan (Daha Hızlı)", key="use_lite_model_checkbox", value=False)
+    race_start = st.checkbox("🏁 Hızlı Başlat (İlk parçayı 2 anahtarla yarıştır)", key="race_start_checkbox", value=False)
+    optimize_images = st.checkbox("🗜️ Görselleri Optimize Et (Kırp / Küçült / Kayıpsız WebP)", key="optimize_images_checkbox", value=True)
+    use_analysis_cache = st.checkbox("♻️ Aynı Girdiler İçin Önbelleği Kullan", key="analysis_cache_checkbox", value=True)
+    extract_tables_opt = st.checkbox("📋 Görselleri Tabloya Çevir (Bir kez okut, sonra tablo gönder)", key="extract_tables_checkbox", value=False)
+    map_reduce_opt = st.checkbox("🧩 Parçalı Analiz (Kategoriler ayrı anahtarlarla paralel, sonra Flash ile birleştir)", key="map_reduce_checkbox", value=False)
+    analysis_mode = st.radio(
+        "Analiz Modu Seçiniz:",
+        options=["⚡ SADE MOD (Öz ve Net)", "🛡️ DESTEK-DİRENÇ MODU (Özel Strateji)", "🧠 GELİŞMİŞ MOD (Ultra Detay - 50 Madde)"],
+        index=0
+    )
+    if "GELİŞMİŞ" in analysis_mode:
+        max_items = st.slider("Gelişmiş Mod Madde Sayısı", 10, 50, 20)
+
+with c1:
+    st.markdown("<br>", unsafe_allow_html=True)
+    if st.button("🐋 ANALİZİ BAŞLAT", type="primary", use_container_width=True):
+        if not api_keys:
+            st.error("❌ API Anahtar Havuzu Boş!")
+            st.stop()
+            
+        input_data = []
+        timer = PipelineTimer()
+        map_reduce = st.session_state.get("map_reduce_checkbox", False)
+        if map_reduce:
+            # Parçalar lite ile işlenir; birleştirme her zaman Flash
+            primary_model = "gemini-2.5-flash"
+            model_priority = ["gemini-2.5-flash", "gemini-2.5-flash-lite"]
+        elif st.session_state.get("use_lite_model_checkbox"):
+            primary_model = "gemini-2.5-flash-lite"
+            model_priority = ["gemini-2.5-flash-lite", "gemini-2.5-flash"]
+        else:
+            primary_model = "gemini-2.5-flash"
+            model_priority = ["gemini-2.5-flash", "gemini-2.5-flash-lite"] 
+
+        # Bağımsız aşamalar havuzda: API bağlamı, haberler, anahtar seçimi. Görseller ana thread'de.
+        api_sections = []
+        if api_depth_data: api_sections.append(("CANLI DERİNLİK API VERİSİ", api_depth_data))
+        if api_akd_data: api_sections.append(("CANLI AKD API VERİSİ", api_akd_data))
+        pool = _fetch_pool()
+        api_future = pool.submit(timer.timed("api_bağlam", serialize_market_context), api_sections) if api_sections and not map_reduce else None
+        news_future = pool.submit(timer.timed("haberler", fetch_stock_news), api_ticker_input) if NEWS_ENABLED else None
+        keys_future = pool.submit(timer.timed("anahtar_seçimi", prepare_candidates), api_keys, model_priority, working_key)
+        news_text = ""
+        api_ctx, table_ctx, levels_ctx, news_ctx = "", "", "", ""
+
+        image_store = get_image_store()
+        image_store.release(session_id())
+        image_digests = []
+        image_cats = {}
+        def add_imgs(cat, fl, pl, pl_hashes, tg_img):
+            added = False
+            sid = session_id()
+            digests = [image_store.add_file(f, sid) for f in (fl or [])]
+            for h, d in zip(pl, pl_hashes):
+                # Çözülmüş görsel ortak depoda varsa oturum deposuna hiç dokunulmaz
+                image_store.pin(sid, [d])
+                if image_store.get(d) is not None: digests.append(d)
+                elif (img := load_image(h)) is not None: digests.append(image_store.add(img, d, sid))
+            tg_image = open_blob_image(tg_img)
+            if tg_image is not None: digests.append(image_store.add(tg_image, owner=sid))
+            for d in digests:
+                added = True
+                if d not in image_digests:
+                    image_digests.append(d)
+                    image_cats[d] = cat
+            return added
+
+        with timer.stage("görsel_alım"):
+            has_d = add_imgs("Derinlik", img_d, st.session_state["pasted_Derinlik"], st.session_state["pasted_Derinlik_hashes"], st.session_state.tg_img_derinlik)
+            has_a = add_imgs("AKD", img_a, st.session_state["pasted_AKD"], st.session_state["pasted_AKD_hashes"], st.session_state.tg_img_akd)
+            has_k = add_imgs("Kademe", img_k, st.session_state["pasted_Kademe"], st.session_state["pasted_Kademe_hashes"], st.session_state.tg_img_kademe)
+            has_t = add_imgs("Takas", img_t, st.session_state["pasted_Takas"], st.session_state["pasted_Takas_hashes"], st.session_state.tg_img_takas)
+
+        tables = {}
+        cat_texts = {}
+        if st.session_state.get("extract_tables_checkbox") and image_digests:
+            with st.spinner("Görsellerden tablolar çıkarılıyor..."), timer.stage("tablo_çıkarımı"):
+                tables = extract_tables(image_cats, image_store, api_keys)
+            st.session_state.extracted_tables = {}
+            for d, df in tables.items():
+                table_txt = frame_to_prompt(df)
+                table_ctx += f"\n\n--- {image_cats[d].upper()} TABLOSU (görselden çıkarıldı) ---\n{table_txt}"
+                cat_texts[image_cats[d]] = (cat_texts.get(image_cats[d], "") + f"\n{table_txt}").strip()
+                st.session_state.extracted_tables.setdefault(image_cats[d], []).append(table_txt)
+            image_digests = [d for d in image_digests if d not in tables]
+
+        depth_src = api_depth_data
+        if depth_src is None:
+            depth_frames = [df for d, df in tables.items() if image_cats[d] == "Derinlik"]
+            if depth_frames: depth_src = pd.concat(depth_frames, ignore_index=True)
+        levels_txt = ""
+        if depth_src is not None or api_akd_data:
+            with timer.stage("yerel_analitik"):
+                try: levels_txt = render_levels(compute_levels(depth_src, api_akd_data))
+                except Exception: levels_txt = ""
+            if levels_txt:
+                levels_ctx = f"\n\n--- YEREL HESAPLANMIŞ SEVİYELER (KESİN) ---\n{levels_txt}"
+                st.caption(f"📐 Seviyeler yerelde hesaplandı ({timer.stages['yerel_analitik']['süre_ms']:.1f} ms)")
+        prep_cfg = PREPROCESS_CONFIG if st.session_state.get("optimize_images_checkbox", True) else PREPROCESS_LOSSLESS
+        with timer.stage("görsel_ön_işleme"):
+            try: image_store.prepare_many(image_digests, prep_cfg)
+            except LookupError as e: st.error(f"Görseller hazırlanamadı: {e}"); st.stop()
+
+        if api_future is not None:
+            api_text, api_stats = api_future.result()
+            api_ctx = f"\n\n{api_text}"
+            st.caption(f"🧾 API verisi: ~{api_stats['before']} → ~{api_stats['after']} token" + (f" ({api_stats['dropped']} satır bütçe için atıldı)" if api_stats['dropped'] else ""))
+        if news_future is not None:
+            with st.spinner("Haberler taranıyor..."):
+                news_text = news_future.result()
+            news_ctx = f"\n\n--- HABERLER ({api_ticker_input}) ---\n{news_text}"
+        if st.session_state.get("api_akd_range"):
+            range_txt = render_akd_range(st.session_state.api_akd_range[1], st.session_state.api_akd_range[0])
+            if range_txt: levels_ctx += f"\n\n--- ÇOK GÜNLÜ AKD (yerel toplam, KESİN) ---\n{range_txt}"
+        compare_ts = st.session_state.get("snapshot_compare")
+        if compare_ts:
+            store = get_snapshot_store()
+            diff_txt = "\n\n".join(filter(None, (render_snapshot_diff(store.diff(api_ticker_input, kind, compare_ts), kind) for kind in ("derinlik", "akd"))))
+            if diff_txt: levels_ctx += f"\n\n--- GÜN İÇİ DEĞİŞİM (kayıtlı görüntülerden) ---\n{diff_txt}"
+        context_str = api_ctx + table_ctx + levels_ctx + news_ctx
+        fallback_digests = []
+        if map_reduce:
+            for cat, title, data in (("Derinlik", "CANLI DERİNLİK API VERİSİ", api_depth_data),
+                                     ("AKD", "CANLI AKD API VERİSİ", api_akd_data)):
+                if data: cat_texts[cat] = (serialize_market_context([(title, data)])[0] + "\n\n" + cat_texts.get(cat, "")).strip()
+            groups = {}
+            for d in image_digests: groups.setdefault(image_cats[d], []).append(d)
+            map_status, map_done = st.empty(), []
+            def on_map_done(cat, cached):
+                map_done.append(cat + (" ⚠️" if cached is None else " ♻️" if cached else ""))
+                map_status.caption(f"🧩 Parçalar: {', '.join(map_done)}")
+            with st.spinner("Kategoriler paralel analiz ediliyor..."), timer.stage("parça_analizi"):
+                try:
+                    partials = run_category_map(groups, image_store, prep_cfg, api_keys, cat_texts,
+                                                use_cache=st.session_state.get("analysis_cache_checkbox", True), on_done=on_map_done)
+                except KeyUnavailable:
+                    st.error("Parça analizleri için kullanılabilir anahtar yok."); st.stop()
+            failed = [c for c, txt in partials.items() if txt is None]
+            if failed: st.warning(f"⚠️ Ön analiz alınamadı, veri doğrudan gönderilecek: {', '.join(failed)}")
+            fallback_digests = [d for c in failed for d in groups.get(c, [])]
+            fallback_ctx = "".join(f"\n\n--- {c.upper()} VERİSİ ---\n{cat_texts[c]}" for c in failed if cat_texts.get(c))
+            context_str = "\n\n" + render_partials(partials) + fallback_ctx + levels_ctx + news_ctx
+        timer.mark("bağlam_hazır")
+        
+        is_depth_avail = has_d or api_depth_data
+        is_akd_avail = has_a or api_akd_data
+        is_kademe_avail = has_k
+        is_takas_avail = has_t
+        
+        levels_rule = ("7. 📐 **HAZIR HESAP:** 'YEREL HESAPLANMIŞ SEVİYELER' bölümündeki sıralama, sınıflandırma, pivot, gap ve balina (🐋) "
+                       "işaretleri kesindir. Bunları yeniden hesaplama; sadece yorumla ve anlat.") if levels_txt else ""
+        merge_rule = ("8. 🧩 **ÖN ANALİZLER:** Veri seti kategori bazlı 'ÖN ANALİZ' bölümlerinden oluşuyor. Bunları aşağıdaki rapor başlıklarına "
+                      "birleştir; rakamları aynen kullan, kategoriler arası çelişki varsa belirt.") if map_reduce else ""
+        base_role = f"""
+        Sen Borsa Uzmanısın ve Kıdemli Veri Analistisin.
+        GÖREV: SADECE sana sağlanan görselleri ve verileri kullanarak analiz yap.
+        🚨 Hisse kodunu görselden veya veriden tespit et.
+        --- MEVCUT VERİ SETİ ---
+        {context_str}
+        --- ⚠️ KRİTİK KURALLAR ---
+        1. 🚫 **YASAK:** Elimizde verisi olmayan başlıkları rapora ekleme.
+        2. 🚫 **YASAK:** Giriş cümlesi yazma. Direkt analize başla.
+        3. 🎨 **RENK:** :green[**OLUMLU**], :blue[**NÖTR**], :red[**OLUMSUZ**] cümlelerin yanına ekle.
+        4. 🚫 **YASAK:** Listeyi doldurmak için aynı satırı tekrarlama. Sadece gördüğün kadarını yaz.
+        5. ⚠️ **DİKKAT:** Tablodaki "Fiyat" (TL) ve "Lot/Adet" (Volume) sütunlarını karıştırma. Genellikle "Lot" sütunu daha büyük tam sayılar içerir.
+        6. 🧠 **MANTIK VE FİYAT KONTROLÜ (ÇOK ÖNEMLİ):**
+           - Önce görseldeki **ANLIK FİYATI** (Current Price) tespit et.
+           - **KURAL 1:** Anlık fiyattan **YÜKSEK** olan emirler **SATIŞ (DİRENÇ)** emirleridir. (Asla bunlara 'Alış' deme!)
+           - **KURAL 2:** Anlık fiyattan **DÜŞÜK** olan emirler **ALIŞ (DESTEK)** emirleridir.
+           - ÖRNEK: Fiyat 22.58 ise, 22.90'daki yığılma **SATIŞ (DİRENÇ)** olur. 22.10'daki yığılma **ALIŞ (DESTEK)** olur. Bunu karıştırma!
+        {levels_rule}
+        {merge_rule}
+        """
+        
+        destek_direnc_prompt_sade = """
+        ## 🛡️ GÜÇLÜ/ZAYIF DESTEK VE DİRENÇ ANALİZİ
+        (GÖREV: SADECE VERİDE GÖRDÜĞÜN, "BALİNA GİRİŞİ" OLAN ÖNEMLİ SEVİYELERİ YAZ.)
+        (DİKKAT: 15 adet yazmak zorunda DEĞİLSİN. Eğer sadece 3 tane varsa, 3 tane yaz.)
+        (EĞER bir seviyede AŞIRI YÜKSEK LOT (Balina) varsa yanına "🔥 :green[**ÇOK GÜÇLÜ ALIM**]" veya "🔥 :red[**ÇOK GÜÇLÜ SATIM**]" yaz. Yoksa sadece fiyatı bırak.)
+        (Hatırlatma: Güncel fiyattan YÜKSEK olanlar SATIŞ/DİRENÇ, DÜŞÜK olanlar ALIŞ/DESTEK'tir.)
+        (FORMAT: **[FİYAT]**: [NEDENİ - Lot miktarı vs.] [VARSA GÜÇ İBARESİ])
+        """
+        
+        guc_siralama_prompt = """
+        ## 🏅 GÜÇ VE ÖNEM SIRALAMASI
+        (Bulduğun seviyeleri, ÖNEM sırasına göre diz. En çok lot olandan en aza doğru.)
+        (Sadece tespit edebildiğin kadarını yaz, listeyi zorlama.)
+        * **DESTEKLER (Güçlüden Zayıfa):** [Fiyat] ...
+        * **DİRENÇLER (Güçlüden Zayıfa):** [Fiyat] ...
+        """
+
+        if "SADE" in analysis_mode:
+            req_sections = ""
+            if is_depth_avail: req_sections += """\n## 💹 DERİNLİK ANALİZİ (EN AZ 5 MADDE)\n"""
+            if is_akd_avail: req_sections += """\n## 🤵 AKD ANALİZİ (EN AZ 5 MADDE)\n"""
+            if is_kademe_avail: req_sections += """\n## 📊 KADEME ANALİZİ (EN AZ 5 MADDE)\n"""
+            if is_takas_avail: req_sections += """\n## 🌍 TAKAS ANALİZİ (EN AZ 5 MADDE)\n"""
+
+            prompt = base_role + f"""
+            --- ⚡ SADE MOD ---
+            {req_sections}
+            {destek_direnc_prompt_sade}
+            ## 🐋 GENEL SENTEZ
+            ## 7. 🧭 YÖN / FİYAT OLASILIĞI
+            ## 8. 💯 SKOR KARTI
+            ## 9. 🚀 İŞLEM PLANI
+            """
+        elif "DESTEK" in analysis_mode:
+            prompt = base_role + f"""
+            --- 🛡️ DESTEK-DİRENÇ VE SEVİYE ANALİZİ MODU ---
+            GÖREV: Bu modda SADECE kritik fiyat seviyelerine odaklan.
+            
+            ## 🧱 KRİTİK DESTEK BÖLGELERİ (Mevcut Olanlar)
+            (Hatırlatma: Güncel fiyattan DÜŞÜK olanlar DESTEKTİR.)
+            1. **[FİYAT]**: [NEDENİ]
+            ... (Sadece olan kadar yaz)
+
+            ## 🚧 KRİTİK DİRENÇ BÖLGELERİ (Mevcut Olanlar)
+            (Hatırlatma: Güncel fiyattan YÜKSEK olanlar DİRENÇTİR.)
+            1. **[FİYAT]**: [NEDENİ]
+            ... (Sadece olan kadar yaz)
+
+            {guc_siralama_prompt}
+            
+            ## ⚖️ KİLİT RAKAM (PİVOT)
+            ## 📉 GAP (BOŞLUK) ANALİZİ
+            ## 🚀 ALIM-SATIM STRATEJİSİ
+            """
+        else:
+            limit_txt = f"(DİKKAT: SADECE VERİDE OLANLARI YAZ, UYDURMA.)"
+            main_headers = ""
+            if is_depth_avail: main_headers += f"## 📸 DERİNLİK ANALİZİ {limit_txt}\n"
+            if is_akd_avail: main_headers += f"## 🏦 AKD ANALİZİ {limit_txt}\n"
+            if is_kademe_avail: main_headers += f"## 📊 KADEME ANALİZİ {limit_txt}\n"
+            if is_takas_avail: main_headers += f"## 🌍 TAKAS ANALİZİ {limit_txt}\n"
+
+            prompt = base_role + f"""
+            --- 🧠 GELİŞMİŞ MOD ---
+            {main_headers}
+            {destek_direnc_prompt_sade}
+            --- 🕵️‍♂️ MİKRO-YAPISAL ANALİZ (50 MADDE KONTROLÜ) ---
+            (Mevcut listeden sadece cevabı olanları yaz)
+            --- FİNAL ---
+            ## 🐋 GENEL SENTEZ
+            ## 🧭 YÖN / FİYAT OLASILIĞI
+            ## 💯 SKOR KARTI
+            ## 🚀 İŞLEM PLANI
+            """
+
+        with timer.stage("bütçe_planı"):
+            plan = fit_request(fallback_digests if map_reduce else image_digests, image_cats, image_store, [prompt], prep_cfg)
+        if not map_reduce: image_digests = plan["digests"]
+        est = plan["estimate"]
+        st.caption(f"📦 İstek: ~{est['bytes'] / 1048576:.1f} MB, ~{est['tokens']:,} token" + (f" ({', '.join(plan['steps'])})" if plan["steps"] else ""))
+        if plan["split"]:
+            with st.spinner(f"Veri {len(plan['split'])} parçada ön analiz ediliyor..."), timer.stage("parça_analizi"):
+                try:
+                    partials = run_category_map(plan["split"], image_store, plan["config"], api_keys,
+                                                use_cache=st.session_state.get("analysis_cache_checkbox", True))
+                except KeyUnavailable:
+                    st.error("Parça analizleri için kullanılabilir anahtar yok."); st.stop()
+            failed = [c for c, txt in partials.items() if txt is None]
+            input_data.append(render_partials(partials))
+            if failed:
+                st.warning(f"⚠️ Ön analiz alınamadı, görseller doğrudan gönderilecek: {', '.join(failed)}")
+                input_data.extend(image_store.prepare_many([d for c in failed for d in plan["split"][c]], plan["config"]))
+        else:
+            if not plan["fits"]: st.warning("⚠️ İstek bütçeyi aşıyor; yanıt yavaş olabilir veya reddedilebilir.")
+            input_data.extend(plan["parts"])
+        input_data.append(prompt)
+        
+        count = 0
+        if has_d: count += 1
+        if has_a: count += 1
+        if has_k: count += 1
+        if has_t: count += 1
+        
+        if count == 0 and not context_str:
+            st.warning("⚠️ Lütfen analiz için veri yükleyin.")
+        else:
+            placeholder = st.empty()
+            full_response = ""
+            
+            use_cache = st.session_state.get("analysis_cache_checkbox", True)
+            cache_key = analysis_fingerprint(
+                image_digests, [api_depth_data, api_akd_data], news_text,
+                analysis_mode, max_items if "GELİŞMİŞ" in analysis_mode else None, primary_model, prompt)
+            cached = get_analysis_cache().get(cache_key) if use_cache else None
+            if cached:
+                placeholder.markdown(cached["result"])
+                st.caption(f"⚡ Önbellekten ({MODEL_OPTIONS.get(cached['model'], cached['model'])}, {time.strftime('%H:%M', time.localtime(cached['created']))})")
+                st.session_state.analysis_result = cached["result"]
+                st.session_state.loaded_count = count
+                timer.mark("önbellek_yanıtı")
+            else:
+                with st.spinner(f"Analiz ({MODEL_OPTIONS.get(primary_model, primary_model)}) ile Başlatılıyor..."):
+                    stream_active = False
+                    candidates, prebound = keys_future.result()
+                    failed_models = {}
+                    renderer = StreamRenderer(placeholder)
+                    attempts = 0
+                    while candidates and not stream_active:
+                        attempts += 1
+                        batch = [candidates.pop(0)]
+                        if st.session_state.get("race_start_checkbox") and candidates:
+                            rival = next((c for c in candidates if c[0] != batch[0][0]), candidates[0])
+                            candidates.remove(rival)
+                            batch.append(rival)
+                        try:
+                            open_t0 = time.perf_counter()
+                            k, model_name, stream, first_chunk = open_first_stream(batch, input_data, prebound)
+                            timer.mark("ilk_parça")
+                            span_attrs = {"key": key_fingerprint(k), "model": model_name, "retries": attempts - 1}
+                            record_span("analiz_ilk_parça", time.perf_counter() - open_t0, **span_attrs)
+                            st.session_state.active_working_key = k
+                            working_key = k
+                            stream_active = True
+
+                            if first_chunk is not None: renderer.feed(first_chunk.text)
+                            last_chunk = first_chunk
+                            for chunk in stream:
+                                last_chunk = chunk
+                                renderer.feed(chunk.text)
+                            
+                            full_response = renderer.finish()
+                            timer.mark("akış_sonu")
+                            usage = getattr(last_chunk, "usage_metadata", None)
+                            record_span("analiz_akış", time.perf_counter() - open_t0, chars=len(full_response),
+                                        prompt_tokens=getattr(usage, "prompt_token_count", None),
+                                        output_tokens=getattr(usage, "candidates_token_count", None),
+                                        render_msgs=renderer.stats["mesaj"], render_bytes=renderer.stats["bayt"], **span_attrs)
+                            st.session_state.analysis_result = full_response
+                            st.session_state.loaded_count = count
+                            # Anahtar istenen modele göre; yedek model yanıtladıysa önbelleğe yazılmaz
+                            if use_cache and model_name == primary_model:
+                                get_analysis_cache().put(cache_key, full_response, model_name, analysis_ttl())
+                            time.sleep(1)
+                        except KeyUnavailable as e:
+                            for k, model_name in batch:
+                                failed_models[k] = failed_models.get(k, 0) + 1
+                                if failed_models[k] == len(model_priority):
+                                    st.warning(f"⚠️ Anahtar `...{k[-4:]}` {'dolu' if e.kind == 'quota' else 'geçersiz'}.")
+                                    invalidate_model(k)
+                            continue
+                        except Exception as e:
+                            kind = classify_key_error(e)
+                            if stream_active and kind:
+                                # Akış ortasında kota düştü: sıradaki adaydan baştan başla
+                                record_key_result(k, model_name, False, error_kind=kind)
+                                stream_active = False
+                                full_response = ""
+                                renderer.reset()
+                                continue
+                            st.error(f"Hata: {e}"); break
+                    if not stream_active: st.error("Tüm kotalar dolu.")
+            st.session_state.last_pipeline_timings = timer.finish()
+
+if st.session_state.analysis_result:
+    st.markdown("## 🐋 Kurumsal Rapor")
+    st.markdown(st.session_state.analysis_result)
+    st.markdown("---")
+    st.subheader("💬 Analist ile Sohbet")
+    
+    col_c1, col_c2 = st.columns([1, 4])
+    with col_c1:
+        st.markdown("**Mod:**")
+        chat_scope = st.radio("M", ("📝 RAPOR", "🌍 GENEL"), label_visibility="collapsed")
+
+    for m in st.session_state.messages:
+        with st.chat_message(m["role"]): st.markdown(m["content"])
+
+    if q := st.chat_input("Soru sor..."):
+        st.session_state.messages.append({"role": "user", "content": q})
+        with st.chat_message("user"): st.markdown(q)
+
+        with st.chat_message("assistant"):
+            local_keys = api_keys.copy()
+            if st.session_state.active_working_key and st.session_state.active_working_key in local_keys:
+                local_keys.remove(st.session_state.active_working_key)
+                local_keys.insert(0, st.session_state.active_working_key)
+            
+            key_found = False
+            full_resp = ""
+            report_index = get_report_index(st.session_state.analysis_result)
+            final_prompt = build_chat_prompt(report_index, st.session_state.messages[:-1], q, chat_scope)
+            for k in local_keys:
+                try:
+                    chat_t0 = time.perf_counter()
+                    stream = bound_model(k, valid_model_name).generate_content(final_prompt, stream=True)
+                    st.session_state.active_working_key = k 
+                    key_found = True
+                    chat_attrs = {"key": key_fingerprint(k), "model": valid_model_name, "prompt_chars": len(final_prompt)}
+                    def parser():
+                        first = True
+                        for ch in stream:
+                            if first:
+                                record_span("sohbet_ilk_parça", time.perf_counter() - chat_t0, **chat_attrs)
+                                first = False
+                            if ch.text: yield ch.text
+                    resp = st.write_stream(parser)
+                    record_span("sohbet_akış", time.perf_counter() - chat_t0, chars=len(resp), **chat_attrs)
+                    full_resp = resp
+                    time.sleep(1)
+                    break 
+                except Exception as e:
+                    error_str = str(e).lower()
+                    if "429" in error_str or "quota" in error_str:
+                        invalidate_model(k)
+                        continue 
+                    elif "expired" in error_str or "invalid" in error_str:
+                        invalidate_model(k)
+                        continue
+                    else: break 
+            
+            if key_found: st.session_state.messages.append({"role": "assistant", "content": full_resp})
+            else: st.error("❌ Sohbet Hatası")
+
+
+
@@ -0,0 +1,61 @@
+"""app.py bir Streamlit betiği olduğundan içe aktarılamaz; testler için yalnızca
+modül düzeyindeki import, sabit (BÜYÜK_HARF), fonksiyon ve sınıf tanımları yüklenir.
+Streamlit yerine önbellek dekoratörlerini taklit eden küçük bir sahte modül konur."""
+import ast
+import os
+import types
+
+import pytest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def _fake_streamlit():
+    st = types.SimpleNamespace(session_state={}, secrets={})
+
+    def cache_resource(func=None, **_):
+        def wrap(f):
+            memo = {}
+
+            def inner(*args):
+                if args not in memo: memo[args] = f(*args)
+                return memo[args]
+            return inner
+        return wrap(func) if func else wrap
+    st.cache_resource = st.cache_data = cache_resource
+    return st
+
+
+def _is_constant(node):
+    targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+    return all(isinstance(t, ast.Name) and t.id.lstrip("_").isupper() for t in targets)
+
+
+def _is_import_guard(node):
+    """try: import x; X_ENABLED = True / except ImportError: ... biçimindeki opsiyonel bağımlılık blokları"""
+    return isinstance(node, ast.Try) and all(
+        isinstance(h.type, ast.Name) and h.type.id == "ImportError" for h in node.handlers)
+
+
+def load_app(tmp_dir):
+    os.environ.setdefault("SNAPSHOT_DIR", os.path.join(tmp_dir, "snapshots"))
+    os.environ.setdefault("SESSION_SPILL_DIR", os.path.join(tmp_dir, "spill"))
+    os.environ.setdefault("AKD_CACHE_DB", os.path.join(tmp_dir, "akd.sqlite3"))
+    os.environ.setdefault("ANALYSIS_CACHE_DB", os.path.join(tmp_dir, "analysis.sqlite3"))
+    os.environ.setdefault("BRIDGE_BLOB_DIR", os.path.join(tmp_dir, "blobs"))
+    tree = ast.parse(open(APP_PATH, encoding="utf-8").read())
+    ns = {"__name__": "app_under_test", "st": _fake_streamlit()}
+    for node in tree.body:
+        keep = isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef)) or \
+            (isinstance(node, (ast.Assign, ast.AnnAssign)) and _is_constant(node)) or _is_import_guard(node)
+        if not keep: continue
+        if isinstance(node, (ast.Import, ast.ImportFrom)) and any(a.name.startswith("streamlit") for a in node.names): continue
+        if isinstance(node, ast.ImportFrom) and (node.module or "").startswith("streamlit"): continue
+        try: exec(compile(ast.Module([node], []), APP_PATH, "exec"), ns)
+        except ImportError: pass  # Opsiyonel bağımlılıklar (genai, firebase...) testlerde gerekmez
+    return types.SimpleNamespace(**ns)
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    return load_app(str(tmp_path_factory.mktemp("app")))
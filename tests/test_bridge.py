@@ -0,0 +1,89 @@
+"""Köprü, süreç içi taşıyıcı (LocalBridgeTransport) ve taklit bir PC tarafı ile"""
+import base64
+import hashlib
+import io
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+
+def _png():
+    buf = io.BytesIO()
+    Image.new("RGB", (40, 20), (60, 200, 90)).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def _fake_pc(transport, delays=(0.1, 0.15)):
+    """bridge.py gibi: pending isteği görünce processing, sonra completed + görsel yazar"""
+    image = _png()
+    seen = []
+
+    def work():
+        time.sleep(delays[0])
+        transport.update("bridge/request", {"status": "processing"})
+        time.sleep(delays[1])
+        transport.update("bridge/request", {"status": "completed", "result": {"image_base64": base64.b64encode(image).decode()}})
+
+    def on_change(value):
+        if value and value.get("status") == "pending" and not seen:
+            seen.append(value)
+            threading.Thread(target=work, daemon=True).start()
+    transport.listen("bridge/request", on_change)
+    return image
+
+
+class _Recording:
+    """Taşıyıcıyı sarar: uygulamanın dinleyicisine giden her durumu kaydeder"""
+    def __init__(self, inner, listen=True):
+        self.inner, self.statuses, self.can_listen = inner, [], listen
+
+    def __getattr__(self, name): return getattr(self.inner, name)
+
+    def listen(self, path, callback):
+        if not self.can_listen: raise RuntimeError("dinleyici yok")
+        def wrapped(value):
+            self.statuses.append((value or {}).get("status"))
+            callback(value)
+        return self.inner.listen(path, wrapped)
+
+
+@pytest.fixture
+def legacy(app, monkeypatch):
+    monkeypatch.setitem(app._run_bridge_job.__globals__, "BRIDGE_PROTOCOL", "legacy")
+    return app
+
+
+def test_listener_wakes_on_each_status_change(legacy):
+    app = legacy
+    transport = _Recording(app.LocalBridgeTransport())
+    image = _fake_pc(transport.inner)
+    job = {"status": "pending"}
+    digest = app._run_bridge_job(transport, "THYAO", "derinlik", 5, job)
+
+    assert digest == hashlib.sha256(image).hexdigest()
+    assert app.open_blob_image(digest).size == (40, 20)
+    assert transport.statuses == ["pending", "processing", "completed"]
+    m = job["metrics"]
+    assert (m["mode"], m["reads"], m["status"]) == ("listen", 0, "completed")
+    assert 0.08 <= m["pending_to_processing"] < 0.4
+    assert 0.13 <= m["processing_to_completed"] < 0.45
+    assert m["total"] < 0.7                         # tamamlanınca beklemeden uyanır
+    assert app._bridge_metrics()[-1] is m
+
+
+def test_polls_when_listener_unavailable(legacy):
+    app = legacy
+    transport = _Recording(app.LocalBridgeTransport(), listen=False)
+    _fake_pc(transport.inner, delays=(0.05, 0.05))
+    job = {"status": "pending"}
+    assert app._run_bridge_job(transport, "ASELS", "akd", 5, job)
+    m = job["metrics"]
+    assert m["mode"] == "poll" and m["reads"] >= 2 and m["status"] == "completed"
+
+
+def test_timeout_reports_noresponse(legacy):
+    job = {"status": "pending"}
+    assert legacy._run_bridge_job(legacy.LocalBridgeTransport(), "PGSUS", "derinlik", 0.3, job) is None
+    assert job["metrics"]["status"] == "noresponse"
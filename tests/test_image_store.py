@@ -0,0 +1,22 @@
+import pytest
+from PIL import Image
+
+
+def _img(i):
+    return Image.new("RGB", (10, 10), (i * 40, 0, 0))
+
+
+def test_pinned_images_survive_other_uploads(app):
+    store = app.ImageStore(max_bytes=3 * 300)
+    mine = [store.add(_img(i), owner="oturum-a") for i in range(5)]
+    store.add(_img(6), owner="oturum-b")          # başka oturumun yüklemesi
+    assert len(store.prepare_many(mine)) == 5
+    store.release("oturum-a")
+    assert store.stats()["items"] <= 3
+
+
+def test_evicted_digest_raises_instead_of_dropping(app):
+    store = app.ImageStore(max_bytes=3 * 300)
+    digests = [store.add(_img(i)) for i in range(5)]
+    with pytest.raises(LookupError):
+        store.prepare_many(digests)
@@ -0,0 +1,45 @@
+"""Elle hesaplanmış altın veri: 6+6 kademeli derinlik (44,80'de GAP, 45,12'de 25.000 lotluk balina)
+ve 10 kurumluk AKD. Lotlar API'deki gibi Türkçe binlik ayraçlı metin."""
+import json
+import os
+
+import pytest
+
+GOLDEN = json.load(open(os.path.join(os.path.dirname(__file__), "fixtures", "golden_levels.json"), encoding="utf-8"))
+EXP = GOLDEN["expected"]
+
+
+def _rows(rows):
+    return [[round(p, 2), int(l), bool(w)] for p, l, w in rows]
+
+
+def test_normalize_depth(app):
+    book, last = app.normalize_depth(GOLDEN["depth"])
+    assert last == 45.2 and len(book) == 12
+    assert book["lot"].sum() == 47800
+    assert book.loc[book["side"] == "alış", "lot"].sum() == 36100
+
+
+def test_normalize_akd(app):
+    akd = app.normalize_akd(GOLDEN["akd"])
+    assert akd["net"].tolist() == [100000, 40000, -10000, -30000, 0, 2000, -2000, 1000, 500, 300]
+    assert akd.loc[0, ["buy", "sell"]].tolist() == [120000, 20000]
+
+
+def test_depth_levels(app):
+    r, e = app.compute_levels(GOLDEN["depth"]), EXP["depth"]
+    assert r["price"] == e["price"] and r["key_level"] == e["key_level"]
+    assert _rows(r["supports"]) == e["supports"]
+    assert _rows(r["resistances"]) == e["resistances"]
+    assert [[round(a, 2), round(b, 2)] for a, b in r["gaps"]] == e["gaps"]
+    assert r["pivot"] == pytest.approx(e["pivot"], abs=1e-6)
+    assert r["imbalance"] == pytest.approx(e["imbalance"], abs=1e-6)
+
+
+def test_akd_levels(app):
+    r, e = app.compute_levels(akd_payload=GOLDEN["akd"]), EXP["akd"]
+    assert [list(x) for x in r["top_buyers"]] == e["top_buyers"]
+    assert [list(x) for x in r["top_sellers"]] == e["top_sellers"]
+    assert r["akd_whales"] == e["akd_whales"]
+    for k in ("buy_concentration", "sell_concentration", "hhi"):
+        assert r[k] == pytest.approx(e[k], abs=1e-6)
@@ -0,0 +1,33 @@
+import pytest
+
+
+class _Store:
+    def prepare_many(self, digests, config=None): return [{"mime_type": "image/png", "data": d.encode()} for d in digests]
+
+
+def _fake_generate(failures):
+    def generate(keys, models, contents, preferred_key=None, **kwargs):
+        cat = next(c for c in failures if c in contents[-1])
+        if failures[cat]: raise failures[cat]
+        return f"{cat} özeti"
+    return generate
+
+
+def test_failed_category_is_reported_not_raised(app, monkeypatch):
+    failures = {"Derinlik": None, "AKD": ValueError("yanıt engellendi"), "Takas": None}
+    monkeypatch.setitem(app.run_category_map.__globals__, "generate_with_pool", _fake_generate(failures))
+    done = []
+    groups = {"Derinlik": ["d1"], "AKD": ["a1"], "Takas": ["t1"]}
+    partials = app.run_category_map(groups, _Store(), None, ["map-key"], use_cache=False,
+                                    on_done=lambda c, cached: done.append((c, cached)))
+    assert partials == {"Derinlik": "Derinlik özeti", "AKD": None, "Takas": "Takas özeti"}
+    assert ("AKD", None) in done
+    text = app.render_partials(partials)
+    assert "TAKAS ÖN ANALİZİ" in text and "AKD" not in text
+
+
+def test_all_keys_unavailable_still_raises(app, monkeypatch):
+    err = app.KeyUnavailable("quota", "429")
+    monkeypatch.setitem(app.run_category_map.__globals__, "generate_with_pool", _fake_generate({"Derinlik": err, "AKD": err}))
+    with pytest.raises(app.KeyUnavailable):
+        app.run_category_map({"Derinlik": ["d1"], "AKD": ["a1"]}, _Store(), None, ["map-key"], use_cache=False)
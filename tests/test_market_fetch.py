@@ -0,0 +1,70 @@
+"""hisseplus yerine yerel HTTP sunucusu: birleştirme, eşzamanlılık ve yeniden deneme"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+
+class _Upstream(BaseHTTPRequestHandler):
+    hits, failures, active, peak = {}, {}, 0, 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        symbol = parse_qs(url.query)["sembol"][0]
+        key = (url.path.rsplit("/", 1)[-1], symbol)
+        cls = type(self)
+        with cls.lock:
+            cls.hits[key] = cls.hits.get(key, 0) + 1
+            cls.active += 1
+            cls.peak = max(cls.peak, cls.active)
+            fail = cls.failures.get(key, 0)
+            if fail: cls.failures[key] = fail - 1
+        time.sleep(0.2)
+        with cls.lock: cls.active -= 1
+        body = json.dumps({"sembol": symbol, "data": [{"alisFiyat": 22.5, "alisLot": 100}]}).encode()
+        self.send_response(503 if fail else 200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args): pass
+
+
+@pytest.fixture
+def upstream(app, monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Upstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setitem(app.fetch_endpoint.__globals__, "HISSEPLUS_BASE_URL", f"http://127.0.0.1:{server.server_port}/api/v1")
+    _Upstream.hits.clear(); _Upstream.failures.clear(); _Upstream.peak = 0
+    yield _Upstream
+    server.shutdown()
+
+
+def test_concurrent_requests_are_coalesced(app, upstream):
+    with ThreadPoolExecutor(6) as pool:
+        results = list(pool.map(lambda _: app.fetch_endpoint("COAL1", "derinlik"), range(6)))
+    assert upstream.hits == {("derinlik", "COAL1"): 1}
+    assert all(r == results[0] for r in results) and results[0]["sembol"] == "COAL1"
+    app.fetch_endpoint("COAL1", "derinlik")                 # TTL içinde önbellekten
+    assert upstream.hits[("derinlik", "COAL1")] == 1
+
+
+def test_endpoints_fetched_concurrently(app, upstream):
+    results, errors = app.fetch_market_data("PAR1")
+    assert errors == {} and set(results) == {"derinlik", "akd"}
+    assert upstream.peak == 2                               # iki uç aynı anda sunucuda
+
+
+def test_server_error_is_retried(app, upstream):
+    upstream.failures[("akd", "RETRY1")] = 1
+    data = app.fetch_endpoint("RETRY1", "akd")
+    assert data["sembol"] == "RETRY1" and upstream.hits[("akd", "RETRY1")] == 2
+    with app._trace_buffer()["lock"]:
+        span = [s for s in app._trace_buffer()["spans"] if s["name"] == "hisseplus" and s.get("symbol") == "RETRY1"][-1]
+    assert span["status"] == 200 and span["retries"] == 1
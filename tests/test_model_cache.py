@@ -0,0 +1,7 @@
+def test_invalidate_forces_rediscovery(app, monkeypatch):
+    calls = []
+    monkeypatch.setitem(app.get_model.__globals__, "_discover_model", lambda key: calls.append(key) or "gemini-2.5-flash")
+    assert app.get_model("model-cache-key") == "gemini-2.5-flash"
+    assert app.get_model("model-cache-key") == "gemini-2.5-flash" and len(calls) == 1
+    app.invalidate_model("model-cache-key")       # 429: key "modeli yok" sayılmamalı
+    assert app.get_model("model-cache-key") == "gemini-2.5-flash" and len(calls) == 2
@@ -0,0 +1,68 @@
+"""Kayıtlı Google News RSS örnekleri (tests/fixtures/news) ile haber önbelleği"""
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "news")
+
+
+@pytest.fixture
+def news(app, monkeypatch):
+    store = app._news_store()
+    with store["lock"]:
+        store["feeds"].clear()
+        store["headlines"].clear()
+    monkeypatch.setitem(app.fetch_news_entries.__globals__, "NEWS_FIXTURE_DIR", FIXTURES)
+    return app
+
+
+def test_headlines_deduplicated_across_symbols(news):
+    thy = news.fetch_news_entries("THYAO")
+    assert [i["title"] for i in thy] == ["THY ekim ayı yolcu sayısını açıkladı - Bloomberg HT",
+                                          "THYAO için KAP'a pay geri alım bildirimi - Foreks",
+                                          "Havacılık hisselerinde petrol fiyatı etkisi - Ekonomim"]
+    pgs = news.fetch_news_entries("PGSUS")
+    shared = [i for i in pgs if i["symbols"] == {"THYAO", "PGSUS"}]
+    assert len(shared) == 1 and shared[0] is thy[-1]        # tek kopya, iki sembol
+    assert len(news._news_store()["headlines"]) == 4
+    assert "[+PGSUS]" in news.fetch_stock_news("THYAO")
+
+
+class _Feed(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        symbol = parse_qs(urlparse(self.path).query)["q"][0].split()[0]
+        type(self).requests.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = open(os.path.join(FIXTURES, f"{symbol}.xml"), "rb").read()
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args): pass
+
+
+def test_not_modified_reuses_cached_entries(news, monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Feed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    g = news.fetch_news_entries.__globals__
+    monkeypatch.setitem(g, "NEWS_FIXTURE_DIR", None)
+    monkeypatch.setitem(g, "NEWS_RSS_URL", f"http://127.0.0.1:{server.server_port}/rss?q={{q}}")
+    _Feed.requests.clear()
+    try:
+        first = news.fetch_news_entries("PGSUS")
+        assert news.fetch_news_entries("PGSUS") == first          # TTL içinde istek yok
+        again = news.fetch_news_entries("PGSUS", force=True)      # koşullu GET -> 304
+    finally:
+        server.shutdown()
+    assert _Feed.requests == [None, '"v1"']
+    assert [i["title"] for i in again] == [i["title"] for i in first] and len(first) == 2
@@ -0,0 +1,22 @@
+from PIL import Image, ImageDraw
+
+
+def _colored_table():
+    img = Image.new("RGB", (600, 400), (18, 20, 28))
+    d = ImageDraw.Draw(img)
+    for i in range(10):
+        d.rectangle((20, 20 + i * 36, 280, 44 + i * 36), fill=(60, 200, 90))
+        d.rectangle((320, 20 + i * 36, 580, 44 + i * 36), fill=(220, 60, 60))
+    return img
+
+
+def test_default_keeps_bid_ask_colours(app):
+    assert not app.PREPROCESS_CONFIG["grayscale"]
+    row = app.benchmark_preprocess([_colored_table()])[0]
+    assert row["psnr_db"] > 40
+
+
+def test_benchmark_shows_grayscale_loss(app):
+    cfg = dict(app.PREPROCESS_CONFIG, grayscale=True)
+    row = app.benchmark_preprocess([_colored_table()], cfg)[0]
+    assert row["psnr_db"] < 25
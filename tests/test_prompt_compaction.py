@@ -0,0 +1,27 @@
+def _book(levels=60):
+    # Sıra API'deki gibi değil: lotlar fiyattan uzaklaştıkça büyür, en iyi kademeler en küçük lotlu
+    rows = [{"alisFiyat": round(299.75 - 0.25 * i, 2), "alisLot": 100 + 500 * i,
+             "satisFiyat": round(300.0 + 0.25 * i, 2), "satisLot": 100 + 500 * i} for i in range(levels)]
+    return {"sonFiyat": 299.9, "data": rows[::-1]}
+
+
+def test_depth_keeps_levels_nearest_price(app):
+    tables, _ = app.compact_payload(_book(), "DERİNLİK", top_n=25)
+    df = tables["data"]
+    assert len(df) == 25
+    assert 299.75 in df["alisFiyat"].tolist() and 300.0 in df["satisFiyat"].tolist()
+    bids = sorted(df["alisFiyat"], reverse=True)
+    assert bids == [round(299.75 - 0.25 * i, 2) for i in range(25)]   # merdivende delik yok
+
+
+def test_akd_still_ranked_by_lots(app):
+    payload = {"data": [{"kurum": f"K{i}", "alisLot": i * 10, "satisLot": 0, "ortFiyat": 300} for i in range(40)]}
+    tables, _ = app.compact_payload(payload, "AKD", top_n=5)
+    assert sorted(tables["data"]["kurum"]) == [f"K{i}" for i in range(35, 40)]
+
+
+def test_budget_trimming_drops_farthest_level(app):
+    full, _ = app.serialize_market_context([("DERİNLİK", _book())], budget_tokens=10 ** 6, top_n=25)
+    text, stats = app.serialize_market_context([("DERİNLİK", _book())], budget_tokens=app.estimate_tokens(full) // 2, top_n=25)
+    assert stats["dropped"] > 0
+    assert "299.75" in text and "300" in text
@@ -0,0 +1,40 @@
+import random
+
+from PIL import Image, ImageDraw
+
+
+def _table(seed, symbol):
+    """Koyu temalı, 25 satırlık derinlik tablosu ekran görüntüsü"""
+    rng = random.Random(seed)
+    img = Image.new("RGB", (900, 1000), (18, 20, 28))
+    d = ImageDraw.Draw(img)
+    d.text((20, 10), symbol, fill=(230, 230, 230))
+    for i in range(25):
+        y = 40 + i * 38
+        d.text((20, y), f"{rng.uniform(20, 25):.2f}", fill=(60, 200, 90))
+        d.text((200, y), f"{rng.randint(1000, 900000):,}".replace(",", "."), fill=(60, 200, 90))
+        d.text((500, y), f"{rng.uniform(25, 30):.2f}", fill=(220, 60, 60))
+        d.text((700, y), f"{rng.randint(1000, 900000):,}".replace(",", "."), fill=(220, 60, 60))
+    return img
+
+
+def _store(app, n):
+    store = app.ImageStore()
+    digests = [store.add(_table(i, "THYAO" if i % 2 else "PGSUS")) for i in range(n)]
+    return store, digests, {d: "Derinlik" for d in digests}
+
+
+def test_similar_tables_are_all_sent_within_budget(app):
+    store, digests, cats = _store(app, 5)
+    plan = app.fit_request(digests, cats, store, ["prompt"], app.PREPROCESS_CONFIG)
+    assert plan["fits"] and plan["dropped"] == [] and plan["split"] is None
+    assert plan["digests"] == digests and len(plan["parts"]) == 5
+
+
+def test_newest_per_category_only_when_over_budget(app):
+    store, digests, cats = _store(app, 5)
+    first = app.fit_request(digests, cats, store, ["prompt"], app.PREPROCESS_CONFIG)
+    budget = {"max_tokens": first["estimate"]["tokens"] - 1, "max_per_cat": 3}
+    plan = app.fit_request(digests, cats, store, ["prompt"], app.PREPROCESS_CONFIG, budget)
+    assert plan["digests"] == digests[-3:]
+    assert plan["dropped"] == digests[:2]
@@ -0,0 +1,39 @@
+import time
+
+MODELS = ["gemini-2.5-flash", "gemini-2.5-flash-lite"]
+
+
+def _keys(app, latencies):
+    keys = [f"sched-{i}" for i in range(len(latencies))]
+    for k, lat in zip(keys, latencies):
+        for m in MODELS: app.record_key_result(k, m, True, latency=lat)
+    return keys
+
+
+def test_preferred_key_spreads_load(app):
+    keys = _keys(app, [2.0, 3.5, 4.0, 6.0])
+    ranked = list(dict.fromkeys(k for k, _ in app.schedule_candidates(keys, MODELS)))
+    assert ranked == keys
+    firsts = [app.schedule_candidates(keys, MODELS, ranked[i % len(ranked)])[0] for i in range(8)]
+    assert [k for k, _ in firsts] == keys * 2
+    assert all(m == MODELS[0] for _, m in firsts)
+
+
+def test_cooling_preferred_key_is_skipped(app):
+    keys = _keys(app, [2.0, 3.5, 4.0, 6.0])
+    app.record_key_result(keys[2], MODELS[0], False, error_kind="quota")
+    order = app.schedule_candidates(keys, MODELS, keys[2])
+    assert order[0] == (keys[2], MODELS[1])        # aynı key'in diğer modeli soğumada değil
+    app.record_key_result(keys[2], MODELS[1], False, error_kind="quota")
+    order = app.schedule_candidates(keys, MODELS, keys[2])
+    assert order[0] == (keys[0], MODELS[0]) and order[-2:] == [(keys[2], MODELS[0]), (keys[2], MODELS[1])]
+
+
+def test_health_checker_forgets_deleted_keys(app, monkeypatch):
+    checker = app.KeyHealthChecker()
+    checker.register("oturum-a", ["k1", "k2", "k3"])
+    checker.register("oturum-b", ["k1"])
+    checker.register("oturum-a", ["k1", "k3"])          # k2 yönetici tarafından silindi
+    assert checker.active_keys() == ["k1", "k3"]
+    checker.keys["oturum-a"] = (checker.keys["oturum-a"][0], time.time() - app.SESSION_IDLE_TTL - 1)
+    assert checker.active_keys() == ["k1"]              # boşta kalan oturumun key'leri düşer
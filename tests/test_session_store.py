@@ -0,0 +1,45 @@
+import os
+
+
+def test_startup_only_removes_own_spill_files(app, tmp_path):
+    own = "a" * 64
+    (tmp_path / own).write_bytes(b"x")
+    (tmp_path / "notes.txt").write_text("keep")
+    (tmp_path / "sub").mkdir()
+    app.SessionStore(spill_dir=str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == ["notes.txt", "sub"]
+
+
+def test_spill_release_and_quota(app, tmp_path):
+    store = app.SessionStore(max_mem=3000, quota=6000, spill_dir=str(tmp_path))
+    handles = [store.put("a", os.urandom(1000)) for _ in range(5)]
+    assert store.stats()["mem_bytes"] == 3000 and store.stats()["disk_bytes"] == 2000
+    assert len(store.get(handles[0])) == 1000          # diskten geri okunur
+    store.put("b", store.get(handles[1]))               # iki oturum aynı bloğu paylaşır
+    try:
+        store.put("a", os.urandom(2000))
+        assert False, "kota aşılmalıydı"
+    except app.SessionQuotaExceeded:
+        pass
+    store.release_session("a")
+    assert store.stats()["blocks"] == 1 and store.get(handles[1]) is not None
+    assert store.get(handles[0]) is None
+
+
+def test_get_returns_none_when_spill_file_vanishes(app, tmp_path):
+    store = app.SessionStore(max_mem=1000, spill_dir=str(tmp_path))
+    first = store.put("a", os.urandom(1000))
+    store.put("a", os.urandom(1000))                    # ilk blok diske taşar
+    os.remove(tmp_path / first)
+    assert store.get(first) is None
+
+
+def test_same_image_in_two_categories_is_counted_per_use(app, tmp_path):
+    store = app.SessionStore(spill_dir=str(tmp_path))
+    data = os.urandom(500)
+    derinlik, akd = store.put("a", data), store.put("a", data)   # aynı görsel iki kategoriye yapıştırıldı
+    assert derinlik == akd and store.stats()["blocks"] == 1
+    store.release("a", derinlik)
+    assert store.get(akd) == data
+    store.release("a", akd)
+    assert store.get(akd) is None
@@ -0,0 +1,38 @@
+import time
+
+
+def _depth(lots):
+    return {"sonFiyat": 22.58, "data": [{"alisFiyat": round(22.5 - 0.02 * i, 2), "alisLot": lot,
+                                          "satisFiyat": round(22.6 + 0.02 * i, 2), "satisLot": 500}
+                                         for i, lot in enumerate(lots)]}
+
+
+def test_diff_skips_unchanged_levels(app, tmp_path):
+    store = app.SnapshotStore(str(tmp_path))
+    t0 = time.time() - 100
+    lots = [1000 * (i + 1) for i in range(10)]
+    store.append("THYAO", "derinlik", _depth(lots), t0)
+    lots[3] += 250
+    store.append("THYAO", "derinlik", _depth(lots), t0 + 50)
+
+    d, _, _ = store.diff("THYAO", "derinlik", t0 + 10)
+    assert len(d) == 1
+    row = d.iloc[0]
+    assert (row["side"], row["price"], row["önce"], row["sonra"], row["değişim"]) == ("alış", 22.44, 4000, 4250, 250)
+
+    text = app.render_snapshot_diff(store.diff("THYAO", "derinlik", t0 + 10), "derinlik")
+    assert "alış 22.44: 4,000 → 4,250 (+250)" in text
+
+
+def test_akd_diff_and_roundtrip(app, tmp_path):
+    store = app.SnapshotStore(str(tmp_path))
+    t0 = time.time() - 100
+    akd = lambda k: {"data": [{"kurum": "İŞ YATIRIM", "alis": 100 + k, "satis": 50}, {"kurum": "BofA", "alis": 10, "satis": 300}]}
+    assert store.append("ASELS", "akd", akd(0), t0)
+    assert not store.append("ASELS", "akd", akd(0), t0 + 1)   # aynı yanıt tekrar yazılmaz
+    assert store.append("ASELS", "akd", akd(40), t0 + 50)
+
+    _, frame, _ = store.at("ASELS", "akd")
+    assert frame.set_index("broker")["net"].to_dict() == {"İŞ YATIRIM": 90, "BofA": -290}
+    d, _, _ = store.diff("ASELS", "akd", t0 + 10)
+    assert d.to_dict("records") == [{"broker": "İŞ YATIRIM", "önce": 50.0, "sonra": 90.0, "değişim": 40.0}]
@@ -0,0 +1,35 @@
+import threading
+import time
+
+
+class _Stream:
+    def __init__(self, delay, chunks=5):
+        self.delay, self.chunks, self.cancelled, self.sent = delay, chunks, threading.Event(), 0
+
+    def __iter__(self):
+        time.sleep(self.delay)
+        for i in range(self.chunks):
+            if self.cancelled.is_set(): return
+            self.sent += 1
+            yield f"parça {i}"
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class _Model:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def generate_content(self, contents, stream=False):
+        return self.stream
+
+
+def test_loser_stream_is_cancelled(app):
+    fast, slow = _Stream(0.0), _Stream(0.2)
+    batch = [("key-a", "m"), ("key-b", "m")]
+    prebound = {batch[0]: _Model(fast), batch[1]: _Model(slow)}
+    key, _, it, first = app.open_first_stream(batch, "istem", prebound)
+    assert key == "key-a" and first == "parça 0"
+    assert list(it) == [f"parça {i}" for i in range(1, 5)]
+    assert slow.cancelled.wait(2) and slow.sent == 1
@@ -0,0 +1,45 @@
+def test_lot_thousands_with_single_dot(app):
+    df = app.rows_to_frame([{"price": "22,58", "lot": "12.500", "side": "Alış"},
+                            {"price": "22.60", "lot": "1.234.567", "side": "satış"},
+                            {"price": "22.62", "lot": "840", "side": "S"}])
+    assert df["price"].tolist() == [22.58, 22.6, 22.62]
+    assert df["lot"].tolist() == [12500, 1234567, 840]
+
+
+def test_price_keeps_single_dot_as_decimal(app):
+    assert app._parse_tr_number("12.500") == 12.5
+    assert app._parse_tr_number("12.500", integer=True) == 12500
+    assert app._parse_tr_number("1.234,5", integer=True) == 1234.5
+
+
+def test_normalize_depth_reads_grouped_lots(app):
+    book, last = app.normalize_depth({"sonFiyat": "22,58", "data": [{"alisFiyat": "22,56", "alisLot": "12.500",
+                                                                     "satisFiyat": "22,60", "satisLot": "3.000"}]})
+    assert last == 22.58
+    assert book.set_index("side")["lot"].to_dict() == {"alış": 12500, "satış": 3000}
+
+
+def test_extract_tables_uses_common_backend_interface(app):
+    calls = []
+
+    class StubBackend:
+        name = "stub"
+        def extract(self, blob, category, digest):
+            calls.append((category, digest))
+            return [{"price": "22,58", "lot": "12.500", "side": "alış"}]
+
+    class Store:
+        def prepare_many(self, digests, config=None): return [{"mime_type": "image/png", "data": b""} for _ in digests]
+
+    tables = app.extract_tables({"d1": "Derinlik"}, Store(), [], backend=StubBackend())
+    assert calls == [("Derinlik", "d1")]
+    assert tables["d1"]["lot"].tolist() == [12500]
+
+
+def test_frame_to_prompt_keeps_tick_precision(app):
+    df = app.rows_to_frame([{"price": "312,25", "lot": "12.500", "side": "alış"},
+                            {"price": "312,75", "lot": "800", "side": "satış"},
+                            {"price": "2502,5", "lot": "40", "side": "satış"}])
+    csv = app.frame_to_prompt(df)
+    for price in ("312.25,", "312.75,", "2502.5,"): assert price in csv
+    assert "12500" in csv